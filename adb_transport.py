@@ -0,0 +1,175 @@
+import re
+import threading
+import time
+import uuid
+
+from ppadb.connection import Connection
+
+# Direct ADB path for simple input and hierarchy dumps. Instead of going
+# client -> Appium HTTP -> UiAutomator2 server -> device, commands are written
+# to one long-lived `sh` per device, opened with the adb server's `exec:`
+# service, so each tap or key costs a single round trip on an open stream.
+# Callers fall back to Appium on AdbError.
+#
+# `uiautomator dump` can stall while Appium's UiAutomator2 instrumentation
+# holds the accessibility connection on some Android versions, so dumps are
+# not among the default operations.
+
+DEFAULT_OPERATIONS = ('tap', 'swipe', 'key')
+OPERATIONS = DEFAULT_OPERATIONS + ('dump',)
+DUMP_PATH = '/data/local/tmp/window_dump.xml'
+XML_START_RE = re.compile(r'<\?xml|<hierarchy')
+
+class AdbError(Exception):
+    pass
+
+def parse_operations(value):
+    # ADB_FAST_PATH: '' or '0' disables, '1' enables the defaults, else a
+    # comma-separated subset of OPERATIONS
+    value = (value or '').strip()
+    if value in ('', '0'):
+        return frozenset()
+    if value == '1':
+        return frozenset(DEFAULT_OPERATIONS)
+    operations = {operation.strip() for operation in value.split(',') if operation.strip()}
+    unknown = operations - set(OPERATIONS)
+    if unknown:
+        raise ValueError(f"Unknown ADB fast path operations: {', '.join(sorted(unknown))}")
+    return frozenset(operations)
+
+
+class AdbShell:
+    # A persistent shell on one device. Each command is followed by a marker
+    # line carrying its exit status, which delimits its output on the stream.
+    def __init__(self, serial=None, host='127.0.0.1', port=5037, timeout=30.0):
+        self.serial = serial
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.connection = None
+        self.buffer = b''
+        self.connects = 0
+
+    def connect(self):
+        connection = Connection(self.host, self.port, self.timeout)
+        try:
+            connection.connect()
+            connection.send(f"host:transport:{self.serial}" if self.serial else 'host:transport-any')
+            connection.send('exec:sh')
+        except Exception:
+            connection.close()
+            raise
+        self.connection = connection
+        self.buffer = b''
+        self.connects += 1
+
+    def run(self, command):
+        # Returns (exit status, output). A broken stream is reopened once.
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.connection is None:
+                        self.connect()
+                    return self.exchange(command)
+                except (OSError, RuntimeError, AdbError) as e:
+                    self.disconnect()
+                    if attempt:
+                        raise AdbError(f"adb shell failed: {str(e)}") from e
+
+    def exchange(self, command):
+        marker = f"__adb_{uuid.uuid4().hex[:12]}__"
+        self.connection.write(f"{command}; printf '\\n{marker}%d\\n' $?\n".encode('utf-8'))
+        end = f"\n{marker}".encode('ascii')
+        while True:
+            index = self.buffer.find(end)
+            if index >= 0:
+                newline = self.buffer.find(b'\n', index + len(end))
+                if newline >= 0:
+                    status = int(self.buffer[index + len(end):newline])
+                    output = self.buffer[:index].decode('utf-8', 'replace')
+                    self.buffer = self.buffer[newline + 1:]
+                    return status, output
+            chunk = self.connection.read(65536)
+            if not chunk:
+                raise AdbError('adb stream closed')
+            self.buffer += chunk
+
+    def disconnect(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        self.buffer = b''
+
+    def close(self):
+        with self.lock:
+            self.disconnect()
+
+
+class AdbTransport:
+    def __init__(self, serial=None, operations=DEFAULT_OPERATIONS, host='127.0.0.1', port=5037, timeout=30.0):
+        self.serial = serial
+        self.operations = frozenset(operations)
+        self.shell = AdbShell(serial, host, port, timeout)
+        self.stats_lock = threading.Lock()
+        self.calls = {}  # operation -> [count, failures, seconds]
+        self.size = None
+
+    def run(self, operation, command):
+        start = time.time()
+        try:
+            status, output = self.shell.run(command)
+            if status != 0:
+                raise AdbError(f"`{command}` exited with {status}: {output.strip()[:200]}")
+        except AdbError:
+            self.record(operation, start, failed=True)
+            raise
+        self.record(operation, start)
+        return output
+
+    def record(self, operation, start, failed=False):
+        with self.stats_lock:
+            entry = self.calls.setdefault(operation, [0, 0, 0.0])
+            entry[0] += 1
+            entry[1] += failed
+            entry[2] += time.time() - start
+
+    def tap(self, x, y):
+        self.run('tap', f"input tap {int(x)} {int(y)}")
+
+    def swipe(self, x1, y1, x2, y2, duration_ms=250):
+        self.run('swipe', f"input swipe {int(x1)} {int(y1)} {int(x2)} {int(y2)} {int(duration_ms)}")
+
+    def keyevent(self, keycode):
+        self.run('key', f"input keyevent {int(keycode)}")
+
+    def window_size(self):
+        # (width, height) of the display, for swipes; read once
+        if self.size is not None:
+            return self.size
+        output = self.run('size', 'wm size')
+        sizes = re.findall(r'(\d+)x(\d+)', output)
+        if not sizes:
+            raise AdbError(f"Unexpected `wm size` output: {output.strip()[:200]}")
+        width, height = sizes[-1]  # an override size is listed last
+        self.size = int(width), int(height)
+        return self.size
+
+    def dump(self):
+        # Window hierarchy in the same attribute format as Appium's page_source
+        output = self.run('dump', f"uiautomator dump {DUMP_PATH} >/dev/null && cat {DUMP_PATH}")
+        match = XML_START_RE.search(output)
+        if match is None:
+            raise AdbError(f"No hierarchy in dump output: {output.strip()[:200]}")
+        return output[match.start():].strip()
+
+    def stats(self):
+        with self.stats_lock:
+            calls = {operation: {'count': count, 'failures': failures,
+                                 'mean_seconds': seconds / count if count else 0.0}
+                     for operation, (count, failures, seconds) in self.calls.items()}
+        return {'serial': self.serial, 'operations': sorted(self.operations),
+                'connects': self.shell.connects, 'calls': calls}
+
+    def close(self):
+        self.shell.close()
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from appium import webdriver
 from appium.options.common import AppiumOptions
 from appium.webdriver.common.appiumby import AppiumBy
@@ -7,167 +7,522 @@ from selenium.webdriver.common.actions import interaction
 from selenium.webdriver.common.actions.action_builder import ActionBuilder
 from selenium.webdriver.common.actions.pointer_input import PointerInput
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.common.exceptions import TimeoutException, NoSuchElementException
 from selenium.webdriver.common.keys import Keys
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+import atexit
+import functools
+import subprocess
 import threading
 import json
 import uuid
 import os
 import time
-import xml.etree.ElementTree as ET
-from groq import Groq
-from functools import lru_cache
+from adb_transport import AdbError, AdbTransport, parse_operations
+from command_control import CommandCancelled, CommandControl, CommandQueue, cancelled_result
+from jobs import JobManager
+from llm_backends import ModelError, ModelResponseError, create_backend
+from metrics import MetricsRegistry
+from nav_graph import NavigationGraph, state_fingerprint
+from prediction_cache import PredictionCache, make_key
+from screen_xml import compress_screen, compress_xml
+from screen_diff import build_screen_context, lookup_bounds
+from single_flight import SingleFlight
+from screen_prune import estimate_tokens, omitted_hint, prune_screen
+from speculation import Speculator
+from step_verifier import retry_action, verify_step
+from stream_json import IncrementalJSONParser
+from driver_pool import DriverPool
+from ui_settle import SettleTracker, screen_package
+from trajectory_store import TrajectoryStore, find_anchor, screen_fingerprint
+from interaction_log import InteractionLogWriter
+from device_scheduler import Device, DeviceScheduler, discover_adb_devices, load_devices_from_config
 
 app = Flask(__name__)
 sessions = {}
 session_lock = threading.Lock()
+job_manager = JobManager(max_workers=int(os.environ.get('JOB_WORKERS', '8')))
+prediction_cache = PredictionCache(
+    maxsize=int(os.environ.get('PREDICTION_CACHE_SIZE', '512')),
+    ttl=float(os.environ.get('PREDICTION_CACHE_TTL', '3600')),
+    path=os.environ.get('PREDICTION_CACHE_PATH')
+)
+atexit.register(prediction_cache.save)
+model_backend = None
+model_backend_lock = threading.Lock()
+# Streamed predictions start the action as soon as its fields are in; the rest
+# of the response (description, screen_awareness) is read in the background
+# for the log, or dropped when STREAM_KEEP_TAIL=0
+stream_predictions_enabled = os.environ.get('STREAM_PREDICTIONS', '1') == '1'
+stream_keep_tail = os.environ.get('STREAM_KEEP_TAIL', '1') == '1'
+# While an action executes, the next step's prediction is requested for the
+# screen the action led to last time, and kept if the real screen matches
+speculation_enabled = os.environ.get('SPECULATIVE_PREDICTIONS', '0') == '1'
+speculator = Speculator(ThreadPoolExecutor(max_workers=int(os.environ.get('JOB_WORKERS', '8')),
+                                           thread_name_prefix='speculate'),
+                        max_transitions=int(os.environ.get('SPECULATION_MAX_TRANSITIONS', '1024')))
+stream_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('JOB_WORKERS', '8')),
+                                     thread_name_prefix='model-stream')
+# Identical predictions requested while one is in flight (same command,
+# screen and step) share that model call
+single_flight_enabled = os.environ.get('SINGLE_FLIGHT', '1') == '1'
+single_flight = SingleFlight()
+metrics = MetricsRegistry()
+step_phase_seconds = metrics.histogram(
+    'automation_step_phase_seconds', 'Time spent in each phase of a step',
+    ['phase', 'action_type', 'outcome'])
+command_seconds = metrics.histogram(
+    'automation_command_seconds', 'Wall-clock time of whole commands', ['status'],
+    buckets=(1, 2.5, 5, 10, 20, 30, 60, 120, 300))
+model_errors = metrics.counter('automation_model_errors_total', 'Model calls that failed after retries', ['kind'])
+json_parse_failures = metrics.counter('automation_json_parse_failures_total', 'Model responses that were not valid JSON')
+max_steps_exhausted = metrics.counter('automation_max_steps_exhausted_total', 'Commands that ran out of steps')
+sessions_started = metrics.counter('automation_sessions_started_total', 'Sessions started')
+sessions_ended = metrics.counter('automation_sessions_ended_total', 'Sessions ended', ['reason'])
+metrics.callback_gauge('automation_active_sessions', 'Sessions currently open', lambda: len(sessions))
+metrics.callback_gauge('automation_prediction_cache_hits', 'Prediction cache hits',
+                       lambda: prediction_cache.stats()['hits'])
+metrics.callback_gauge('automation_prediction_cache_misses', 'Prediction cache misses',
+                       lambda: prediction_cache.stats()['misses'])
+metrics.callback_gauge('automation_speculative_predictions', 'Speculative predictions by outcome',
+                       lambda: [({'outcome': outcome}, speculator.stats()[outcome])
+                                for outcome in ('started', 'hits', 'misses', 'errors', 'cancelled')], ['outcome'])
+metrics.callback_gauge('automation_speculative_wasted_tokens', 'Estimated tokens spent on discarded speculations',
+                       lambda: speculator.stats()['wasted_tokens'])
+metrics.callback_gauge('automation_coalesced_predictions', 'Model calls made (leaders) and shared (coalesced)',
+                       lambda: [({'role': role}, single_flight.stats()[role]) for role in ('leaders', 'coalesced')],
+                       ['role'])
+metrics.callback_gauge('automation_queue_depth', 'Commands waiting for a device',
+                       lambda: device_scheduler.status()['queue_depth'])
+metrics.callback_gauge('automation_device_utilization', 'Fraction of time each device ran a command',
+                       lambda: [({'device': device['udid']}, device['utilization'])
+                                for device in device_scheduler.status()['devices']], ['device'])
+screen_diff_enabled = os.environ.get('SCREEN_DIFF', '0') == '1'
+screen_diff_max_ratio = float(os.environ.get('SCREEN_DIFF_MAX_RATIO', '0.5'))
+# Screens longer than this (estimated tokens) are pruned to the most relevant elements; 0 disables
+screen_token_budget = int(os.environ.get('SCREEN_TOKEN_BUDGET', '0'))
+# In plan mode the model may add follow-up actions for predictable screens;
+# they run without another model call while their targets are still on screen
+plan_mode_enabled = os.environ.get('PLAN_MODE', '0') == '1'
+plan_max_actions = int(os.environ.get('PLAN_MAX_ACTIONS', '3'))
+planned_actions = metrics.counter('automation_planned_actions_total', 'Follow-up actions from model plans',
+                                  ['outcome'])
 
-def setup_appium():
+def appium_capabilities(device=None):
+    capabilities = {
+        'platformName': 'Android',
+        'deviceName': 'Pixel 7',  # Update this to match your device
+        'automationName': 'UiAutomator2',
+        'platformVersion': '15',  # Update this to match your Android version
+        'noReset': True,
+        'newCommandTimeout': 300,
+        'adbExecTimeout': 60000
+    }
+    if device is not None and device.udid != DEFAULT_DEVICE_ID:
+        capabilities['udid'] = device.udid
+        capabilities['deviceName'] = device.name
+        if device.platform_version:
+            capabilities['platformVersion'] = device.platform_version
+        if device.system_port:
+            capabilities['systemPort'] = device.system_port  # must differ between parallel sessions
+        capabilities.update(device.capabilities)
+    return capabilities
+
+def load_devices():
+    # Devices come from DEVICES_CONFIG, else from `adb devices`, else the
+    # single device configured in appium_capabilities()
+    config_path = os.environ.get('DEVICES_CONFIG')
+    if config_path:
+        return load_devices_from_config(config_path)
+    try:
+        devices = discover_adb_devices()
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"Could not list adb devices: {str(e)}")
+        devices = []
+    return devices or [Device(DEFAULT_DEVICE_ID)]
+
+def refresh_devices():
+    device_scheduler.sync_devices(load_devices())
+    print(f"Devices: {', '.join(device_scheduler.devices)}")
+
+def setup_appium(capabilities=None):
     options = AppiumOptions()
-    options.set_capability('platformName', 'Android')
-    options.set_capability('deviceName', 'Pixel 7')  # Update this to match your device
-    options.set_capability('automationName', 'UiAutomator2')
-    options.set_capability('platformVersion', '15')  # Update this to match your Android version
-    options.set_capability('noReset', True)
-    options.set_capability('newCommandTimeout', 300)
-    options.set_capability('adbExecTimeout', 60000)
+    for name, value in (capabilities or appium_capabilities()).items():
+        options.set_capability(name, value)
     
     driver = webdriver.Remote('http://localhost:4723', options=options)
     return driver
-os.environ["GROQ_API_KEY"] = "GROQ_API_KEY"
-def capture_screen_xml(driver):
-    return driver.page_source
-
-def compress_xml(xml_string):
-    root = ET.fromstring(xml_string)
-    compressed_info = []
-
-    def extract_info(elem):
-        content_desc = elem.attrib.get('content-desc', '').strip()
-        text = elem.attrib.get('text', '').strip()
-        clickable = elem.attrib.get('clickable', 'false')
-        bounds = elem.attrib.get('bounds', '')
-        class_name = elem.attrib.get('class', '').split('.')[-1]
-        
-        if content_desc or (text and clickable == 'true'):
-            info = f"{content_desc or text}|Bounds:{bounds}|{class_name}"
-            compressed_info.append(info)
 
-        for child in elem:
-            extract_info(child)
+driver_pool = DriverPool(
+    setup_appium,
+    size=int(os.environ.get('DRIVER_POOL_SIZE', '1')),
+    keepalive=float(os.environ.get('DRIVER_POOL_KEEPALIVE', '60'))
+)
+atexit.register(driver_pool.close)
+DEFAULT_DEVICE_ID = 'default'
+settle_tracker = SettleTracker(
+    min_wait=float(os.environ.get('SETTLE_MIN_WAIT', '0.2')),
+    max_wait=float(os.environ.get('SETTLE_MAX_WAIT', '5')),
+    stable_polls=int(os.environ.get('SETTLE_STABLE_POLLS', '2'))
+)
+settle_wait_action_max = 5  # WAIT actions used to sleep a fixed 5 seconds
+# With STEP_VERIFY=1, whether the previous action worked is decided locally
+# where the screens show it, and taps that did nothing are repeated before
+# asking the model
+step_verify_enabled = os.environ.get('STEP_VERIFY', '0') == '1'
+step_verify_retries = int(os.environ.get('STEP_VERIFY_RETRIES', '1'))
+step_verifications = metrics.counter('automation_step_verifications_total', 'Local verdicts on the previous action',
+                                     ['outcome'])
+# Model calls are retried inside the backend; a step whose call still fails is
+# asked again this many times before the command gives up
+step_model_retries = int(os.environ.get('STEP_MODEL_RETRIES', '2'))
+# Per-command wall-clock (seconds) and model token budgets, 0 = unlimited;
+# requests override them with "timeout" and "token_budget"
+command_timeout = float(os.environ.get('COMMAND_TIMEOUT', '0'))
+command_token_budget = int(os.environ.get('COMMAND_TOKEN_BUDGET', '0'))
+commands_cancelled = metrics.counter('automation_commands_cancelled_total', 'Commands stopped before finishing',
+                                     ['reason'])
+trajectory_store = TrajectoryStore(path=os.environ.get('TRAJECTORY_PATH'),
+                                   maxsize=int(os.environ.get('TRAJECTORY_MAX', '1024')))
+trajectory_replay_enabled = os.environ.get('TRAJECTORY_REPLAY', '0') == '1'
+# Without replay, trajectories are only worth recording to keep them on disk
+trajectory_recording_enabled = trajectory_replay_enabled or bool(trajectory_store.path)
+atexit.register(trajectory_store.save)
+# Known routes between screens are walked without the model up to the point
+# where a command needs its own input
+navigation_enabled = os.environ.get('NAV_GRAPH', '0') == '1'
+navigation_graph = NavigationGraph(
+    path=os.environ.get('NAV_GRAPH_PATH') if navigation_enabled else None,
+    min_success=float(os.environ.get('NAV_GRAPH_MIN_SUCCESS', '0.8')),
+    min_attempts=int(os.environ.get('NAV_GRAPH_MIN_ATTEMPTS', '2'))
+)
+atexit.register(navigation_graph.close)
+navigation_steps = metrics.counter('automation_navigation_steps_total', 'Steps walked from the navigation graph',
+                                   ['outcome'])
+interaction_log = InteractionLogWriter(
+    path=os.environ.get('INTERACTION_LOG_PATH', 'ai_interaction_log.jsonl'),
+    max_bytes=int(os.environ.get('INTERACTION_LOG_MAX_BYTES', str(50 * 1024 * 1024))),
+    backup_count=int(os.environ.get('INTERACTION_LOG_BACKUPS', '5')),
+    compress=os.environ.get('INTERACTION_LOG_COMPRESS', '0') == '1'
+)
+atexit.register(interaction_log.close)
+device_scheduler = DeviceScheduler()
+# Taps, swipes and keys (and, if listed, hierarchy dumps) sent straight over
+# ADB; Appium is used when this is off or an ADB call fails
+adb_operations = parse_operations(os.environ.get('ADB_FAST_PATH', ''))
+adb_transports = {}
+adb_transports_lock = threading.Lock()
+adb_calls = metrics.counter('automation_adb_calls_total', 'Operations tried on the direct ADB path',
+                            ['operation', 'outcome'])
+def get_adb_transport(udid):
+    # One transport (and persistent shell) per device, or None when the fast path is off
+    if not adb_operations:
+        return None
+    serial = None if udid == DEFAULT_DEVICE_ID else udid
+    with adb_transports_lock:
+        transport = adb_transports.get(serial)
+        if transport is None:
+            transport = adb_transports[serial] = AdbTransport(
+                serial, adb_operations, host=os.environ.get('ADB_HOST', '127.0.0.1'),
+                port=int(os.environ.get('ADB_PORT', '5037')))
+        return transport
+
+def close_adb_transports():
+    with adb_transports_lock:
+        for transport in adb_transports.values():
+            transport.close()
 
-    extract_info(root)
-    return '\n'.join(compressed_info)
+atexit.register(close_adb_transports)
 
-def get_model_prediction(verification_prompt, command):
-    client = Groq()
+def via_adb(adb, operation, call, fallback):
+    # Runs call() on the direct ADB path when it is enabled for the operation,
+    # else (or when it fails) fallback() through Appium
+    if adb is None or operation not in adb.operations:
+        return fallback()
+    try:
+        result = call()
+    except AdbError as e:
+        print(f"ADB {operation} failed, using Appium: {str(e)}")
+        adb_calls.inc(operation=operation, outcome='fallback')
+        return fallback()
+    adb_calls.inc(operation=operation, outcome='ok')
+    return result
 
-    prompt = f"""You are an advanced AI assistant simulating a mobile phone user. Your task is to predict the next **single action** to take based on the given screen information and user command. Follow these steps to provide the most accurate and efficient action:
+def capture_screen_xml(driver, adb=None):
+    return via_adb(adb, 'dump', lambda: adb.dump(), lambda: driver.page_source)
 
+def press_key(driver, keycode, adb=None):
+    via_adb(adb, 'key', lambda: adb.keyevent(keycode), lambda: driver.press_keycode(keycode))
 
-{verification_prompt}
+def tap(driver, x, y, adb=None):
+    def appium_tap():
+        actions = ActionChains(driver)
+        actions.w3c_actions = ActionBuilder(driver, mouse=PointerInput(interaction.POINTER_TOUCH, "touch"))
+        actions.w3c_actions.pointer_action.move_to_location(x, y)
+        actions.w3c_actions.pointer_action.click()
+        actions.perform()
+    via_adb(adb, 'tap', lambda: adb.tap(x, y), appium_tap)
+
+def build_verification_prompt(command, screen_heading, screen_context, step_number, verdict=None):
+    # verdict: (success, reason) from the local step check, stated as a fact
+    if verdict is not None and verdict[0] is not None:
+        outcome, next_step = ("succeeded", "predict the next step") if verdict[0] else \
+            ("had no effect", "predict a corrective action")
+        return f"""Your command is: {command}
+
+{screen_heading}
+{screen_context}
+
+The previous action {outcome}: {verdict[1]}. Set "previous_step_successful" to {json.dumps(verdict[0])} and {next_step}. If the entire task is complete (command is executed), set "task_complete" to true. Respond in JSON format as before."""
+    return f"""Your command is: {command}
+
+{screen_heading}
+{screen_context}
+
+Is step {step_number} successful? If yes, predict the next step. If no, predict a corrective action. If the entire task is complete (command is executed) acetively check if the command is executed, set "task_complete" to true. Respond in JSON format as before."""
+
+# Static instructions go first (as the system prompt) so that backends can
+# reuse them across steps; only the per-step part below changes.
+MODEL_INSTRUCTIONS = """You are an advanced AI assistant simulating a mobile phone user. Your task is to predict the next **single action** to take based on the given screen information and user command. Follow these steps to provide the most accurate and efficient action:
 
 Respond with a single JSON object representing the next action. The action should have the following properties:
 - "action_type": The type of action (e.g., "CLICK", "TYPE", "SCROLL", "WAIT", "GOBACK", "ENTER"). Actively use the "ENTER" action whenever required. Actively use "SCROLL" action when you dontfind what you are supposed to find.
 - "element": The text after the colon (:) in the element information. This will be either the content description or the text of the element.
-- "description": A brief description of the action
+- "bounds": The bounds of the element in the format "[x1,y1][x2,y2]"
 - "text": (Only for TYPE actions) The text to be typed
-- "previous_step_successful": A boolean indicating if the previous step was successful
 - "task_complete": A boolean indicating if the entire task is complete based on the new screen available. if you are confident enough the task is complete, set it to true.
-- "bounds": The bounds of the element in the format "[x1,y1][x2,y2]"
+- "previous_step_successful": A boolean indicating if the previous step was successful
+- "description": A brief description of the action
 - "screen_awareness": A brief description of what's currently happening on the screen
 
+Always write the properties in this order.
+
 if your command is : "Open youtube"
 Example:
-{{
+{
     "action_type": "CLICK",
     "element": "Google Search",
-    "description": "Click Google search to search for youtube",
     "bounds": "[100,200][200,300]",
-    "previous_step_successful": true,
     "task_complete": false,
+    "previous_step_successful": true,
+    "description": "Click Google search to search for youtube",
     "screen_awareness": "The home screen is displayed with various apps and the Google search bar at the bottom."
-}}
+}
 
-{{
+{
     "action_type": "TYPE",
     "element": "Search",
-    "description": "Type 'YouTube' in the search bar",
-    "text": "YouTube",
     "bounds": "[100,200][200,300]",
-    "previous_step_successful": true,
+    "text": "YouTube",
     "task_complete": false,
+    "previous_step_successful": true,
+    "description": "Type 'YouTube' in the search bar",
     "screen_awareness": "A search bar is active, waiting for input."
-}}
+}
 
-{{
+{
     "action_type": "ENTER",
     "element": "Search",
-    "description": "Press the Enter key to submit the search",
     "bounds": "[100,200][200,300]",
-    "previous_step_successful": true,
     "task_complete": false,
+    "previous_step_successful": true,
+    "description": "Press the Enter key to submit the search",
     "screen_awareness": "The search query has been entered, ready to be submitted."
-}}
+}
 
-{{
+{
     "action_type": " ",
     "element": " ",
-    "description": "Do nothing since task is complete",
     "bounds": "[ , ][ , ]",
-    "previous_step_successful": true,
     "task_complete": true,
+    "previous_step_successful": true,
+    "description": "Do nothing since task is complete",
     "screen_awareness": "Youtube home page is displayed."
+}
+"""
+
+PLAN_INSTRUCTIONS = f"""
+When the next screens are predictable (for example typing into a search field right after tapping it, then submitting), you may plan ahead: add a "plan" property, right before "task_complete", with a list of up to {plan_max_actions} follow-up actions. Each follow-up has only "action_type", "element", "bounds" and "text". They are run one after another without showing you the screen again, and the plan stops as soon as a follow-up's element is not on the screen. Leave "plan" out when unsure.
+
+Example:
+{{
+    "action_type": "CLICK",
+    "element": "Search",
+    "bounds": "[100,200][200,300]",
+    "plan": [
+        {{"action_type": "TYPE", "element": "Search", "bounds": "[100,200][200,300]", "text": "YouTube"}},
+        {{"action_type": "ENTER", "element": "Search", "bounds": "[100,200][200,300]"}}
+    ],
+    "task_complete": false,
+    "previous_step_successful": true,
+    "description": "Tap the search bar, type 'YouTube' and submit",
+    "screen_awareness": "The home screen is displayed with the Google search bar at the bottom."
 }}
+"""
+
+# What is sent as the system prompt; fixed for the life of the process
+model_instructions = MODEL_INSTRUCTIONS + PLAN_INSTRUCTIONS if plan_mode_enabled else MODEL_INSTRUCTIONS
+model_max_tokens = 400 if plan_mode_enabled else 250
+
+def build_step_prompt(command, compressed_info, element_table, previous_screen, step_number, timings, verdict=None):
+    # Returns (verification prompt, pruned screen the model sees, screen mode)
+    t0 = time.time()
+    prompt_screen, omitted = prune_screen(compressed_info, command, screen_token_budget, element_table)
+    timings['prune'] = time.time() - t0
+    
+    if screen_diff_enabled:
+        screen_context, screen_mode = build_screen_context(previous_screen, prompt_screen, screen_diff_max_ratio)
+    else:
+        screen_context, screen_mode = prompt_screen, 'full'
+    if omitted:
+        screen_context = f"{screen_context}\n{omitted_hint(omitted)}"
+    screen_heading = "Current screen information:" if screen_mode == 'full' else \
+        "Current screen information (changes since the previous step):"
+    
+    t0 = time.time()
+    verification_prompt = build_verification_prompt(command, screen_heading, screen_context, step_number, verdict)
+    timings['prompt'] = time.time() - t0
+    return verification_prompt, prompt_screen, screen_mode
+
+def build_model_prompt(verification_prompt):
+    return f"""{verification_prompt}
+
 Provide only the JSON object as your response, without any additional text."""
 
+def get_model_backend():
+    # Created on first use so the reloader's parent process never loads a local model
+    global model_backend
+    with model_backend_lock:
+        if model_backend is None:
+            model_backend = create_backend()
+        return model_backend
+
+def charge_model_call(control, prompt):
+    # Counts the prompt against the command's token budget before it is sent
+    control.charge(estimate_tokens(model_instructions) + estimate_tokens(prompt))
+    control.check()
+
+def get_model_prediction(verification_prompt, command, control):
+    # Raises ModelError when no usable prediction could be had
+    prompt = build_model_prompt(verification_prompt)
+    charge_model_call(control, prompt)
+
     print("\nGenerating AI Prediction...")
+    prediction = get_model_backend().complete(model_instructions, prompt, max_tokens=model_max_tokens,
+                                              temperature=0.7)
+    control.charge(estimate_tokens(prediction))
+    print(f"\nAI Response: {prediction}")
+    return parse_prediction(prediction)
+
+def parse_prediction(prediction):
     try:
-        completion = client.chat.completions.create(
-            model="llama-3.1-70b-versatile",
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.7,
-            max_tokens=250,
-            top_p=1,
-            stream=False
-        )
-
-        prediction = completion.choices[0].message.content
-        print(f"\nAI Response: {prediction}")
-        
+        json_prediction = json.loads(prediction)
+        return json.dumps(json_prediction)
+    except json.JSONDecodeError:
+        print("Failed to parse JSON. Raw prediction:")
+        print(prediction)
+        json_parse_failures.inc()
+        raise ModelResponseError("Model response is not valid JSON")
+
+def get_speculative_prediction(verification_prompt, command, control, stop):
+    # Streams the prediction so that a dropped speculation (stop) or a
+    # cancelled command closes the model call at its next chunk. A stopped
+    # call returns the text it got, which only counts as wasted tokens.
+    prompt = build_model_prompt(verification_prompt)
+    charge_model_call(control, prompt)
+    chunks = get_model_backend().stream(model_instructions, prompt, max_tokens=model_max_tokens, temperature=0.7)
+    parts = []
+    try:
+        for chunk in chunks:
+            if stop.is_set() or control.cancelled:
+                break
+            parts.append(chunk)
+    finally:
+        chunks.close()
+    prediction = ''.join(parts)
+    control.charge(estimate_tokens(prediction))
+    if stop.is_set() or control.cancelled:
+        return prediction
+    return parse_prediction(prediction)
+
+def action_ready(fields, table=None):
+    # True once the action can run. Models trained on the dataset send
+    # "task_complete" before "bounds", so an action on an element also waits
+    # for its bounds, or for an element label the screen's table resolves.
+    if 'action_type' not in fields or 'task_complete' not in fields:
+        return False
+    action_type = fields['action_type']
+    if action_type == 'TYPE' and 'text' not in fields:
+        return False
+    if action_type in ('CLICK', 'TYPE', 'ENTER') and not fields.get('bounds'):
+        return table is not None and table.resolve(fields.get('element', '')) is not None
+    return True
+
+def stream_model_prediction(verification_prompt, command, control, table=None):
+    # Returns (prediction, tail). The prediction holds the actionable fields
+    # as soon as the model has emitted them; tail is a Future of the complete
+    # prediction, or None when the prediction already is complete. Raises
+    # ModelError if the stream fails before the action is known. Cancelling
+    # the command stops the stream at its next chunk. table: the ElementTable
+    # of the screen, for resolving targets before their bounds arrive.
+    prompt = build_model_prompt(verification_prompt)
+    ready = threading.Event()
+    early = {}
+
+    def consume():
+        parser = IncrementalJSONParser()
         try:
-            json_prediction = json.loads(prediction)
-            return json.dumps(json_prediction)
-        except json.JSONDecodeError:
-            print("Failed to parse JSON. Raw prediction:")
-            print(prediction)
-            return json.dumps({
-                "action_type": "CLICK",
-                "element": "Camera",
-                "description": "Click the Camera app icon (fallback action due to parsing error)",
-                "bounds": "",
-                "previous_step_successful": False,
-                "task_complete": False,
-                "screen_awareness": "Unable to determine screen state due to parsing error"
-            })
-    except Exception as e:
-        print(f"Error in get_model_prediction: {str(e)}")
-        return json.dumps({
-            "action_type": "CLICK",
-            "element": "Camera",
-            "description": "Click the Camera app icon (fallback action due to error)",
-            "bounds": "",
-            "previous_step_successful": False,
-            "task_complete": False,
-            "screen_awareness": "Unable to determine screen state due to error"
-        })
+            charge_model_call(control, prompt)
+            chunks = get_model_backend().stream(model_instructions, prompt, max_tokens=model_max_tokens,
+                                                temperature=0.7)
+            try:
+                for chunk in chunks:
+                    if control.cancelled:
+                        break
+                    fields = parser.feed(chunk)
+                    if not ready.is_set() and action_ready(fields, table):
+                        early.update(fields)
+                        ready.set()
+                        if not stream_keep_tail:
+                            break
+            finally:
+                chunks.close()
+            control.charge(estimate_tokens(parser.buffer))
+            if control.cancelled and not parser.complete:
+                raise CommandCancelled(control.reason)
+            print(f"\nAI Response: {parser.buffer}")
+            if not action_ready(parser.fields, table) and not (parser.complete and parser.fields):
+                print("Failed to parse JSON. Raw prediction:")
+                print(parser.buffer)
+                json_parse_failures.inc()
+                raise ModelResponseError("Model response is not valid JSON")
+            return json.dumps(parser.fields)
+        finally:
+            ready.set()
+
+    print("\nGenerating AI Prediction (streaming)...")
+    tail = stream_executor.submit(consume)
+    control.wait(ready)
+    if not early:
+        return control.result(tail), None
+    return json.dumps(early), tail
+
+def after_prediction(action, tail, fn):
+    # Calls fn(action) once the fields streamed after the action started
+    # (description, screen_awareness) have been added to it, without
+    # holding up the step loop
+    if tail is None:
+        fn(action)
+        return
+
+    def merge(future):
+        try:
+            for field, value in json.loads(future.result()).items():
+                action.setdefault(field, value)
+        except Exception as e:
+            print(f"Rest of the streamed prediction unavailable: {str(e)}")
+        fn(action)
+    tail.add_done_callback(merge)
 
 def parse_actions(prediction):
     if isinstance(prediction, str):
@@ -175,59 +530,104 @@ def parse_actions(prediction):
             prediction = json.loads(prediction)
         except json.JSONDecodeError:
             print("Error parsing prediction JSON")
+            json_parse_failures.inc()
             return [{"previous_step_successful": False, "task_complete": False}]
-    return [prediction]
+    actions = [prediction]
+    plan = prediction.get('plan') if plan_mode_enabled else None
+    if isinstance(plan, list):
+        for planned in plan[:plan_max_actions]:
+            if isinstance(planned, dict) and planned.get('action_type'):
+                actions.append(dict(planned, planned=True, previous_step_successful=True, task_complete=False))
+    return actions
+
+def element_locator(table, index):
+    # Id-based locator for a table element, if it has an unambiguous one
+    resource_id = table.unique_resource_id(index)
+    if resource_id:
+        return AppiumBy.ID, resource_id
+    desc = table.unique_desc(index)
+    if desc:
+        return AppiumBy.ACCESSIBILITY_ID, desc
+    return None
+
+def find_by_label(driver, element):
+    # Native UiAutomator lookups; unlike XPath they need no dump of the whole tree
+    for by, value in ((AppiumBy.ACCESSIBILITY_ID, element),
+                      (AppiumBy.ANDROID_UIAUTOMATOR, f"new UiSelector().text({json.dumps(element)})")):
+        found = driver.find_elements(by, value)
+        if found:
+            return found[0]
+    raise NoSuchElementException(f"No element labelled {element!r}")
+
+def swipe_up(driver, adb=None):
+    # Scrolls the content up by most of a screen
+    def appium_swipe():
+        size = driver.get_window_size()
+        start_x = size['width'] * 0.5
+        start_y = size['height'] * 0.4
+        end_x = size['width'] * 0.5
+        end_y = size['height'] * 0.1
+        
+        actions = ActionChains(driver)
+        actions.w3c_actions = ActionBuilder(driver, mouse=PointerInput(interaction.POINTER_TOUCH, "touch"))
+        actions.w3c_actions.pointer_action.move_to_location(start_x, start_y)
+        actions.w3c_actions.pointer_action.pointer_down()
+        actions.w3c_actions.pointer_action.move_to_location(end_x, end_y)
+        actions.w3c_actions.pointer_action.release()
+        actions.perform()
+    
+    def adb_swipe():
+        width, height = adb.window_size()
+        adb.swipe(width * 0.5, height * 0.4, width * 0.5, height * 0.1)
+    via_adb(adb, 'swipe', adb_swipe, appium_swipe)
 
-def execute_action(driver, action):
+def execute_action(driver, action, table=None, adb=None):
+    # table: the ElementTable of the screen the action was chosen on. Targets
+    # are resolved in it to tap coordinates and, for TYPE, an id locator.
+    # adb: the device's AdbTransport when the direct ADB path is on.
     action_type = action['action_type']
     element = action.get('element', '')
     bounds = action.get('bounds', '')
+    target = None
+    if table is not None and action_type in ('CLICK', 'TYPE', 'ENTER'):
+        target = table.resolve(element, bounds)
 
     print(f"Executing: {action_type} on {element}")
 
+    located = False  # whether the target was found on screen
     try:
-        if bounds:
-            bounds = bounds.replace('Bounds:', '').strip()
-            x, y = parse_bounds(bounds)
-            if x is None or y is None:
-                print("Invalid bounds detected")
-                return
-            
-            actions = ActionChains(driver)
-            actions.w3c_actions = ActionBuilder(driver, mouse=PointerInput(interaction.POINTER_TOUCH, "touch"))
-            actions.w3c_actions.pointer_action.move_to_location(x, y)
+        if bounds or target is not None:
+            if target is not None:
+                x, y = table.center(target)
+            else:
+                bounds = bounds.replace('Bounds:', '').strip()
+                x, y = parse_bounds(bounds)
+                if x is None or y is None:
+                    raise NoSuchElementException(f"Invalid bounds {bounds!r} for {action_type}")
+            located = True
 
             if action_type == 'CLICK':
-                actions.w3c_actions.pointer_action.click()
-                actions.perform() 
+                tap(driver, x, y, adb)
             elif action_type == 'TYPE':
-                actions.w3c_actions.pointer_action.click()
-                actions.perform()
-                el = driver.find_element(AppiumBy.XPATH, f"//*[@bounds='{bounds}']")
+                tap(driver, x, y, adb)
+                # The tap focused the field; type into it by id if it has one
+                locator = element_locator(table, target) if target is not None else None
+                el = driver.find_element(*locator) if locator else driver.switch_to.active_element
                 el.send_keys(action.get('text', ''))
-                driver.press_keycode(66)  # Enter key
+                press_key(driver, 66, adb)  # Enter key
             elif action_type == 'ENTER':
-                actions.w3c_actions.pointer_action.click()
-                actions.perform()
-                driver.press_keycode(66)  # Enter key
+                tap(driver, x, y, adb)
+                press_key(driver, 66, adb)  # Enter key
+        elif action_type in ('CLICK', 'TYPE', 'ENTER'):
+            raise NoSuchElementException(f"{action_type} action has no bounds or known element")
         elif action_type == 'SCROLL':
-            size = driver.get_window_size()
-            start_x = size['width'] * 0.5
-            start_y = size['height'] * 0.4
-            end_x = size['width'] * 0.5
-            end_y = size['height'] * 0.1
-            
-            actions = ActionChains(driver)
-            actions.w3c_actions = ActionBuilder(driver, mouse=PointerInput(interaction.POINTER_TOUCH, "touch"))
-            actions.w3c_actions.pointer_action.move_to_location(start_x, start_y)
-            actions.w3c_actions.pointer_action.pointer_down()
-            actions.w3c_actions.pointer_action.move_to_location(end_x, end_y)
-            actions.w3c_actions.pointer_action.release()
-            actions.perform()
+            swipe_up(driver, adb)
         elif action_type == 'WAIT':
-            time.sleep(action.get('duration', 5))
+            # Without an explicit duration the settle wait after the action covers WAIT
+            if 'duration' in action:
+                time.sleep(action['duration'])
         elif action_type == 'GOBACK':
-            driver.back()
+            via_adb(adb, 'key', lambda: adb.keyevent(4), driver.back)  # 4 is the keycode for BACK
         else:
             print(f"Unknown action type: {action_type}")
     except Exception as e:
@@ -235,17 +635,19 @@ def execute_action(driver, action):
         if action_type in ['CLICK', 'TYPE', 'ENTER']:
             print("Attempting to find element without bounds...")
             try:
-                el = WebDriverWait(driver, 10).until(
-                    EC.presence_of_element_located((AppiumBy.XPATH, f"//*[@content-desc='{element}' or @text='{element}']"))
-                )
+                locator = element_locator(table, target) if target is not None else None
+                el = driver.find_element(*locator) if locator else find_by_label(driver, element)
                 if action_type == 'CLICK':
                     el.click()
                 elif action_type == 'TYPE':
                     el.send_keys(action.get('text', ''))
                 elif action_type == 'ENTER':
-                    driver.press_keycode(66)  # Enter key
+                    press_key(driver, 66, adb)  # Enter key
             except Exception as inner_e:
                 print(f"Failed to find element: {str(inner_e)}")
+                if not located:
+                    # Nothing was tapped; do not let the step pass as done
+                    raise
 
 def parse_bounds(bounds_str):
     try:
@@ -268,20 +670,57 @@ def home():
 def start_session():
     try:
         print("Attempting to start Appium session...")
-        driver = setup_appium()
+        data = request.get_json(silent=True) or {}
+        if not device_scheduler.devices:
+            refresh_devices()
         session_id = str(uuid.uuid4())
+        driver = None
+        
+        device = device_scheduler.allocate(session_id, data.get('udid'))
+        if device is None and data.get('take_over'):
+            # Opted in: hand over the device of the session idle the longest
+            device, previous_id = device_scheduler.take_over_idle(session_id, data.get('udid'))
+        else:
+            previous_id = None
+        if device is None:
+            return jsonify({
+                "status": "error",
+                "message": "No free device available"
+            })
+        if previous_id is not None:
+            with session_lock:
+                previous = sessions.pop(previous_id, None)
+            if previous is not None:
+                print(f"Taking over device {device.udid} from idle session {previous_id}")
+                sessions_ended.inc(reason='taken_over')
+                driver = previous['driver']
+        
+        capabilities = appium_capabilities(device)
+        if driver is None:
+            try:
+                driver = driver_pool.acquire(capabilities)
+            except Exception:
+                device_scheduler.release(session_id)
+                raise
         
         with session_lock:
             sessions[session_id] = {
+                'session_id': session_id,
                 'driver': driver,
+                'capabilities': capabilities,
+                'udid': device.udid,
+                'adb': get_adb_transport(device.udid),
+                'commands': CommandQueue(),
                 'last_activity': time.time()
             }
         
-        print(f"Session started successfully: {session_id}")
+        sessions_started.inc()
+        print(f"Session started successfully: {session_id} on device {device.udid}")
         return jsonify({
             "status": "success",
             "message": "Session started",
-            "session_id": session_id
+            "session_id": session_id,
+            "device": device.udid
         })
     except Exception as e:
         print(f"Error starting session: {str(e)}")
@@ -292,65 +731,333 @@ def start_session():
             "message": str(e)
         })
 
-@app.route('/execute_command', methods=['POST'])
-def execute_command():
-    print("\n=== Execute Command Request Received ===")
-    data = request.json
-    session_id = data.get('session_id')
-    command = data.get('command')
+def log_interaction(session, step_number, max_steps, command, compressed_info, action, timings, mode):
+    interaction_log.write({
+        'session_id': session.get('session_id'),
+        'device': session.get('udid'),
+        'command': command,
+        'step': step_number,
+        'max_steps': max_steps,
+        'mode': mode,
+        'screen': compressed_info,
+        'action': action,
+        'timings': timings
+    })
+
+def act_and_settle(driver, action, xml, timings, table=None, adb=None):
+    # Executes the action and returns the page source once the UI has settled
+    t0 = time.time()
+    execute_action(driver, action, table, adb)
+    timings['act'] = time.time() - t0
+    t0 = time.time()
+    max_wait = settle_wait_action_max if action['action_type'] == 'WAIT' else None
+    settled_xml, _ = settle_tracker.wait(driver, action['action_type'], screen_package(xml),
+                                         max_wait=max_wait, capture=lambda: capture_screen_xml(driver, adb))
+    timings['settle'] = time.time() - t0
+    if navigation_enabled:
+        navigation_graph.observe(compress_xml(xml), action, compress_xml(settled_xml))
+    return settled_xml
+
+def check_planned_action(screen_info, action):
+    # Local check before a planned action: its element must be on the freshly
+    # captured screen. Fills in the bounds when the element has moved.
+    if not action.get('element') and not action.get('bounds'):
+        return action['action_type'] in ('SCROLL', 'WAIT', 'GOBACK')
+    if action.get('bounds') and find_anchor(screen_info, action) is not None:
+        return True
+    bounds = lookup_bounds(screen_info, action.get('element'))
+    if not bounds:
+        return False
+    action['bounds'] = bounds
+    return True
+
+def run_planned_actions(session, command, plan, xml, emit, recorded_steps, step_number, max_steps):
+    # Runs the follow-up actions of a plan until one fails its check. Returns
+    # (current page source, next step number).
+    driver = session['driver']
+    for action in plan:
+        if step_number > max_steps:
+            break
+        session['control'].check()
+        compressed_info, table = compress_screen(xml)
+        if not check_planned_action(compressed_info, action):
+            print(f"Planned {action['action_type']} on {action.get('element', '')} does not apply, asking the model")
+            planned_actions.inc(outcome='rejected')
+            break
+        planned_actions.inc(outcome='executed')
+        
+        print(f"\nStep {step_number}/{max_steps} (planned): {action['action_type']} on {action.get('element', '')}")
+        timings = {}
+        xml = act_and_settle(driver, action, xml, timings, table, session.get('adb'))
+        record_step_metrics(timings, action['action_type'], 'plan')
+        emit('step', step=step_number, screen_summary='', element_count=len(compressed_info.splitlines()),
+             screen_mode='plan', action=action, timings=timings)
+        log_interaction(session, step_number, max_steps, command, compressed_info, action, timings, 'plan')
+        recorded_steps.append({'screen': compressed_info, 'action': action})
+        step_number += 1
+    return xml, step_number
+
+def speculate_next_step(session, command, screen_info, table, prompt_screen, action, step_number):
+    # Starts the next step's prediction for the screen this action led to last
+    # time; run_command_steps keeps it only if the real prompt is the same
+    predicted = speculator.next_screen(screen_info, action)
+    if predicted is None:
+        return
+    next_screen, next_table = predicted
+    if make_key(command, next_screen, step_number) in prediction_cache:
+        return  # the next step will be served from the cache anyway
+    verdict = verify_step(action, screen_info, table, next_screen, next_table) if step_verify_enabled else None
+    verification_prompt, _, _ = build_step_prompt(
+        command, next_screen, next_table, prompt_screen, step_number, {}, verdict)
+    control = session['control']
+    session['speculation'] = speculator.start(
+        verification_prompt, lambda prompt, stop: get_speculative_prediction(prompt, command, control, stop))
+
+def walk_navigation_graph(session, command, xml, emit, recorded_steps, step_number, max_steps, max_replans=2):
+    # Walks the most reliable known path to the command's goal screen,
+    # replanning from wherever a step actually lands. Returns (current page
+    # source, next step number).
+    driver = session['driver']
+    replans = 0
+    while step_number <= max_steps:
+        session['control'].check()
+        compressed_info, table = compress_screen(xml)
+        path, _ = navigation_graph.plan(command, compressed_info, max_steps - step_number + 1)
+        if not path:
+            break
+        action, expected = path[0]
+        action = dict(action, previous_step_successful=True, task_complete=False)
+        if not check_planned_action(compressed_info, action):
+            print(f"Known route step {action['action_type']} on {action.get('element', '')} does not apply")
+            navigation_steps.inc(outcome='rejected')
+            break
+        
+        print(f"\nStep {step_number}/{max_steps} (known route, {len(path)} to go): "
+              f"{action['action_type']} on {action.get('element', '')}")
+        timings = {}
+        next_xml = act_and_settle(driver, action, xml, timings, table, session.get('adb'))
+        record_step_metrics(timings, action['action_type'], 'navigate')
+        emit('step', step=step_number, screen_summary=action.get('description', ''),
+             element_count=len(compressed_info.splitlines()), screen_mode='navigate',
+             action=action, timings=timings)
+        log_interaction(session, step_number, max_steps, command, compressed_info, action, timings, 'navigate')
+        recorded_steps.append({'screen': compressed_info, 'action': action})
+        xml = next_xml
+        step_number += 1
+        if state_fingerprint(compress_xml(xml)) == expected:
+            navigation_steps.inc(outcome='walked')
+        else:
+            navigation_steps.inc(outcome='diverged')
+            replans += 1
+            if replans > max_replans:
+                break
+    return xml, step_number
+
+def replay_trajectory(session, command, xml, emit, recorded_steps, max_steps):
+    # Replays the stored trajectory for the command while every screen still
+    # matches. Returns (result if the command finished, current page source,
+    # next step number).
+    trajectory, values = trajectory_store.lookup(command)
+    if trajectory is None:
+        return None, xml, 1
+    driver = session['driver']
     
-    print(f"Session ID: {session_id}")
-    print(f"Command: {command}")
+    print(f"\nReplaying recorded trajectory: {trajectory['template']}")
+    step_number = 1
+    for step in trajectory['steps'][:max_steps]:
+        session['control'].check()
+        compressed_info, table = compress_screen(xml)
+        if not trajectory_store.step_matches(step, compressed_info, values):
+            print(f"Screen diverged from the recorded trajectory at step {step_number}")
+            trajectory_store.mark(trajectory['template'], False)
+            return None, xml, step_number
+        
+        action = trajectory_store.step_action(step, values)
+        print(f"\nReplaying step {step_number}: {action['action_type']} on {action.get('element', '')}")
+        timings = {}
+        next_xml = act_and_settle(driver, action, xml, timings, table, session.get('adb'))
+        record_step_metrics(timings, action['action_type'], 'replay')
+        emit('step', step=step_number, screen_summary=action.get('screen_awareness', ''),
+             element_count=len(compressed_info.splitlines()), screen_mode='replay',
+             action=action, timings=timings)
+        log_interaction(session, step_number, max_steps, command, compressed_info, action, timings, 'replay')
+        recorded_steps.append({'screen': compressed_info, 'action': action})
+        xml = next_xml
+        step_number += 1
     
-    if not session_id or session_id not in sessions:
-        print("Error: Invalid or expired session")
-        return jsonify({
-            "status": "error",
-            "message": "Invalid or expired session",
-            "session_expired": True
-        })
+    compressed_info = compress_xml(xml)
+    if screen_fingerprint(compressed_info) != trajectory['final_fingerprint']:
+        # The model confirms completion on screens not seen before; a replay
+        # that keeps ending elsewhere is dropped like one that diverges
+        trajectory_store.mark(trajectory['template'], False)
+        return None, xml, step_number
     
+    trajectory_store.mark(trajectory['template'], True)
+    print("Command execution completed by replay")
+    return {
+        "status": "success",
+        "message": "Command execution completed",
+        "screen_info": compressed_info,
+        "task_complete": True,
+        "replayed": True
+    }, xml, step_number
+
+def record_step_metrics(timings, action_type, outcome):
+    for phase, seconds in timings.items():
+        step_phase_seconds.observe(seconds, phase=phase, action_type=action_type, outcome=outcome)
+
+def command_control(command, data):
+    # Budgets from the request, defaulting to COMMAND_TIMEOUT/COMMAND_TOKEN_BUDGET
+    control = CommandControl(command, timeout=float(data.get('timeout', command_timeout)),
+                             token_budget=int(data.get('token_budget', command_token_budget)))
+    control.on_cancel(lambda: commands_cancelled.inc(reason=control.reason))
+    return control
+
+def run_command(session, command, job=None, control=None):
+    # Runs after every earlier command of the session has finished
+    start = time.time()
+    control = control or CommandControl(command)
+    commands = session.get('commands')
+    try:
+        if commands is not None:
+            result = commands.run(control, lambda: run_command_steps(session, command, job, control))
+        else:
+            result = run_command_steps(session, command, job, control)
+    except CommandCancelled as e:
+        result = cancelled_result(e.reason)
+    command_seconds.observe(time.time() - start, status=result['status'])
+    return result
+
+def run_command_steps(session, command, job, control):
+    # Runs the capture -> LLM -> act loop for one command. When a job is given,
+    # per-step progress is published on it as events. control is checked
+    # between steps and around every model call.
+    def emit(event_type, **data):
+        if job is not None:
+            job.emit(event_type, **data)
+
     try:
-        session = sessions[session_id]
+        session['control'] = control
         driver = session['driver']
+        adb = session.get('adb')
         session['last_activity'] = time.time()
         
         # Always start from home screen
         print("Going to home screen...")
-        driver.press_keycode(3)  # 3 is the keycode for HOME button
-        time.sleep(1)  # Wait for home screen to load
+        press_key(driver, 3, adb)  # 3 is the keycode for HOME button
+        pending_xml, _ = settle_tracker.wait(driver, 'HOME', capture=lambda: capture_screen_xml(driver, adb))
+        session['previous_screen'] = None
         
         step_number = 1
         max_steps = 15
+        recorded_steps = []
+        model_failures = 0
+        last_step = None  # (screen, element table, action) of the last model step
+        local_retries = 0
+        speculation = session.pop('speculation', None)
+        if speculation is not None:
+            speculator.discard(speculation)  # left over from the previous command
+        
+        if trajectory_replay_enabled:
+            result, pending_xml, step_number = replay_trajectory(
+                session, command, pending_xml, emit, recorded_steps, max_steps)
+            if result is not None:
+                return result
+        if navigation_enabled:
+            pending_xml, step_number = walk_navigation_graph(
+                session, command, pending_xml, emit, recorded_steps, step_number, max_steps)
         
         print(f"\nStarting command execution with {max_steps} max steps")
         
         while step_number <= max_steps:
+            control.check()
             print(f"\nStep {step_number}/{max_steps}")
+            session['last_activity'] = time.time()
+            timings = {}
             
             # Get current screen info
-            xml = capture_screen_xml(driver)
-            compressed_info = compress_xml(xml)
+            t0 = time.time()
+            # The settle wait already captured the stable screen
+            xml = pending_xml if pending_xml is not None else capture_screen_xml(driver, adb)
+            pending_xml = None
+            timings['capture'] = time.time() - t0
+            t0 = time.time()
+            compressed_info, element_table = compress_screen(xml)
+            timings['compress'] = time.time() - t0
             print(f"Current Screen Information:")
             print(compressed_info)
             
-            # Create verification prompt
-            verification_prompt = f"""Your command is: {command}
-
-Current screen information:
-{compressed_info}
-
-Is step {step_number} successful? If yes, predict the next step. If no, predict a corrective action. If the entire task is complete (command is executed) acetively check if the command is executed, set "task_complete" to true. Respond in JSON format as before."""
+            verdict = None
+            previous_step, last_step = last_step, None
+            if previous_step is not None:
+                before_screen, before_table, last_action = previous_step
+                if speculation_enabled:
+                    speculator.observe(before_screen, last_action, compressed_info, element_table)
+                if step_verify_enabled:
+                    verdict = verify_step(last_action, before_screen, before_table, compressed_info, element_table)
+                    retry = retry_action(last_action, element_table) if verdict[0] is False else None
+                    if retry is not None and local_retries < step_verify_retries:
+                        # An obvious no-op tap is repeated where the element is now
+                        local_retries += 1
+                        step_verifications.inc(outcome='retried')
+                        print(f"{last_action['action_type']} had no effect ({verdict[1]}), retrying")
+                        pending_xml = act_and_settle(driver, retry, xml, timings, element_table, adb)
+                        record_step_metrics(timings, retry['action_type'], 'retry')
+                        last_step = previous_step
+                        continue
+                    local_retries = 0
+                    step_verifications.inc(outcome={True: 'success', False: 'no_effect', None: 'unknown'}[verdict[0]])
+            
+            # The model sees (and diffs against) the pruned screen
+            previous_screen = session.get('previous_screen')
+            verification_prompt, prompt_screen, screen_mode = build_step_prompt(
+                command, compressed_info, element_table, previous_screen, step_number, timings, verdict)
+            session['previous_screen'] = prompt_screen
 
             print("\nGetting AI prediction...")
-            prediction = get_model_prediction(verification_prompt, command)
+            t0 = time.time()
+            try:
+                prediction = None
+                speculation = session.pop('speculation', None)
+                if speculation is not None:
+                    prediction = speculator.resolve(speculation, verification_prompt, wait=control.result)
+                if prediction is not None:
+                    print("Using speculative prediction")
+                    prediction_tail = None
+                    prediction_cache.put(make_key(command, compressed_info, step_number), prediction)
+                else:
+                    prediction, prediction_tail = get_cached_prediction(
+                        verification_prompt, command, compressed_info, step_number, control, element_table)
+            except ModelError as e:
+                # Nothing was done on the device; ask again on a fresh capture
+                timings['predict'] = time.time() - t0
+                print(f"Model call failed: {str(e)}")
+                model_errors.inc(kind=type(e).__name__)
+                record_step_metrics(timings, 'NONE', 'model_error')
+                session['previous_screen'] = previous_screen
+                last_step = previous_step
+                model_failures += 1
+                if model_failures > step_model_retries:
+                    return {
+                        "status": "error",
+                        "message": f"Model unavailable: {str(e)}"
+                    }
+                continue
+            model_failures = 0
+            timings['predict'] = time.time() - t0
             print(f"AI Prediction: {prediction}")
             
             try:
-                action = parse_actions(prediction)[0]
+                actions = parse_actions(prediction)
+                action = actions[0]
+                if screen_mode == 'diff' and not action.get('bounds'):
+                    # Unchanged elements are sent without bounds in diff mode
+                    action['bounds'] = lookup_bounds(compressed_info, action.get('element'))
+                if verdict is not None and verdict[0] is not None:
+                    action['previous_step_successful'] = verdict[0]
                 print(f"\nParsed Action: {action}")
                 
-                previous_step_successful = action['previous_step_successful']
+                previous_step_successful = action.get('previous_step_successful')
                 task_complete = action['task_complete']
                 
                 print(f"Previous step successful: {previous_step_successful}")
@@ -358,54 +1065,291 @@ Is step {step_number} successful? If yes, predict the next step. If no, predict
                 
                 if task_complete:
                     print("Command execution completed successfully")
-                    return jsonify({
+                    record_step_metrics(timings, action.get('action_type') or 'NONE', 'complete')
+                    if trajectory_recording_enabled:
+                        trajectory_store.record(command, recorded_steps, compressed_info)
+                    if navigation_enabled:
+                        navigation_graph.record_goal(command, recorded_steps, compressed_info)
+                    emit('step', step=step_number, screen_summary=action.get('screen_awareness', ''),
+                         element_count=len(compressed_info.splitlines()), screen_mode=screen_mode,
+                         action=action, timings=timings)
+                    return {
                         "status": "success",
                         "message": "Command execution completed",
                         "action": action,
                         "screen_info": compressed_info,
                         "task_complete": True
-                    })
+                    }
+                
+                if speculation_enabled and len(actions) == 1:
+                    speculate_next_step(session, command, compressed_info, element_table, prompt_screen, action,
+                                        step_number + 1)
                 
                 # Execute the action
                 print(f"\nExecuting action: {action['action_type']} on {action.get('element', '')}")
-                execute_action(driver, action)
+                pending_xml = act_and_settle(driver, action, xml, timings, element_table, adb)
+                if len(actions) == 1:
+                    last_step = (compressed_info, element_table, action)
+                record_step_metrics(timings, action['action_type'], 'ok')
+                emit('step', step=step_number, screen_summary=action.get('screen_awareness', ''),
+                     element_count=len(compressed_info.splitlines()), screen_mode=screen_mode,
+                     action=action, timings=timings)
                 
-                # Log the interaction
-                with open("ai_interaction_log.txt", "a", encoding="utf-8") as f:
-                    f.write(f"\nStep {step_number}/{max_steps}:\n")
-                    f.write(f"Command: {command}\n")
-                    f.write(f"Screen Information:\n{compressed_info}\n\n")
-                    f.write(f"Action:\n")
-                    f.write(f"Type: {action['action_type']}, Element: {action.get('element', '')}, Bounds: {action.get('bounds', '')}, Description: {action['description']}\n")
-                    f.write(f"Screen Awareness: {action['screen_awareness']}\n")
-                    if 'text' in action:
-                        f.write(f"Text: {action['text']}\n")
-                    f.write(f"Previous step successful: {previous_step_successful}\n")
-                    f.write(f"Task complete: {task_complete}\n")
+                after_prediction(action, prediction_tail, functools.partial(
+                    log_interaction, session, step_number, max_steps, command, compressed_info,
+                    timings=timings, mode=screen_mode))
+                recorded_steps.append({'screen': compressed_info, 'action': action})
                 
                 step_number += 1
+                if len(actions) > 1:
+                    pending_xml, step_number = run_planned_actions(
+                        session, command, actions[1:], pending_xml, emit, recorded_steps, step_number, max_steps)
                 
+            except CommandCancelled:
+                raise
             except Exception as e:
                 print(f"Error in action execution: {str(e)}")
-                return jsonify({
+                record_step_metrics(timings, 'NONE', 'error')
+                return {
                     "status": "error",
                     "message": str(e)
-                })
+                }
         
         print(f"Maximum steps ({max_steps}) reached")
-        return jsonify({
+        max_steps_exhausted.inc()
+        return {
             "status": "warning",
             "message": f"Maximum steps ({max_steps}) reached"
-        })
+        }
             
+    except CommandCancelled as e:
+        print(f"Command stopped: {str(e)}")
+        speculation = session.pop('speculation', None)
+        if speculation is not None:
+            speculator.discard(speculation)
+        return cancelled_result(e.reason)
     except Exception as e:
         print(f"Error in command execution: {str(e)}")
         import traceback
         print(traceback.format_exc())
-        return jsonify({
+        return {
             "status": "error",
             "message": str(e)
+        }
+
+@app.route('/execute_command', methods=['POST'])
+def execute_command():
+    print("\n=== Execute Command Request Received ===")
+    data = request.json
+    session_id = data.get('session_id')
+    command = data.get('command')
+    run_async = data.get('async', False)
+    
+    print(f"Session ID: {session_id}")
+    print(f"Command: {command}")
+    
+    if not session_id or session_id not in sessions:
+        print("Error: Invalid or expired session")
+        return jsonify({
+            "status": "error",
+            "message": "Invalid or expired session",
+            "session_expired": True
+        })
+    
+    session = sessions[session_id]
+    udid = session['udid']
+    control = command_control(command, data)
+    commands = session['commands']
+    if run_async:
+        job = commands.add(control, lambda: job_manager.submit(
+            session_id, command, lambda job, device: run_command(session, command, job, control),
+            dispatch=lambda run: device_scheduler.submit(run, udid, label=command), control=control))
+        print(f"Submitted job: {job.job_id}")
+        return jsonify({
+            "status": "accepted",
+            "message": "Command submitted",
+            "job_id": job.job_id,
+            "command_id": control.command_id
         })
+    
+    # Commands on one device run one at a time, in order
+    control.future = commands.add(control, lambda: device_scheduler.submit(
+        lambda device: run_command(session, command, control=control), udid, label=command))
+    try:
+        return jsonify(control.future.result())
+    except CancelledError:
+        return jsonify(cancelled_result(control.reason or 'cancelled'))
+
+def run_on_device(job, device):
+    # Runs a queued command on whichever device the scheduler picked
+    try:
+        job.control.check()
+    except CommandCancelled as e:
+        return cancelled_result(e.reason)
+    job.emit('assigned', device=device.udid)
+    capabilities = appium_capabilities(device)
+    driver = driver_pool.acquire(capabilities)
+    try:
+        session = {
+            'session_id': job.job_id,
+            'driver': driver,
+            'capabilities': capabilities,
+            'udid': device.udid,
+            'adb': get_adb_transport(device.udid),
+            'last_activity': time.time()
+        }
+        return run_command(session, job.command, job, job.control)
+    finally:
+        driver_pool.release(driver, capabilities)
+
+@app.route('/queue_command', methods=['POST'])
+def queue_command():
+    data = request.get_json(silent=True) or {}
+    command = data.get('command')
+    if not command:
+        return jsonify({"status": "error", "message": "Missing command"})
+    if not device_scheduler.devices:
+        refresh_devices()
+    
+    job = job_manager.submit(None, command, run_on_device,
+                             dispatch=lambda run: device_scheduler.submit(run, label=command),
+                             control=command_control(command, data))
+    print(f"Queued job: {job.job_id}")
+    return jsonify({
+        "status": "accepted",
+        "message": "Command queued",
+        "job_id": job.job_id
+    })
+
+@app.route('/cancel', methods=['POST'])
+def cancel_command():
+    # {"job_id": ...}, {"session_id": ..., "command_id": ...}, or just
+    # {"session_id": ...} for every queued and running command of the session
+    data = request.get_json(silent=True) or {}
+    if data.get('job_id'):
+        job = job_manager.get(data['job_id'])
+        if job is None or job.control is None:
+            return jsonify({"status": "error", "message": "Job not found"})
+        cancelled = [job.control.command_id] if job.control.cancel() else []
+    else:
+        session = sessions.get(data.get('session_id'))
+        if session is None:
+            return jsonify({
+                "status": "error",
+                "message": "Invalid or expired session",
+                "session_expired": True
+            })
+        cancelled = session['commands'].cancel(data.get('command_id'))
+    print(f"Cancelled commands: {cancelled}")
+    return jsonify({"status": "success", "cancelled": cancelled})
+
+@app.route('/sessions/<session_id>/commands', methods=['GET'])
+def session_commands(session_id):
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({"status": "error", "message": "Invalid or expired session", "session_expired": True})
+    return jsonify({"status": "success", "commands": session['commands'].to_list()})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"})
+    since = request.args.get('since', 0, type=int)
+    return jsonify({"status": "success", "job": job.to_dict(since)})
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Job not found"})
+    since = request.args.get('since', 0, type=int)
+
+    def stream():
+        seq = since
+        while True:
+            events = job.events_since(seq, timeout=15)
+            if not events:
+                if job.done:
+                    return
+                yield ": keep-alive\n\n"
+                continue
+            for event in events:
+                yield f"id: {event['seq']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+            seq = events[-1]['seq'] + 1
+            if job.done and seq >= len(job.events):
+                return
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({"status": "success", "prediction_cache": prediction_cache.stats()})
+
+@app.route('/cache/clear', methods=['POST'])
+def cache_clear():
+    prediction_cache.clear()
+    return jsonify({"status": "success", "message": "Prediction cache cleared"})
+
+@app.route('/pool/status', methods=['GET'])
+def pool_status():
+    return jsonify({"status": "success", "driver_pool": driver_pool.status()})
+
+@app.route('/trajectories/stats', methods=['GET'])
+def trajectories_stats():
+    return jsonify({"status": "success", "trajectories": trajectory_store.stats()})
+
+@app.route('/navigation/stats', methods=['GET'])
+def navigation_stats():
+    return jsonify({"status": "success", "navigation": navigation_graph.stats()})
+
+@app.route('/speculation/stats', methods=['GET'])
+def speculation_stats():
+    return jsonify({"status": "success", "speculation": speculator.stats()})
+
+@app.route('/coalescing/stats', methods=['GET'])
+def coalescing_stats():
+    return jsonify({"status": "success", "enabled": single_flight_enabled, **single_flight.stats()})
+
+@app.route('/settle/stats', methods=['GET'])
+def settle_stats():
+    return jsonify({"status": "success", "settle": settle_tracker.stats()})
+
+@app.route('/model/stats', methods=['GET'])
+def model_stats():
+    return jsonify({"status": "success", "model": get_model_backend().stats()})
+
+@app.route('/adb/stats', methods=['GET'])
+def adb_stats():
+    with adb_transports_lock:
+        transports = [transport.stats() for transport in adb_transports.values()]
+    return jsonify({"status": "success", "operations": sorted(adb_operations), "transports": transports})
+
+@app.route('/devices', methods=['GET'])
+def devices_status():
+    return jsonify({"status": "success", **device_scheduler.status()})
+
+@app.route('/devices/refresh', methods=['POST'])
+def devices_refresh():
+    refresh_devices()
+    return jsonify({"status": "success", **device_scheduler.status()})
+
+def close_session(session, reason):
+    # Cancels the session's commands and frees its driver and device. The
+    # release is queued on the device, so it runs once a command that is
+    # mid-step has seen the cancel, and nothing else gets the device before.
+    session['commands'].cancel()
+
+    def release(device):
+        driver_pool.release(session['driver'], session['capabilities'])
+        device_scheduler.release(session['session_id'])
+    device_scheduler.submit(release, session['udid'], label='end_session')
+    sessions_ended.inc(reason=reason)
 
 @app.route('/end_session', methods=['POST'])
 def end_session():
@@ -415,8 +1359,8 @@ def end_session():
     if session_id and session_id in sessions:
         try:
             with session_lock:
-                sessions[session_id]['driver'].quit()
-                del sessions[session_id]
+                session = sessions.pop(session_id)
+            close_session(session, 'ended')
             return jsonify({"status": "success", "message": "Session ended"})
         except Exception as e:
             print(f"Error ending session: {str(e)}")
@@ -431,20 +1375,68 @@ def cleanup_old_sessions():
         with session_lock:
             for session_id in list(sessions.keys()):
                 if current_time - sessions[session_id]['last_activity'] > 1800:  # 30 minutes
-                    try:
-                        sessions[session_id]['driver'].quit()
-                    except:
-                        pass
-                    del sessions[session_id]
+                    close_session(sessions.pop(session_id), 'expired')
+        job_manager.cleanup()
+        prediction_cache.save()
+        trajectory_store.save()
+        navigation_graph.save()
 
-@lru_cache(maxsize=100)
-def get_cached_prediction(prompt_hash):
-    # Convert the prompt to a string hash for caching
-    return get_model_prediction(prompt_hash)
+def get_cached_prediction(verification_prompt, command, screen_info, step_context, control, table=None):
+    # Returns (prediction, tail); see stream_model_prediction
+    key = make_key(command, screen_info, step_context)
+    prediction = prediction_cache.get(key)
+    if prediction is not None:
+        print("Using cached prediction")
+        return prediction, None
+    if single_flight_enabled:
+        # Callers of a streamed call share its early prediction and its tail
+        return single_flight.do(key, lambda: predict(key, verification_prompt, command, control, table),
+                                wait=control.result,
+                                share=lambda shared: charge_shared_prediction(control, verification_prompt, shared))
+    return predict(key, verification_prompt, command, control, table)[0]
+
+def charge_shared_prediction(control, verification_prompt, shared):
+    # A command sharing another command's model call is charged the tokens it
+    # would have used making the call itself, so sharing does not bypass its
+    # budget. The rest of a streamed prediction is charged when it arrives.
+    prediction, tail = shared
+    control.charge(estimate_tokens(prediction))
+    charge_model_call(control, build_model_prompt(verification_prompt))
+    if tail is not None:
+        def charge_rest(future):
+            if future.exception() is None:
+                control.charge(max(estimate_tokens(future.result()) - estimate_tokens(prediction), 0))
+        tail.add_done_callback(charge_rest)
+
+def predict(key, verification_prompt, command, control, table=None):
+    # ((prediction, tail), tail) from the model; the result is cached under key
+    if not stream_predictions_enabled:
+        # Off the step thread, so a cancelled command does not wait for the reply
+        prediction = control.result(stream_executor.submit(get_model_prediction, verification_prompt, command,
+                                                           control))
+        prediction_cache.put(key, prediction)
+        return (prediction, None), None
+    prediction, tail = stream_model_prediction(verification_prompt, command, control, table)
+    if tail is None:
+        prediction_cache.put(key, prediction)
+    else:
+        def cache_complete(future):
+            if future.exception() is None:
+                prediction_cache.put(key, future.result())
+        tail.add_done_callback(cache_complete)
+    return (prediction, tail), tail
 
 if __name__ == '__main__':
     cleanup_thread = threading.Thread(target=cleanup_old_sessions, daemon=True)
     cleanup_thread.start()
     
+    # With debug=True the reloader runs this block in two processes; only the
+    # serving child may hold a session on the device
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        refresh_devices()
+        for device in device_scheduler.devices.values():
+            driver_pool.warm(appium_capabilities(device))
+        get_model_backend().warm(model_instructions)
+    
     print("Starting automation server on http://0.0.0.0:5001")
     app.run(host='0.0.0.0', port=5001, debug=True)
\ No newline at end of file
@@ -0,0 +1,102 @@
+import argparse
+import json
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from screen_xml import compress_xml
+from benchmarks.screens import deep_page_source, recorded_page_sources, synthetic_page_source
+
+# Compares the streaming compress_xml against the previous xml.etree
+# implementation on recorded and large synthetic hierarchies.
+#
+#   python -m benchmarks.bench_compress_xml [--repeat N] [--json out.json]
+
+def legacy_compress_xml(xml_string):
+    root = ET.fromstring(xml_string)
+    compressed_info = []
+
+    def extract_info(elem):
+        content_desc = elem.attrib.get('content-desc', '').strip()
+        text = elem.attrib.get('text', '').strip()
+        clickable = elem.attrib.get('clickable', 'false')
+        bounds = elem.attrib.get('bounds', '')
+        class_name = elem.attrib.get('class', '').split('.')[-1]
+
+        if content_desc or (text and clickable == 'true'):
+            info = f"{content_desc or text}|Bounds:{bounds}|{class_name}"
+            compressed_info.append(info)
+
+        for child in elem:
+            extract_info(child)
+
+    extract_info(root)
+    return '\n'.join(compressed_info)
+
+def measure(func, page_sources, repeat):
+    try:
+        outputs = [func(source) for source in page_sources]
+    except RecursionError:
+        return None, {'error': 'RecursionError'}
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for source in page_sources:
+            func(source)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    for source in page_sources:
+        func(source)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return outputs, {'seconds': best, 'peak_python_bytes': peak}
+
+def run(repeat=5):
+    cases = [
+        ('recorded', recorded_page_sources()),
+        ('feed_500_rows', [synthetic_page_source(rows=500)]),
+        ('feed_3000_rows', [synthetic_page_source(rows=3000, seed=1)]),
+        ('deep_1500_levels', [deep_page_source(1500)]),
+    ]
+    results = []
+    for name, page_sources in cases:
+        legacy_out, legacy = measure(legacy_compress_xml, page_sources, repeat)
+        stream_out, streaming = measure(compress_xml, page_sources, repeat)
+        result = {
+            'case': name,
+            'screens': len(page_sources),
+            'input_bytes': sum(len(source) for source in page_sources),
+            'legacy': legacy,
+            'streaming': streaming,
+            'identical_output': legacy_out == stream_out if legacy_out is not None else None,
+        }
+        if 'seconds' in legacy and 'seconds' in streaming:
+            result['speedup'] = legacy['seconds'] / streaming['seconds']
+        results.append(result)
+    return results
+
+def format_result(result):
+    def side(stats):
+        if 'error' in stats:
+            return f"{stats['error']:>24}"
+        return f"{stats['seconds'] * 1000:9.2f} ms {stats['peak_python_bytes'] / 1024:9.0f} KiB"
+    speedup = f"{result['speedup']:.2f}x" if 'speedup' in result else '-'
+    return (f"{result['case']:<18} {result['input_bytes'] / 1024:9.0f} KiB | legacy {side(result['legacy'])}"
+            f" | streaming {side(result['streaming'])} | speedup {speedup:>6} | identical {result['identical_output']}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark compress_xml')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    for result in results:
+        print(format_result(result))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'benchmark': 'compress_xml', 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
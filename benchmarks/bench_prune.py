@@ -0,0 +1,85 @@
+import argparse
+import json
+import random
+import time
+
+from screen_diff import split_line
+from screen_prune import estimate_tokens, prune_screen
+from screen_xml import compress_screen
+from benchmarks.screens import recorded_episodes, synthetic_page_source
+
+# Measures screen pruning: prompt tokens before and after, and how often the
+# element the step actually targeted survives (target recall), per budget.
+#
+#   python -m benchmarks.bench_prune [--budgets 150 300 600 1500] [--json out.json]
+
+def recorded_steps():
+    # (command, compressed screen, element table, target label) per recorded step with a target
+    steps = []
+    for episode in recorded_episodes():
+        for source, action in zip(episode['screens'], episode['actions']):
+            target = (action.get('element') or '').strip()
+            bounds = (action.get('bounds') or '').replace('Bounds:', '').strip()
+            if not target and not bounds:
+                continue
+            screen, table = compress_screen(source)
+            steps.append((episode['command'], screen, table, target, bounds))
+    return steps
+
+def feed_steps(count=20, rows=500):
+    # Commands naming a random row of a long synthetic feed
+    screen, table = compress_screen(synthetic_page_source(rows=rows))
+    rng = random.Random(0)
+    lines = [line for line in screen.splitlines() if not line.startswith('Thumbnail')]
+    steps = []
+    for _ in range(count):
+        label, bounds, _ = split_line(rng.choice(lines))
+        steps.append((f"play {label.lower()}", screen, table, label, bounds))
+    return steps
+
+def target_kept(pruned, target, bounds):
+    for line in pruned.splitlines():
+        label, line_bounds, _ = split_line(line)
+        if (target and label == target) or (not target and line_bounds == bounds):
+            return True
+    return False
+
+def run_case(steps, budget):
+    before = after = kept = 0
+    start = time.perf_counter()
+    for command, screen, table, target, bounds in steps:
+        pruned, _ = prune_screen(screen, command, budget, table)
+        before += estimate_tokens(screen)
+        after += estimate_tokens(pruned)
+        kept += target_kept(pruned, target, bounds)
+    elapsed = time.perf_counter() - start
+    return {
+        'budget': budget,
+        'steps': len(steps),
+        'mean_tokens_before': before / len(steps),
+        'mean_tokens_after': after / len(steps),
+        'target_recall': kept / len(steps),
+        'mean_prune_us': elapsed / len(steps) * 1e6
+    }
+
+def run(budgets):
+    cases = [('recorded', recorded_steps()), ('feed_500_rows', feed_steps())]
+    return [dict(case=name, **run_case(steps, budget)) for name, steps in cases if steps for budget in budgets]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark screen pruning')
+    parser.add_argument('--budgets', type=int, nargs='+', default=[150, 300, 600, 1500])
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    results = run(args.budgets)
+    for result in results:
+        print(f"{result['case']:<14} budget {result['budget']:>5} | tokens {result['mean_tokens_before']:8.0f}"
+              f" -> {result['mean_tokens_after']:6.0f} | target recall {result['target_recall']:6.1%}"
+              f" | {result['mean_prune_us']:8.1f} us/screen | n={result['steps']}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'benchmark': 'prune', 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Offline benchmarks of the server's own overhead: no phone, no API key.
+#
+#   python -m benchmarks.bench_suite [--llm-latency 0.0] [--token-latency 0.0] [--json out.json]
+#                                    [--compare baseline.json --threshold 0.25]
+#
+# The interaction log goes to a temporary directory and UI-settle sleeps are
+# disabled so only server work is measured.
+
+os.environ.setdefault('INTERACTION_LOG_PATH', os.path.join(tempfile.mkdtemp(), 'interaction_log.jsonl'))
+
+import automation_server as server
+from command_control import CommandQueue
+from device_scheduler import Device
+from llm_backends import GroqBackend
+from screen_xml import compress_screen, compress_xml
+from benchmarks.fakes import FakeDriver, FakeGroq
+from benchmarks.screens import recorded_episodes, recorded_page_sources, recorded_screens
+from screen_diff import split_line
+
+def measure(fn, iterations=200, batch=1, warmup=5):
+    # Per-call statistics in microseconds over `iterations` samples of `batch` calls
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        for _ in range(batch):
+            fn()
+        samples.append((time.perf_counter() - start) / batch * 1e6)
+    samples.sort()
+    return {
+        'iterations': iterations * batch,
+        'mean_us': statistics.fmean(samples),
+        'p50_us': samples[len(samples) // 2],
+        'p95_us': samples[min(int(len(samples) * 0.95), len(samples) - 1)],
+        'min_us': samples[0]
+    }
+
+def quiet(fn):
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn()
+    return run
+
+def bench_compress_xml():
+    sources = itertools.cycle(recorded_page_sources())
+    return measure(lambda: compress_xml(next(sources)), iterations=300)
+
+def bench_compress_screen():
+    sources = itertools.cycle(recorded_page_sources())
+    return measure(lambda: compress_screen(next(sources)), iterations=300)
+
+def bench_resolve_target():
+    # Local lookup of the model's element/bounds that replaces on-device XPath
+    targets = []
+    for source in recorded_page_sources():
+        compressed, table = compress_screen(source)
+        targets.extend((table, *split_line(line)[:2]) for line in compressed.splitlines())
+    targets = itertools.cycle(targets)
+
+    def resolve():
+        table, element, bounds = next(targets)
+        return table.resolve(element, bounds)
+    return measure(resolve, iterations=200, batch=100)
+
+def bench_parse_bounds():
+    bounds = itertools.cycle([split_line(line)[1] for screen in recorded_screens() for line in screen.splitlines()])
+    return measure(lambda: server.parse_bounds(next(bounds)), iterations=200, batch=100)
+
+def bench_build_prompt():
+    screens = itertools.cycle([compress_xml(source) for source in recorded_page_sources()])
+
+    def build():
+        verification_prompt = server.build_verification_prompt(
+            'play devara song on youtube', 'Current screen information:', next(screens), 3)
+        return server.MODEL_INSTRUCTIONS, server.build_model_prompt(verification_prompt)
+    return measure(build, iterations=200, batch=10)
+
+def bench_parse_actions():
+    predictions = itertools.cycle([json.dumps(action) for episode in recorded_episodes()
+                                   for action in episode['actions']])
+    return measure(quiet(lambda: server.parse_actions(next(predictions))), iterations=200, batch=10)
+
+# Order the system prompt asks the model to write the fields in
+FIELD_ORDER = ('action_type', 'element', 'bounds', 'text', 'plan', 'task_complete',
+               'previous_step_successful', 'description', 'screen_awareness')
+
+def in_field_order(action):
+    rank = {field: index for index, field in enumerate(FIELD_ORDER)}
+    return dict(sorted(action.items(), key=lambda item: rank.get(item[0], len(rank))))
+
+def bench_execute_command(llm_latency, token_latency=0.0):
+    # One full /execute_command request per recorded episode, end to end
+    server.settle_tracker.min_wait = 0
+    server.settle_tracker.poll_interval = 0
+    server.settle_tracker.max_interval = 0
+    server.device_scheduler.sync_devices([Device('bench')])
+    client = server.app.test_client()
+    episodes = itertools.cycle(recorded_episodes())
+
+    def run():
+        episode = next(episodes)
+        fake_llm = FakeGroq([in_field_order(action) for action in episode['actions']],
+                            latency=llm_latency, token_latency=token_latency)
+        server.model_backend = GroqBackend(client=fake_llm)
+        server.prediction_cache.clear()
+        server.sessions['bench'] = {
+            'session_id': 'bench',
+            'driver': FakeDriver(episode['screens']),
+            'capabilities': {},
+            'udid': 'bench',
+            'commands': CommandQueue(),
+            'last_activity': time.time()
+        }
+        response = client.post('/execute_command', json={'session_id': 'bench', 'command': episode['command']})
+        if response.json['status'] != 'success':
+            raise RuntimeError(f"Benchmark command failed: {response.json}")
+    return measure(quiet(run), iterations=30 if llm_latency or token_latency else 100, warmup=2)
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def run(llm_latency=0.0, token_latency=0.0):
+    return {
+        'compress_xml': bench_compress_xml(),
+        'compress_screen': bench_compress_screen(),
+        'resolve_target': bench_resolve_target(),
+        'parse_bounds': bench_parse_bounds(),
+        'build_prompt': bench_build_prompt(),
+        'parse_actions': bench_parse_actions(),
+        'execute_command': bench_execute_command(llm_latency, token_latency),
+    }
+
+def compare(results, baseline, threshold):
+    # Names of benchmarks whose mean got slower than baseline by more than threshold
+    regressions = []
+    for name, stats in results.items():
+        old = baseline.get('results', {}).get(name)
+        if old and stats['mean_us'] > old['mean_us'] * (1 + threshold):
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline server benchmarks')
+    parser.add_argument('--llm-latency', type=float, default=0.0, help='fake model latency per call, seconds')
+    parser.add_argument('--token-latency', type=float, default=0.0,
+                        help='fake model delay per streamed chunk, seconds')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='baseline results file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown before failing')
+    args = parser.parse_args()
+
+    results = run(args.llm_latency, args.token_latency)
+    report = {
+        'suite': 'server',
+        'timestamp': time.time(),
+        'git_commit': git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'llm_latency': args.llm_latency,
+        'token_latency': args.token_latency,
+        'results': results
+    }
+    for name, stats in results.items():
+        print(f"{name:<16} mean {stats['mean_us']:11.1f} us  p50 {stats['p50_us']:11.1f} us  "
+              f"p95 {stats['p95_us']:11.1f} us  n={stats['iterations']}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"Regressions over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("No regressions")
+
+if __name__ == '__main__':
+    main()
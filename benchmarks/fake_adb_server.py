@@ -0,0 +1,160 @@
+import argparse
+import re
+import socketserver
+import threading
+import time
+
+from benchmarks.screens import recorded_episodes
+
+# Local stand-in for the adb server (the host side of `adb`, port 5037), for
+# exercising the direct ADB path without a device:
+#
+#   python -m benchmarks.fake_adb_server --port 5038 --command-latency 0.02
+#   ADB_FAST_PATH=tap,swipe,key,dump ADB_PORT=5038 python automation_server.py
+#
+# It answers `host:transport*`, `host:devices` and `exec:sh`. Shell input is
+# recorded and the commands the transport sends are simulated: `input`, `wm
+# size` and `uiautomator dump`. Like FakeDriver, dumps serve a sequence of
+# recorded screens; taps, swipes and BACK move to the next, HOME to the first.
+
+COMMAND_RE = re.compile(r"^(.*); printf '\\n(__adb_\w+__)%d\\n' \$\?$")
+DUMP_RE = re.compile(r'^uiautomator dump (\S+) >/dev/null && cat \1$')
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, serials=('emulator-5554',), screens=None, command_latency=0.0,
+                 size=(1080, 2400), fail_every=0):
+        super().__init__(address, FakeAdbHandler)
+        self.serials = list(serials)
+        self.screens = screens or [source for episode in recorded_episodes() for source in episode['screens']]
+        self.command_latency = command_latency
+        self.size = size
+        self.fail_every = fail_every
+        self.lock = threading.Lock()
+        self.commands = []
+        self.connections = 0
+        self.dumps = 0
+        self.index = 0
+
+    def run(self, command):
+        # (exit status, output) for one simulated shell command
+        with self.lock:
+            self.commands.append(command)
+            count = len(self.commands)
+        if self.command_latency:
+            time.sleep(self.command_latency)
+        if self.fail_every and count % self.fail_every == 0:
+            return 1, 'Error: simulated failure\n'
+        fields = command.split()
+        if (fields[:2] == ['input', 'tap'] and len(fields) == 4) or \
+                (fields[:2] == ['input', 'swipe'] and len(fields) in (6, 7)):
+            with self.lock:
+                self.index += 1
+            return 0, ''
+        if fields[:2] == ['input', 'keyevent'] and len(fields) == 3:
+            with self.lock:
+                if fields[2] == '3':
+                    self.index = 0
+                elif fields[2] == '4':
+                    self.index += 1
+            return 0, ''
+        if fields == ['wm', 'size']:
+            return 0, f"Physical size: {self.size[0]}x{self.size[1]}\n"
+        if DUMP_RE.match(command):
+            with self.lock:
+                self.dumps += 1
+                return 0, self.screens[min(self.index, len(self.screens) - 1)]
+        return 127, f"/system/bin/sh: {fields[0] if fields else command}: not found\n"
+
+    def stats(self):
+        with self.lock:
+            return {'connections': self.connections, 'commands': len(self.commands), 'dumps': self.dumps}
+
+
+class FakeAdbHandler(socketserver.StreamRequestHandler):
+    def read_request(self):
+        length = self.rfile.read(4)
+        if len(length) < 4:
+            return None
+        return self.rfile.read(int(length, 16)).decode('utf-8')
+
+    def okay(self, payload=None):
+        data = b'OKAY'
+        if payload is not None:
+            payload = payload.encode('utf-8')
+            data += f"{len(payload):04x}".encode('ascii') + payload
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def fail(self, message):
+        message = message.encode('utf-8')
+        self.wfile.write(b'FAIL' + f"{len(message):04x}".encode('ascii') + message)
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        while True:
+            service = self.read_request()
+            if service is None:
+                return
+            if service == 'host:devices':
+                self.okay(''.join(f"{serial}\tdevice\n" for serial in server.serials))
+                return
+            if service == 'host:transport-any' or service.startswith('host:transport:'):
+                serial = service.split(':', 2)[2] if service.count(':') == 2 else None
+                if serial is not None and serial not in server.serials:
+                    self.fail(f"device '{serial}' not found")
+                    return
+                self.okay()
+                continue
+            if service == 'exec:sh':
+                self.okay()
+                self.shell()
+                return
+            self.fail(f"unknown service {service}")
+            return
+
+    def shell(self):
+        try:
+            for line in self.rfile:
+                match = COMMAND_RE.match(line.decode('utf-8').rstrip('\n'))
+                if match is None:
+                    continue
+                command, marker = match.groups()
+                status, output = self.server.run(command)
+                self.wfile.write(f"{output}\n{marker}{status}\n".encode('utf-8'))
+                self.wfile.flush()
+        except ConnectionError:
+            pass  # the client resets the stream when it closes
+
+
+def serve(port=0, **options):
+    # Starts a fake adb server in a background thread; returns it (port in server.port)
+    server = FakeAdbServer(('127.0.0.1', port), **options)
+    server.port = server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True, name='fake-adb').start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake adb server')
+    parser.add_argument('--port', type=int, default=5038)
+    parser.add_argument('--serial', action='append', help='device serial to report (repeatable)')
+    parser.add_argument('--command-latency', type=float, default=0.0, help='delay per shell command, seconds')
+    parser.add_argument('--fail-every', type=int, default=0, help='fail every Nth shell command')
+    args = parser.parse_args()
+
+    server = FakeAdbServer(('127.0.0.1', args.port), serials=args.serial or ('emulator-5554',),
+                           command_latency=args.command_latency, fail_every=args.fail_every)
+    print(f"Fake adb server on 127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(server.stats())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+import json
+import time
+from types import SimpleNamespace
+
+from selenium.webdriver.remote.command import Command
+
+# Stand-ins for the Appium driver and the Groq client so the server can be
+# exercised without a phone or an API key.
+
+class FakeElement:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def click(self):
+        self.driver.advance()
+
+    def send_keys(self, text):
+        self.driver.typed.append(text)
+
+
+class FakeDriver:
+    # Serves a sequence of recorded page sources. Gestures and GOBACK move to
+    # the next screen, HOME goes back to the first one.
+    def __init__(self, screens, latency=0.0):
+        self.screens = screens
+        self.latency = latency
+        self.index = 0
+        self.typed = []
+        self.commands = []
+        self.switch_to = SimpleNamespace(active_element=FakeElement(self))
+
+    @property
+    def page_source(self):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.screens[min(self.index, len(self.screens) - 1)]
+
+    def advance(self):
+        self.index += 1
+
+    def execute(self, command, params=None):
+        self.commands.append(command)
+        if command == Command.W3C_ACTIONS:
+            self.advance()
+        return {'value': None}
+
+    def press_keycode(self, keycode):
+        self.commands.append(f"keycode {keycode}")
+        if keycode == 3:
+            self.index = 0
+
+    def back(self):
+        self.advance()
+
+    def find_element(self, by=None, value=None):
+        return FakeElement(self)
+
+    def find_elements(self, by=None, value=None):
+        return [FakeElement(self)]
+
+    def get_window_size(self):
+        return {'width': 1080, 'height': 2400}
+
+    def quit(self):
+        pass
+
+
+class FakeGroq:
+    # Mimics groq.Groq().chat.completions.create. Responses are produced by
+    # respond(messages) (default: replay `actions` in order). `latency` is the
+    # time to the first token and `token_latency` the delay per streamed chunk.
+    def __init__(self, actions=(), respond=None, latency=0.0, token_latency=0.0, chunk_size=8):
+        self.actions = list(actions)
+        self.respond = respond
+        self.latency = latency
+        self.token_latency = token_latency
+        self.chunk_size = chunk_size
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def next_content(self, messages):
+        if self.respond is not None:
+            return self.respond(messages)
+        action = self.actions[min(self.calls, len(self.actions) - 1)] if self.actions else {'task_complete': True}
+        return json.dumps(action)
+
+    def create(self, messages=None, stream=False, **kwargs):
+        content = self.next_content(messages)
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if not stream:
+            if self.token_latency:
+                time.sleep(self.token_latency * -(-len(content) // self.chunk_size))  # whole generation
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+        return self.stream_chunks(content)
+
+    def stream_chunks(self, content):
+        for start in range(0, len(content), self.chunk_size):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            delta = SimpleNamespace(content=content[start:start + self.chunk_size])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
@@ -0,0 +1,165 @@
+import json
+import os
+import random
+import re
+
+from lxml import etree
+
+# Page sources for offline benchmarks. Recorded screens only exist in their
+# compressed form (the dataset and the interaction log), so they are expanded
+# back into UiAutomator2-style hierarchies that compress to the same lines.
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATASET_PATH = os.path.join(ROOT_DIR, 'youtube_interaction_dataset_auto.json')
+LOG_PATH = os.path.join(ROOT_DIR, 'ai_interaction_log.txt')
+
+LINE_RE = re.compile(r'^(.*)\|(?:Bounds:)?(\[[^|]*\]\[[^|]*\])\|(\w*)$')
+TEXT_CLASSES = ('TextView', 'EditText', 'Button', 'CheckBox', 'Switch')
+WIDGET_PACKAGE = {
+    'View': 'android.view',
+    'ViewPager': 'androidx.viewpager.widget',
+    'RecyclerView': 'androidx.recyclerview.widget',
+    'LauncherAppWidgetHostView': 'com.android.launcher3.widget',
+}
+
+def node_attrib(class_name, bounds, text='', content_desc='', clickable=False, index=0):
+    package = WIDGET_PACKAGE.get(class_name, 'android.widget')
+    return {
+        'index': str(index),
+        'package': 'com.google.android.apps.nexuslauncher',
+        'class': f"{package}.{class_name}",
+        'text': text,
+        'content-desc': content_desc,
+        'checkable': 'false',
+        'checked': 'false',
+        'clickable': 'true' if clickable else 'false',
+        'enabled': 'true',
+        'focusable': 'true' if clickable else 'false',
+        'focused': 'false',
+        'long-clickable': 'false',
+        'password': 'false',
+        'scrollable': 'false',
+        'selected': 'false',
+        'bounds': bounds,
+        'displayed': 'true',
+    }
+
+def new_hierarchy():
+    return etree.Element('hierarchy', {'index': '0', 'class': 'hierarchy', 'rotation': '0',
+                                       'width': '1080', 'height': '2400'})
+
+def add_node(parent, attrib):
+    return etree.SubElement(parent, attrib['class'], attrib)
+
+def to_page_source(root):
+    return etree.tostring(root, encoding='UTF-8', xml_declaration=True, standalone=True).decode('utf-8')
+
+def screen_info_to_page_source(screen_info):
+    # Rebuild a hierarchy whose compressed form equals screen_info
+    root = new_hierarchy()
+    frame = add_node(root, node_attrib('FrameLayout', '[0,0][1080,2400]'))
+    container = add_node(frame, node_attrib('LinearLayout', '[0,0][1080,2400]'))
+    for index, line in enumerate(screen_info.splitlines()):
+        match = LINE_RE.match(line)
+        if not match:
+            continue
+        label, bounds, class_name = match.groups()
+        if class_name in TEXT_CLASSES:
+            attrib = node_attrib(class_name, bounds, text=label, clickable=True, index=index)
+        else:
+            attrib = node_attrib(class_name, bounds, content_desc=label, index=index)
+        wrapper = add_node(container, node_attrib('FrameLayout', bounds, index=index))
+        add_node(wrapper, attrib)
+        # Decorations that carry no description and are dropped by compress_xml
+        add_node(wrapper, node_attrib('ImageView', bounds, index=1))
+    return to_page_source(root)
+
+def recorded_screens():
+    # Unique compressed screens from the sample dataset and the interaction log
+    screens = []
+    if os.path.exists(DATASET_PATH):
+        with open(DATASET_PATH, 'r', encoding='utf-8') as f:
+            for episode in json.load(f):
+                for step in episode['steps']:
+                    screens.append(step['screen_info'])
+    if os.path.exists(LOG_PATH):
+        with open(LOG_PATH, 'r', encoding='utf-8') as f:
+            for block in f.read().split('Screen Information:\n')[1:]:
+                screens.append(block.split('\n\n', 1)[0].strip())
+    return list(dict.fromkeys(screens))
+
+def recorded_page_sources():
+    return [screen_info_to_page_source(screen) for screen in recorded_screens()]
+
+def synthetic_page_source(rows=500, depth=8, seed=0):
+    # A scrolling feed: every row sits `depth` containers deep and holds a
+    # clickable title, a described thumbnail and a few undescribed decorations
+    rng = random.Random(seed)
+    root = new_hierarchy()
+    parent = add_node(root, node_attrib('FrameLayout', '[0,0][1080,2400]'))
+    feed = add_node(parent, node_attrib('RecyclerView', '[0,136][1080,2337]'))
+    for row in range(rows):
+        top = 136 + (row * 240) % 2000
+        bounds = f"[0,{top}][1080,{top + 240}]"
+        node = feed
+        for level in range(depth):
+            node = add_node(node, node_attrib('LinearLayout' if level % 2 else 'FrameLayout', bounds))
+        title = ' '.join(rng.choice(('Video', 'Live', 'Music', 'Shorts', 'News', 'Mix')) for _ in range(4))
+        add_node(node, node_attrib('TextView', bounds, text=f"{title} {row}", clickable=True))
+        add_node(node, node_attrib('ImageView', bounds, content_desc=f"Thumbnail {row}"))
+        add_node(node, node_attrib('TextView', bounds, text=f"{rng.randint(1, 999)}K views"))
+        for _ in range(3):
+            add_node(node, node_attrib('View', bounds))
+    return to_page_source(root)
+
+def deep_page_source(depth=1500):
+    # A single chain of nested layouts, deeper than Python's recursion limit
+    root = new_hierarchy()
+    node = root
+    for level in range(depth):
+        node = add_node(node, node_attrib('FrameLayout', '[0,0][1080,2400]', content_desc=f"Level {level}"))
+    return to_page_source(root)
+
+LOG_ACTION_RE = re.compile(r'^Type: (\w*), Element: (.*), Bounds: (.*), Description: (.*)$')
+
+def recorded_episodes():
+    # [{'command', 'screens': [page source, ...], 'actions': [action, ...]}]
+    # The last action of every episode has task_complete set.
+    episodes = []
+    if os.path.exists(DATASET_PATH):
+        with open(DATASET_PATH, 'r', encoding='utf-8') as f:
+            for episode in json.load(f):
+                actions = []
+                for step in episode['steps']:
+                    action = dict(step['action'])
+                    action['element'] = action.pop('element_id', '')
+                    actions.append(action)
+                actions[-1]['task_complete'] = True
+                episodes.append({
+                    'command': episode['command'],
+                    'screens': [screen_info_to_page_source(step['screen_info']) for step in episode['steps']],
+                    'actions': actions
+                })
+    if os.path.exists(LOG_PATH):
+        with open(LOG_PATH, 'r', encoding='utf-8') as f:
+            blocks = f.read().split('\nStep ')
+        command, screens, actions = None, [], []
+        for block in blocks:
+            if 'Screen Information:\n' not in block:
+                continue
+            command = block.split('Command: ', 1)[1].split('\n', 1)[0].strip()
+            screens.append(screen_info_to_page_source(block.split('Screen Information:\n', 1)[1].split('\n\n', 1)[0]))
+            fields = {}
+            for line in block.splitlines():
+                match = LOG_ACTION_RE.match(line)
+                if match:
+                    fields.update(zip(('action_type', 'element', 'bounds', 'description'), match.groups()))
+                elif line.startswith('Screen Awareness: '):
+                    fields['screen_awareness'] = line[len('Screen Awareness: '):]
+            fields['previous_step_successful'] = 'Previous step successful: True' in block
+            fields['task_complete'] = 'Task complete: True' in block
+            actions.append(fields)
+            if fields['task_complete']:
+                episodes.append({'command': command, 'screens': screens, 'actions': actions})
+                screens, actions = [], []
+    return episodes
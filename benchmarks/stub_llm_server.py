@@ -0,0 +1,170 @@
+import argparse
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the Groq chat completions endpoint, for exercising the
+# real client (connection reuse, rate limits, retries) without an API key:
+#
+#   python -m benchmarks.stub_llm_server --port 8099 --rate-limit-every 3
+#   GROQ_BASE_URL=http://127.0.0.1:8099 GROQ_API_KEY=stub python automation_server.py
+#
+# Every Nth request can be answered with a 429 (with Retry-After) or a 500.
+
+COMPLETIONS_PATH = '/openai/v1/chat/completions'
+
+DEFAULT_ACTION = {
+    "action_type": "CLICK",
+    "element": "YouTube",
+    "bounds": "[0,136][320,262]",
+    "task_complete": True,
+    "previous_step_successful": True,
+    "description": "Click the YouTube icon to open the app",
+    "screen_awareness": "The home screen is displayed."
+}
+
+
+class StubLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, actions=None, latency=0.0, token_latency=0.0, chunk_size=8,
+                 rate_limit_every=0, retry_after=1.0, fail_every=0):
+        super().__init__(address, StubHandler)
+        self.actions = itertools.cycle(actions or [DEFAULT_ACTION])
+        self.latency = latency
+        self.token_latency = token_latency
+        self.chunk_size = chunk_size
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.fail_every = fail_every
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = set()
+        self.responses = {200: 0, 429: 0, 500: 0}
+
+    def next_response(self):
+        # (status, content) for the next request
+        with self.lock:
+            self.requests += 1
+            if self.rate_limit_every and self.requests % self.rate_limit_every == 0:
+                status, content = 429, None
+            elif self.fail_every and self.requests % self.fail_every == 0:
+                status, content = 500, None
+            else:
+                status, content = 200, json.dumps(next(self.actions))
+            self.responses[status] += 1
+        return status, content
+
+    def stats(self):
+        with self.lock:
+            return {'requests': self.requests, 'connections': len(self.connections),
+                    'responses': dict(self.responses)}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, so connection reuse shows up in stats
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=()):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        with server.lock:
+            server.connections.add(self.client_address)
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if self.path != COMPLETIONS_PATH:
+            self.send_json(404, {'error': {'message': f"Unknown path {self.path}"}})
+            return
+        status, content = server.next_response()
+        if status == 429:
+            self.send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'requests'}},
+                           [('Retry-After', str(server.retry_after))])
+            return
+        if status == 500:
+            self.send_json(500, {'error': {'message': 'Internal server error'}})
+            return
+        if server.latency:
+            time.sleep(server.latency)
+        model = request.get('model', 'stub')
+        if request.get('stream'):
+            self.stream(model, content)
+            return
+        if server.token_latency:
+            time.sleep(server.token_latency * -(-len(content) // server.chunk_size))
+        self.send_json(200, {
+            'id': f"chatcmpl-{server.requests}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                         'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+        })
+
+    def stream(self, model, content):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        pieces = [content[i:i + self.server.chunk_size] for i in range(0, len(content), self.server.chunk_size)]
+        for index, piece in enumerate(pieces + [None]):
+            if piece is not None and self.server.token_latency:
+                time.sleep(self.server.token_latency)
+            chunk = {
+                'id': 'chatcmpl-stream',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': piece} if piece is not None else {},
+                             'finish_reason': None if piece is not None else 'stop'}]
+            }
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+        self.write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, text):
+        data = text.encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+
+def serve(port=0, **options):
+    # Starts a stub server in a background thread; returns it (URL in server.url)
+    server = StubLLMServer(('127.0.0.1', port), **options)
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True, name='stub-llm').start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='Stub Groq chat completions server')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.0, help='time to first token, seconds')
+    parser.add_argument('--token-latency', type=float, default=0.0, help='delay per streamed chunk, seconds')
+    parser.add_argument('--rate-limit-every', type=int, default=0, help='answer every Nth request with 429')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After sent with 429s, seconds')
+    parser.add_argument('--fail-every', type=int, default=0, help='answer every Nth request with 500')
+    args = parser.parse_args()
+
+    server = StubLLMServer(('127.0.0.1', args.port), latency=args.latency, token_latency=args.token_latency,
+                           rate_limit_every=args.rate_limit_every, retry_after=args.retry_after,
+                           fail_every=args.fail_every)
+    print(f"Stub LLM server on http://127.0.0.1:{args.port}{COMPLETIONS_PATH}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(server.stats())
+
+if __name__ == '__main__':
+    main()
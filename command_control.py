@@ -0,0 +1,196 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Cancellation and budgets for one command, and the ordered queue of a
+# session's commands. A CommandControl goes with a command from the moment it
+# is accepted. cancel() (from /cancel, or once the wall-clock or token budget
+# is spent) takes it out of the device queue if it has not started, wakes the
+# step loop if it is waiting for the model and stops a streaming model call at
+# its next chunk. The step loop checks it between steps.
+
+REASONS = {
+    'cancelled': 'Command cancelled',
+    'timeout': 'Command ran out of time',
+    'token_budget': 'Command used up its token budget'
+}
+
+def cancelled_result(reason):
+    return {"status": "cancelled", "reason": reason, "message": REASONS[reason]}
+
+
+class CommandCancelled(Exception):
+    def __init__(self, reason):
+        super().__init__(REASONS[reason])
+        self.reason = reason
+
+
+class CommandControl:
+    # timeout: seconds from acceptance, token_budget: model tokens sent and
+    # received; 0 means no limit
+    def __init__(self, command, timeout=0, token_budget=0):
+        self.command_id = str(uuid.uuid4())
+        self.command = command
+        self.timeout = timeout
+        self.token_budget = token_budget
+        self.created_at = time.time()
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.tokens_used = 0
+        self.status = 'queued'
+        self.reason = None
+        self.future = None  # the device queue entry, cancelled while still queued
+        self.callbacks = {}
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self, reason='cancelled'):
+        # False if the command was already cancelled
+        with self.lock:
+            if self.reason is not None:
+                return False
+            self.reason = reason
+            callbacks = list(self.callbacks.values())
+            future = self.future
+        self.event.set()
+        if future is not None and future.cancel():
+            self.status = 'cancelled'
+        for callback in callbacks:
+            callback()
+        return True
+
+    def on_cancel(self, callback):
+        # Calls callback() on cancellation, right away if that already
+        # happened. Returns a handle for remove().
+        with self.lock:
+            if self.reason is None:
+                handle = object()
+                self.callbacks[handle] = callback
+                return handle
+        callback()
+        return None
+
+    def remove(self, handle):
+        with self.lock:
+            self.callbacks.pop(handle, None)
+
+    def remaining(self):
+        # Seconds left, or None without a deadline
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def check(self):
+        # Raises CommandCancelled once the command is cancelled or out of time
+        if self.deadline is not None and self.reason is None and time.monotonic() >= self.deadline:
+            self.cancel('timeout')
+        if self.reason is not None:
+            raise CommandCancelled(self.reason)
+
+    def charge(self, tokens):
+        # Counts model tokens; going over the budget cancels the command
+        with self.lock:
+            self.tokens_used += tokens
+            over = self.token_budget and self.tokens_used > self.token_budget
+        if over:
+            self.cancel('token_budget')
+
+    def wait(self, event):
+        # Waits for the event, but not past cancellation or the deadline
+        handle = self.on_cancel(event.set)
+        try:
+            event.wait(self.remaining())
+        finally:
+            self.remove(handle)
+        self.check()
+
+    def result(self, future):
+        # future.result(), abandoning the future on cancellation or timeout
+        done = threading.Event()
+        future.add_done_callback(lambda _: done.set())
+        try:
+            self.wait(done)
+        except CommandCancelled:
+            future.cancel()
+            raise
+        return future.result()
+
+    def to_dict(self):
+        return {
+            'command_id': self.command_id,
+            'command': self.command,
+            'status': self.status,
+            'reason': self.reason,
+            'timeout': self.timeout,
+            'remaining': self.remaining(),
+            'token_budget': self.token_budget,
+            'tokens_used': self.tokens_used,
+            'created_at': self.created_at
+        }
+
+
+class CommandQueue:
+    # A session's commands in arrival order. Only the oldest one runs; the
+    # others wait for it, so two requests never drive the session's driver at
+    # the same time.
+    def __init__(self):
+        self.commands = OrderedDict()  # command id -> CommandControl
+        self.cond = threading.Condition()
+
+    def add(self, control, dispatch):
+        # Queues the command and returns dispatch(), which hands it to the
+        # device queue. Both happen under the lock, so the two queues always
+        # agree on the order and no device worker waits on a command that is
+        # still behind it.
+        with self.cond:
+            self.commands[control.command_id] = control
+            try:
+                dispatched = dispatch()
+            except BaseException:
+                # Not queued on the device; it must not hold up the commands after it
+                del self.commands[control.command_id]
+                self.cond.notify_all()
+                raise
+        control.on_cancel(lambda: self.cancelled(control))
+        return dispatched
+
+    def cancelled(self, control):
+        # Drops a command cancelled before it started and wakes the waiters
+        with self.cond:
+            if control.status == 'cancelled':
+                self.commands.pop(control.command_id, None)
+            self.cond.notify_all()
+
+    def run(self, control, fn):
+        # fn() once every earlier command has finished. Raises
+        # CommandCancelled if the command is cancelled or times out first.
+        try:
+            with self.cond:
+                self.commands.setdefault(control.command_id, control)
+                while True:
+                    control.check()
+                    if next(iter(self.commands)) == control.command_id:
+                        break
+                    self.cond.wait(control.remaining())
+                control.status = 'running'
+            return fn()
+        finally:
+            with self.cond:
+                self.commands.pop(control.command_id, None)
+                control.status = 'cancelled' if control.reason is not None else 'finished'
+                self.cond.notify_all()
+
+    def cancel(self, command_id=None, reason='cancelled'):
+        # Cancels one command, or all of them; returns the ids cancelled
+        with self.cond:
+            controls = [control for control in self.commands.values()
+                        if command_id is None or control.command_id == command_id]
+        return [control.command_id for control in controls if control.cancel(reason)]
+
+    def to_list(self):
+        with self.cond:
+            return [control.to_dict() for control in self.commands.values()]
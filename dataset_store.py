@@ -0,0 +1,242 @@
+import argparse
+import json
+import mmap
+import os
+import random
+import struct
+import sys
+
+# Compact, deduplicated dataset format with memory-mapped random access.
+#
+# Every distinct string (element line, task, action) is stored once in a
+# string table and referred to by id; a screen is a list of element line ids
+# and identical screens are stored once. Steps are fixed-width records, so
+# step i is found by offset arithmetic and nothing is parsed until it is read.
+#
+#   python dataset_store.py convert youtube_interaction_dataset_auto.json dataset.steps
+#   python dataset_store.py convert dataset/ dataset.steps      # gen_dataset.py shards
+#   python dataset_store.py stats dataset.steps
+#
+# Layout (little-endian): header, string offsets (u64, count + 1), string
+# bytes (UTF-8), screen offsets (u64, count + 1) into the line id array (u32),
+# step records, episode records.
+
+MAGIC = b'STEPS\x00\x01\x00'
+HEADER = struct.Struct('<8s11Q')
+STEP = struct.Struct('<IIIII')  # episode, step number, task string, screen, action string
+EPISODE = struct.Struct('<III')  # first step, step count, command string
+OFFSET = struct.Struct('<Q')
+LINE_ID = struct.Struct('<I')
+
+def example_prompt(task, screen_info):
+    # Per-step prompt used both for collection and for training examples
+    return f"""Current task: {task}
+
+Screen information:
+{screen_info}"""
+
+def read_source(path):
+    # Episodes ({'command', 'steps': [{'step', 'task', 'screen_info', 'action'}]}) from a
+    # legacy JSON dataset, a JSONL file or a directory of gen_dataset.py shards
+    if os.path.isdir(path):
+        names = sorted(name for name in os.listdir(path) if name.startswith('episodes-') and name.endswith('.jsonl'))
+        for name in names:
+            yield from read_source(os.path.join(path, name))
+    elif path.endswith('.jsonl'):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+
+
+class DatasetWriter:
+    def __init__(self):
+        self.strings = {}  # string -> id
+        self.screens = {}  # tuple of line ids -> screen id
+        self.steps = []
+        self.episodes = []
+
+    def string_id(self, value):
+        string_id = self.strings.get(value)
+        if string_id is None:
+            string_id = self.strings[value] = len(self.strings)
+        return string_id
+
+    def screen_id(self, screen_info):
+        lines = tuple(self.string_id(line) for line in screen_info.split('\n')) if screen_info else ()
+        screen_id = self.screens.get(lines)
+        if screen_id is None:
+            screen_id = self.screens[lines] = len(self.screens)
+        return screen_id
+
+    def add_episode(self, episode):
+        first = len(self.steps)
+        for index, step in enumerate(episode['steps']):
+            task = step.get('task', episode['command'])
+            action = json.dumps(step['action'], sort_keys=True, ensure_ascii=False)
+            self.steps.append((len(self.episodes), step.get('step', index + 1), self.string_id(task),
+                               self.screen_id(step['screen_info']), self.string_id(action)))
+        self.episodes.append((first, len(self.steps) - first, self.string_id(episode['command'])))
+
+    def write(self, path):
+        strings = [value.encode('utf-8') for value, _ in sorted(self.strings.items(), key=lambda item: item[1])]
+        screens = [lines for lines, _ in sorted(self.screens.items(), key=lambda item: item[1])]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(b'\0' * HEADER.size)
+            sections = []
+
+            sections.append(f.tell())  # string offsets
+            offset = 0
+            for value in strings:
+                f.write(OFFSET.pack(offset))
+                offset += len(value)
+            f.write(OFFSET.pack(offset))
+            sections.append(f.tell())  # string bytes
+            for value in strings:
+                f.write(value)
+
+            sections.append(f.tell())  # screen offsets
+            offset = 0
+            for lines in screens:
+                f.write(OFFSET.pack(offset))
+                offset += len(lines)
+            f.write(OFFSET.pack(offset))
+            sections.append(f.tell())  # line ids
+            for lines in screens:
+                f.write(struct.pack(f'<{len(lines)}I', *lines))
+
+            sections.append(f.tell())  # steps
+            for record in self.steps:
+                f.write(STEP.pack(*record))
+            sections.append(f.tell())  # episodes
+            for record in self.episodes:
+                f.write(EPISODE.pack(*record))
+
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, len(strings), len(screens), len(self.steps), len(self.episodes),
+                                *sections, 0))
+        os.replace(tmp_path, path)
+
+
+def convert(source, path):
+    writer = DatasetWriter()
+    for episode in read_source(source):
+        writer.add_episode(episode)
+    writer.write(path)
+    return len(writer.episodes), len(writer.steps)
+
+
+class StepDataset:
+    # Random access to the steps of a converted file. Only the header is read
+    # up front; strings and screens are decoded when a step is accessed, with
+    # the most recently used screens kept decoded.
+    def __init__(self, path, screen_cache_size=256):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = HEADER.unpack_from(self.data, 0)
+        if fields[0] != MAGIC:
+            raise ValueError(f"{path} is not a step dataset")
+        (self.string_count, self.screen_count, self.step_count, self.episode_count,
+         self.string_offsets, self.string_bytes, self.screen_offsets, self.line_ids,
+         self.steps_offset, self.episodes_offset, _) = fields[1:]
+        self.screen_cache = {}
+        self.screen_cache_size = screen_cache_size
+
+    def __len__(self):
+        return self.step_count
+
+    def string(self, string_id):
+        start, = OFFSET.unpack_from(self.data, self.string_offsets + string_id * OFFSET.size)
+        end, = OFFSET.unpack_from(self.data, self.string_offsets + (string_id + 1) * OFFSET.size)
+        return self.data[self.string_bytes + start:self.string_bytes + end].decode('utf-8')
+
+    def screen(self, screen_id):
+        screen_info = self.screen_cache.pop(screen_id, None)
+        if screen_info is None:
+            start, = OFFSET.unpack_from(self.data, self.screen_offsets + screen_id * OFFSET.size)
+            end, = OFFSET.unpack_from(self.data, self.screen_offsets + (screen_id + 1) * OFFSET.size)
+            ids = struct.unpack_from(f'<{end - start}I', self.data, self.line_ids + start * LINE_ID.size)
+            screen_info = '\n'.join(self.string(line_id) for line_id in ids)
+            if len(self.screen_cache) >= self.screen_cache_size:
+                self.screen_cache.pop(next(iter(self.screen_cache)))
+        self.screen_cache[screen_id] = screen_info  # reinserted as most recent
+        return screen_info
+
+    def record(self, index):
+        if not 0 <= index < self.step_count:
+            raise IndexError(index)
+        return STEP.unpack_from(self.data, self.steps_offset + index * STEP.size)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.step_count
+        episode, step, task, screen, action = self.record(index)
+        return {
+            'episode': episode,
+            'step': step,
+            'task': self.string(task),
+            'screen_info': self.screen(screen),
+            'action': json.loads(self.string(action))
+        }
+
+    def __iter__(self):
+        for index in range(self.step_count):
+            yield self[index]
+
+    def episode(self, index):
+        first, count, command = EPISODE.unpack_from(self.data, self.episodes_offset + index * EPISODE.size)
+        return {'command': self.string(command), 'steps': [self[i] for i in range(first, first + count)]}
+
+    def examples(self, shuffle=False, seed=0):
+        # Training pairs: {'prompt': per-step prompt, 'completion': action JSON}
+        order = list(range(self.step_count))
+        if shuffle:
+            random.Random(seed).shuffle(order)
+        for index in order:
+            _, _, task, screen, action = self.record(index)
+            yield {'prompt': example_prompt(self.string(task), self.screen(screen)),
+                   'completion': self.string(action)}
+
+    def stats(self):
+        return {
+            'episodes': self.episode_count,
+            'steps': self.step_count,
+            'screens': self.screen_count,
+            'strings': self.string_count,
+            'bytes': len(self.data)
+        }
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert and inspect compact step datasets')
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert_parser = commands.add_parser('convert', help='convert a JSON dataset or shard directory')
+    convert_parser.add_argument('source')
+    convert_parser.add_argument('output')
+    stats_parser = commands.add_parser('stats', help='print the size of a converted dataset')
+    stats_parser.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        episodes, steps = convert(args.source, args.output)
+        source_bytes = sum(os.path.getsize(os.path.join(args.source, name)) for name in os.listdir(args.source)) \
+            if os.path.isdir(args.source) else os.path.getsize(args.source)
+        print(f"{episodes} episodes, {steps} steps: {source_bytes} bytes -> {os.path.getsize(args.output)} bytes")
+    else:
+        dataset = StepDataset(args.path)
+        print(json.dumps(dataset.stats(), indent=2))
+        dataset.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
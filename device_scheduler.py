@@ -0,0 +1,220 @@
+import json
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+# Registry of attached devices and a scheduler that binds sessions to free
+# devices and runs commands with at most one active command per device. Each
+# device has its own worker thread, FIFO queue and (when no session holds it)
+# also takes work from a shared queue, so throughput grows with the fleet.
+
+class Device:
+    def __init__(self, udid, name=None, platform_version=None, capabilities=None, system_port=None):
+        self.udid = udid
+        self.name = name or udid
+        self.platform_version = platform_version
+        self.capabilities = capabilities or {}
+        self.system_port = system_port
+        self.session_id = None
+        self.queue = deque()
+        self.active = None
+        self.online = True
+        self.added_at = time.time()
+        self.last_used = time.time()
+        self.busy_since = None
+        self.busy_seconds = 0.0
+        self.commands_run = 0
+
+    def to_dict(self):
+        busy = self.busy_seconds
+        if self.busy_since is not None:
+            busy += time.time() - self.busy_since
+        uptime = max(time.time() - self.added_at, 1e-9)
+        return {
+            'udid': self.udid,
+            'name': self.name,
+            'platform_version': self.platform_version,
+            'online': self.online,
+            'session_id': self.session_id,
+            'busy': self.active is not None,
+            'active_command': self.active,
+            'queue_depth': len(self.queue),
+            'commands_run': self.commands_run,
+            'utilization': busy / uptime
+        }
+
+
+def discover_adb_devices(adb='adb', base_port=8200):
+    result = subprocess.run([adb, 'devices', '-l'], capture_output=True, text=True, timeout=30)
+    devices = []
+    for line in result.stdout.strip().split('\n')[1:]:
+        fields = line.split()
+        if len(fields) < 2 or fields[1] != 'device':
+            continue
+        udid = fields[0]
+        details = dict(field.split(':', 1) for field in fields[2:] if ':' in field)
+        try:
+            version = subprocess.run([adb, '-s', udid, 'shell', 'getprop', 'ro.build.version.release'],
+                                     capture_output=True, text=True, timeout=30).stdout.strip()
+        except subprocess.SubprocessError:
+            version = None
+        devices.append(Device(udid, name=details.get('model', udid).replace('_', ' '),
+                              platform_version=version or None, system_port=base_port + len(devices)))
+    return devices
+
+def load_devices_from_config(path, base_port=8200):
+    # [{"udid": ..., "name": ..., "platform_version": ..., "capabilities": {...}}, ...]
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    return [Device(entry['udid'], name=entry.get('name'), platform_version=entry.get('platform_version'),
+                   capabilities=entry.get('capabilities'),
+                   system_port=entry.get('system_port', base_port + index))
+            for index, entry in enumerate(entries)]
+
+
+class DeviceScheduler:
+    def __init__(self, devices=()):
+        self.devices = {}
+        self.shared_queue = deque()
+        self.cond = threading.Condition()
+        self.running = True
+        for device in devices:
+            self.add_device(device)
+
+    def add_device(self, device):
+        with self.cond:
+            existing = self.devices.get(device.udid)
+            if existing is not None:
+                existing.online = True
+                self.cond.notify_all()
+                return existing
+            self.devices[device.udid] = device
+        threading.Thread(target=self._worker, args=(device,), daemon=True,
+                         name=f"device-{device.udid}").start()
+        return device
+
+    def sync_devices(self, devices):
+        # Adds newly attached devices and marks missing ones offline
+        seen = set()
+        for device in devices:
+            self.add_device(device)
+            seen.add(device.udid)
+        with self.cond:
+            for udid, device in self.devices.items():
+                if udid not in seen:
+                    device.online = False
+
+    def allocate(self, session_id, udid=None):
+        # Binds a free device to the session; None when no device is free.
+        # A device still running or holding shared-queue work is not free: a
+        # second driver on it would end the running job's session.
+        with self.cond:
+            for device in self._candidates(udid):
+                if device.session_id is None and device.active is None and not device.queue:
+                    device.session_id = session_id
+                    device.last_used = time.time()
+                    return device
+        return None
+
+    def take_over_idle(self, session_id, udid=None):
+        # Rebinds the device whose session has been idle the longest.
+        # Returns (device, previous session id) or (None, None).
+        with self.cond:
+            idle = [device for device in self._candidates(udid)
+                    if device.active is None and not device.queue]
+            if not idle:
+                return None, None
+            device = min(idle, key=lambda device: device.last_used)
+            previous = device.session_id
+            device.session_id = session_id
+            device.last_used = time.time()
+            self.cond.notify_all()
+            return device, previous
+
+    def _candidates(self, udid):
+        return [device for device in self.devices.values()
+                if device.online and (udid is None or device.udid == udid)]
+
+    def release(self, session_id):
+        with self.cond:
+            for device in self.devices.values():
+                if device.session_id == session_id:
+                    device.session_id = None
+                    device.last_used = time.time()
+            self.cond.notify_all()
+
+    def device_for(self, session_id):
+        with self.cond:
+            for device in self.devices.values():
+                if device.session_id == session_id:
+                    return device
+        return None
+
+    def submit(self, fn, udid=None, label=None):
+        # Queues fn(device) on the given device, or on any free device that no
+        # session holds. Returns a Future with fn's result.
+        future = Future()
+        item = (fn, future, label)
+        with self.cond:
+            if udid is None:
+                self.shared_queue.append(item)
+            elif udid in self.devices:
+                self.devices[udid].queue.append(item)
+            else:
+                raise KeyError(f"Unknown device: {udid}")
+            self.cond.notify_all()
+        return future
+
+    def _next_item(self, device):
+        if device.queue:
+            return device.queue.popleft()
+        if device.online and device.session_id is None and self.shared_queue:
+            return self.shared_queue.popleft()
+        return None
+
+    def _worker(self, device):
+        while True:
+            with self.cond:
+                item = self._next_item(device)
+                while item is None and self.running:
+                    self.cond.wait()
+                    item = self._next_item(device)
+                if item is None:
+                    return
+                fn, future, label = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                device.active = label or 'command'
+                device.busy_since = time.time()
+            try:
+                future.set_result(fn(device))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self.cond:
+                    device.busy_seconds += time.time() - device.busy_since
+                    device.busy_since = None
+                    device.active = None
+                    device.commands_run += 1
+                    device.last_used = time.time()
+
+    def status(self):
+        with self.cond:
+            devices = [device.to_dict() for device in self.devices.values()]
+            shared_depth = len(self.shared_queue)
+        online = [device for device in devices if device['online']]
+        return {
+            'devices': devices,
+            'online': len(online),
+            'busy': sum(1 for device in online if device['busy']),
+            'queue_depth': shared_depth + sum(device['queue_depth'] for device in devices),
+            'shared_queue_depth': shared_depth,
+            'utilization': sum(device['utilization'] for device in online) / len(online) if online else 0.0
+        }
+
+    def shutdown(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
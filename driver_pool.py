@@ -0,0 +1,208 @@
+import json
+import threading
+import time
+from collections import deque
+
+# Pool of pre-warmed Appium drivers keyed by their capabilities (which include
+# the device). Creating a driver pays the full UiAutomator2 bootstrap, so
+# drivers are handed back here on session end instead of being quit, checked,
+# reset to the home screen and kept for the next session.
+#
+# `size` caps idle + in-use + warming drivers per key. A device only hosts one
+# UiAutomator2 session at a time, so the default of 1 never warms a second
+# driver while the first one is checked out, and acquire() waits for a driver
+# that is still warming up or being checked on its way back instead of
+# creating a second one.
+
+def pool_key(capabilities):
+    return json.dumps(capabilities, sort_keys=True)
+
+def check_driver(driver):
+    try:
+        driver.get_window_size()
+        return True
+    except Exception:
+        return False
+
+def reset_driver(driver):
+    driver.press_keycode(3)  # HOME
+
+def quit_driver(driver):
+    try:
+        driver.quit()
+    except Exception:
+        pass
+
+
+class DriverPool:
+    def __init__(self, factory, size=1, keepalive=60, health_check=check_driver, reset=reset_driver):
+        # factory(capabilities) creates a new driver
+        self.factory = factory
+        self.size = size
+        self.keepalive = keepalive
+        self.health_check = health_check
+        self.reset = reset
+        self.idle = {}          # key -> deque of [driver, last_checked]
+        self.in_use = {}        # key -> drivers handed out
+        self.pending = {}       # key -> drivers being created
+        self.capabilities = {}  # key -> capabilities
+        self.lock = threading.Condition()  # notified whenever a driver turns idle or goes away
+        self.closed = False
+        self.stats = {'hits': 0, 'misses': 0, 'created': 0, 'replaced': 0, 'discarded': 0}
+        self.maintainer = threading.Thread(target=self._maintain, daemon=True)
+        self.maintainer.start()
+
+    def _register(self, capabilities):
+        key = pool_key(capabilities)
+        self.capabilities[key] = capabilities
+        self.idle.setdefault(key, deque())
+        self.in_use.setdefault(key, 0)
+        self.pending.setdefault(key, 0)
+        return key
+
+    def warm(self, capabilities):
+        # Start filling the pool for these capabilities in the background
+        with self.lock:
+            key = self._register(capabilities)
+        self._refill(key)
+
+    def acquire(self, capabilities, timeout=120):
+        # Raises TimeoutError if the key stays at `size` drivers, none idle,
+        # for `timeout` seconds
+        with self.lock:
+            key = self._register(capabilities)
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                while not self.idle[key] and 0 < self.size <= self._total(key):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"No driver became free within {timeout}s")
+                    self.lock.wait(remaining)
+                if not self.idle[key]:
+                    self.stats['misses'] += 1
+                    self.in_use[key] += 1
+                    break
+                driver, last_checked = self.idle[key].popleft()
+                self.in_use[key] += 1
+            if time.time() - last_checked < self.keepalive or self.health_check(driver):
+                with self.lock:
+                    self.stats['hits'] += 1
+                return driver
+            quit_driver(driver)
+            with self.lock:
+                self.in_use[key] -= 1
+                self.stats['replaced'] += 1
+                self.lock.notify_all()
+        try:
+            driver = self.factory(capabilities)
+        except Exception:
+            with self.lock:
+                self.in_use[key] -= 1
+                self.lock.notify_all()
+            raise
+        with self.lock:
+            self.stats['created'] += 1
+        return driver
+
+    def release(self, driver, capabilities):
+        # Returns a driver to the pool; the check and reset run in the background
+        threading.Thread(target=self._return, args=(driver, pool_key(capabilities)), daemon=True).start()
+
+    def _return(self, driver, key):
+        try:
+            if self.closed or not self.health_check(driver):
+                raise RuntimeError("driver is not healthy")
+            self.reset(driver)
+        except Exception as e:
+            print(f"Discarding pooled driver: {str(e)}")
+            quit_driver(driver)
+            with self.lock:
+                self.in_use[key] -= 1
+                self.stats['discarded'] += 1
+                self.lock.notify_all()
+            self._refill(key)
+            return
+        with self.lock:
+            self.in_use[key] -= 1
+            self.lock.notify_all()
+            if not self.closed and self._total(key) < self.size:
+                self.idle[key].append([driver, time.time()])
+                return
+            self.stats['discarded'] += 1
+        quit_driver(driver)
+
+    def _total(self, key):
+        return len(self.idle[key]) + self.in_use[key] + self.pending[key]
+
+    def _refill(self, key):
+        with self.lock:
+            if self.closed:
+                return
+            missing = self.size - self._total(key)
+            if missing <= 0:
+                return
+            self.pending[key] += missing
+            capabilities = self.capabilities[key]
+        for _ in range(missing):
+            threading.Thread(target=self._create, args=(key, capabilities), daemon=True).start()
+
+    def _create(self, key, capabilities):
+        try:
+            driver = self.factory(capabilities)
+        except Exception as e:
+            print(f"Error warming driver: {str(e)}")
+            driver = None
+        with self.lock:
+            self.pending[key] -= 1
+            self.lock.notify_all()
+            if driver is None:
+                return
+            self.stats['created'] += 1
+            if not self.closed and self._total(key) < self.size:
+                self.idle[key].append([driver, time.time()])
+                return
+        quit_driver(driver)
+
+    def _maintain(self):
+        # Pings idle drivers so Appium's newCommandTimeout never expires them,
+        # and replaces the ones that died
+        while not self.closed:
+            time.sleep(self.keepalive)
+            with self.lock:
+                entries = [(key, entry) for key, idle in self.idle.items() for entry in idle]
+            for key, entry in entries:
+                if self.health_check(entry[0]):
+                    entry[1] = time.time()
+                    continue
+                with self.lock:
+                    try:
+                        self.idle[key].remove(entry)
+                    except ValueError:
+                        continue  # handed out meanwhile
+                    self.stats['replaced'] += 1
+                    self.lock.notify_all()
+                quit_driver(entry[0])
+            with self.lock:
+                keys = list(self.capabilities.keys())
+            for key in keys:
+                self._refill(key)
+
+    def status(self):
+        with self.lock:
+            return {
+                'size': self.size,
+                'idle': sum(len(idle) for idle in self.idle.values()),
+                'in_use': sum(self.in_use.values()),
+                'warming': sum(self.pending.values()),
+                **self.stats
+            }
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            drivers = [entry[0] for idle in self.idle.values() for entry in idle]
+            for idle in self.idle.values():
+                idle.clear()
+        for driver in drivers:
+            quit_driver(driver)
@@ -0,0 +1,139 @@
+import re
+from array import array
+
+# Compact table of the elements on a screen, filled in the same pass as the
+# compressed screen description (see screen_xml.compress_screen). Bounds are
+# parsed once into integer arrays, so the model's "element" / "bounds" can be
+# resolved to tap coordinates or an id-based locator locally instead of by an
+# XPath search of the whole tree on the device.
+
+BOUNDS_RE = re.compile(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]')
+GRID_CELL = 256  # px per spatial index cell
+
+def parse_bounds_ints(bounds):
+    # "[x1,y1][x2,y2]" -> (x1, y1, x2, y2), or None
+    match = BOUNDS_RE.search(bounds or '')
+    return tuple(map(int, match.groups())) if match else None
+
+
+class ElementTable:
+    __slots__ = ('x1', 'y1', 'x2', 'y2', 'labels', 'texts', 'descs', 'classes', 'resource_ids',
+                 'clickable', 'focused', 'by_bounds', 'grid')
+
+    def __init__(self):
+        self.x1 = array('i')
+        self.y1 = array('i')
+        self.x2 = array('i')
+        self.y2 = array('i')
+        self.labels = []
+        self.texts = []
+        self.descs = []
+        self.classes = []
+        self.resource_ids = []
+        self.clickable = bytearray()
+        self.focused = bytearray()
+        self.by_bounds = {}  # bounds string -> [index, ...]
+        self.grid = None  # built on the first hit test
+
+    def __len__(self):
+        return len(self.labels)
+
+    def add(self, bounds, label, text, desc, class_name, resource_id, clickable, focused=False):
+        coords = parse_bounds_ints(bounds)
+        if coords is None:
+            return None
+        index = len(self.labels)
+        self.x1.append(coords[0])
+        self.y1.append(coords[1])
+        self.x2.append(coords[2])
+        self.y2.append(coords[3])
+        self.labels.append(label)
+        self.texts.append(text)
+        self.descs.append(desc)
+        self.classes.append(class_name)
+        self.resource_ids.append(resource_id)
+        self.clickable.append(clickable)
+        self.focused.append(focused)
+        self.by_bounds.setdefault(bounds, []).append(index)
+        self.grid = None
+        return index
+
+    def get(self, index):
+        return {
+            'bounds': f"[{self.x1[index]},{self.y1[index]}][{self.x2[index]},{self.y2[index]}]",
+            'label': self.labels[index],
+            'text': self.texts[index],
+            'desc': self.descs[index],
+            'class': self.classes[index],
+            'resource_id': self.resource_ids[index],
+            'clickable': bool(self.clickable[index]),
+            'focused': bool(self.focused[index])
+        }
+
+    def center(self, index):
+        return (self.x1[index] + self.x2[index]) // 2, (self.y1[index] + self.y2[index]) // 2
+
+    def area(self, index):
+        return (self.x2[index] - self.x1[index]) * (self.y2[index] - self.y1[index])
+
+    def build_grid(self):
+        grid = {}
+        for index in range(len(self.labels)):
+            for cx in range(self.x1[index] // GRID_CELL, self.x2[index] // GRID_CELL + 1):
+                for cy in range(self.y1[index] // GRID_CELL, self.y2[index] // GRID_CELL + 1):
+                    grid.setdefault((cx, cy), []).append(index)
+        self.grid = grid
+
+    def at(self, x, y):
+        # Innermost (smallest) element containing the point, or None
+        if self.grid is None:
+            self.build_grid()
+        best = None
+        for index in self.grid.get((x // GRID_CELL, y // GRID_CELL), ()):
+            if self.x1[index] <= x < self.x2[index] and self.y1[index] <= y < self.y2[index]:
+                if best is None or self.area(index) < self.area(best):
+                    best = index
+        return best
+
+    def find_label(self, label):
+        # Labelled element with this label (exact, then case-insensitive), clickable first
+        label = (label or '').strip()
+        if not label:
+            return None
+        lowered = label.lower()
+        for matches in (lambda value: value == label, lambda value: value.lower() == lowered):
+            found = [index for index, value in enumerate(self.labels) if value and matches(value)]
+            if found:
+                return max(found, key=lambda index: self.clickable[index])
+        return None
+
+    def resolve(self, element='', bounds=''):
+        # Index of the element the model means: exact bounds, then its label,
+        # then whatever is under the centre of the bounds it gave
+        bounds = (bounds or '').replace('Bounds:', '').strip()
+        element = (element or '').strip()
+        candidates = self.by_bounds.get(bounds)
+        if candidates:
+            for index in candidates:
+                if element and self.labels[index] == element:
+                    return index
+            return max(candidates, key=lambda index: (bool(self.labels[index]), self.clickable[index]))
+        index = self.find_label(element)
+        if index is not None:
+            return index
+        coords = parse_bounds_ints(bounds)
+        if coords is not None:
+            return self.at((coords[0] + coords[2]) // 2, (coords[1] + coords[3]) // 2)
+        return None
+
+    def unique_resource_id(self, index):
+        resource_id = self.resource_ids[index]
+        if resource_id and self.resource_ids.count(resource_id) == 1:
+            return resource_id
+        return None
+
+    def unique_desc(self, index):
+        desc = self.descs[index]
+        if desc and self.descs.count(desc) == 1:
+            return desc
+        return None
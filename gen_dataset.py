@@ -7,16 +7,28 @@ from selenium.webdriver.common.actions.action_builder import ActionBuilder
 from selenium.webdriver.common.actions.pointer_input import PointerInput
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-import xml.etree.ElementTree as ET
-from groq import Groq
+from dataset_store import example_prompt
+from device_scheduler import discover_adb_devices, load_devices_from_config
+from llm_backends import ModelError, ModelResponseError, create_backend
+from screen_xml import compress_xml as compress_screen_xml
+import argparse
+import glob
 import json
 import os
+import queue
+import threading
 import time
 import sys
 
-os.environ["GROQ_API_KEY"] = "GROQ_API_KEY"
+# Dataset collection. Scenarios from a JSON file are run as episodes on every
+# connected device in parallel. Each finished episode is appended to a sharded
+# JSONL file in the output directory, so an interrupted run resumes with the
+# episodes that are not there yet:
+#
+#   python gen_dataset.py --scenarios scenarios.json --output dataset/ [--devices devices.json]
+#   python gen_dataset.py --output dataset/ --export youtube_interaction_dataset.json
 
-def setup_appium():
+def setup_appium(device=None):
     options = AppiumOptions()
     options.set_capability('platformName', 'Android')
     options.set_capability('deviceName', 'Pixel 7')
@@ -26,6 +38,15 @@ def setup_appium():
     options.set_capability('appActivity', 'com.google.android.youtube.HomeActivity')
     options.set_capability('noReset', True)
     options.set_capability('newCommandTimeout', 3600)  # Set a long timeout (1 hour)
+    if device is not None:
+        options.set_capability('udid', device.udid)
+        options.set_capability('deviceName', device.name)
+        if device.platform_version:
+            options.set_capability('platformVersion', device.platform_version)
+        if device.system_port:
+            options.set_capability('systemPort', device.system_port)  # must differ between parallel sessions
+        for name, value in device.capabilities.items():
+            options.set_capability(name, value)
     
     driver = webdriver.Remote('http://localhost:4723', options=options)
     return driver
@@ -34,35 +55,10 @@ def capture_screen_xml(driver):
     return driver.page_source
 
 def compress_xml(xml_string):
-    root = ET.fromstring(xml_string)
-    compressed_info = []
-
-    def extract_info(elem):
-        content_desc = elem.attrib.get('content-desc', '').strip()
-        text = elem.attrib.get('text', '').strip()
-        clickable = elem.attrib.get('clickable', 'false')
-        bounds = elem.attrib.get('bounds', '')
-        class_name = elem.attrib.get('class', '').split('.')[-1]
-        
-        if content_desc or (text and clickable == 'true'):
-            info = f"{content_desc or text}|{bounds}|{class_name}"
-            compressed_info.append(info)
-
-        for child in elem:
-            extract_info(child)
-
-    extract_info(root)
-    return '\n'.join(compressed_info)
+    # Dataset screens are stored without the "Bounds:" label
+    return compress_screen_xml(xml_string, bounds_prefix='')
 
-def get_model_prediction(screen_info, command):
-    client = Groq()
-
-    prompt = f"""You are an AI assistant simulating a mobile phone user. Based on the given screen information and user command, provide the next single action to take. Focus on what to do in the current step to achieve the command as soon as possible. Output the action in JSON format without any preamble.
-
-Current task: {command}
-
-Screen information:
-{screen_info}
+DATASET_INSTRUCTIONS = """You are an AI assistant simulating a mobile phone user. Based on the given screen information and user command, provide the next single action to take. Focus on what to do in the current step to achieve the command as soon as possible. Output the action in JSON format without any preamble.
 
 Respond with a single JSON object representing the next action. The action should have the following properties:
 - "action_type": The type of action (e.g., "CLICK", "TYPE", "SCROLL", "WAIT", "GOBACK")
@@ -76,59 +72,34 @@ Respond with a single JSON object representing the next action. The action shoul
 
 Provide only the JSON object as your response, without any additional text."""
 
-    print("\nGenerating AI Prediction...")
+model_backend = None
+model_backend_lock = threading.Lock()
+
+def get_model_backend():
+    # One rate-limited client shared by all device workers
+    global model_backend
+    with model_backend_lock:
+        if model_backend is None:
+            model_backend = create_backend()
+        return model_backend
+
+def get_model_prediction(screen_info, command):
+    # Raises ModelError instead of inventing an action, so a bad step fails
+    # the episode rather than ending up in the dataset
+    prompt = example_prompt(command, screen_info)
+
+    prediction = get_model_backend().complete(DATASET_INSTRUCTIONS, prompt, max_tokens=250, temperature=0.7)
     try:
-        completion = client.chat.completions.create(
-            model="llama-3.1-70b-versatile",
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.7,
-            max_tokens=250,
-            top_p=1,
-            stream=True,
-            stop=None,
-        )
-
-        prediction = ""
-        for chunk in completion:
-            content = chunk.choices[0].delta.content or ""
-            print(content, end="", flush=True)
-            prediction += content
-
-        print("\n")  # New line after streaming completion
-        
-        try:
-            json_prediction = json.loads(prediction)
-            return json.dumps(json_prediction)
-        except json.JSONDecodeError:
-            print("Failed to parse JSON. Raw prediction:")
-            print(prediction)
-            return json.dumps({
-                "action_type": "CLICK",
-                "element": "Search",
-                "description": "Click the Search button (fallback action due to parsing error)",
-                "bounds": "",
-                "step_successful": False,
-                "task_complete": False,
-                "screen_awareness": "Unable to determine screen state due to parsing error"
-            })
-    except Exception as e:
-        print(f"Error in get_model_prediction: {str(e)}")
-        return json.dumps({
-            "action_type": "CLICK",
-            "element": "Search",
-            "description": "Click the Search button (fallback action due to error)",
-            "bounds": "",
-            "step_successful": False,
-            "task_complete": False,
-            "screen_awareness": "Unable to determine screen state due to error"
-        })
+        json_prediction = json.loads(prediction)
+        return json.dumps(json_prediction)
+    except json.JSONDecodeError:
+        print("Failed to parse JSON. Raw prediction:")
+        print(prediction)
+        raise ModelResponseError("Model response is not valid JSON")
 
 def parse_actions(prediction):
+    # Raises ModelResponseError for a prediction that is not an action object,
+    # so the episode fails instead of recording a made-up step
     try:
         action = json.loads(prediction)
         parsed_action = {
@@ -146,26 +117,10 @@ def parse_actions(prediction):
     except json.JSONDecodeError:
         print("Failed to parse JSON. Raw prediction:")
         print(prediction)
-        return [{
-            'action_type': 'CLICK',
-            'element_id': 'Search',
-            'description': 'Click the Search button (fallback action)',
-            'step_successful': False,
-            'task_complete': False,
-            'bounds': '',
-            'screen_awareness': 'Unable to determine screen state due to parsing error'
-        }]
+        raise ModelResponseError("Model response is not valid JSON")
     except Exception as e:
         print(f"Error parsing actions: {str(e)}")
-        return [{
-            'action_type': 'CLICK',
-            'element_id': 'Search',
-            'description': 'Click the Search button (fallback action)',
-            'step_successful': False,
-            'task_complete': False,
-            'bounds': '',
-            'screen_awareness': 'Unable to determine screen state due to error'
-        }]
+        raise ModelResponseError(f"Model response is not a usable action: {str(e)}")
 
 def execute_action(driver, action):
     action_type = action['action_type']
@@ -238,52 +193,220 @@ def keep_session_alive(driver):
     except Exception as e:
         print(f"Error keeping session alive: {str(e)}")
 
-def generate_dataset(num_samples):
-    dataset = []
-    for _ in range(num_samples):
-        scenario = random.choice(SCENARIOS)
-        num_steps = random.randint(3, 7)
-        
-        steps = []
-        pre_step_successful = True  # Initialize as True for the first step
-        
-        for i in range(num_steps):
-            action = random.choice(ACTIONS)
-            element = random.choice(ELEMENTS)
-            
-            step = {
-                "action": action,
-                "element": element,
-                "pre_step_successful": pre_step_successful
+def load_scenarios(path):
+    # [{"command": ..., "repeat": 1, "max_steps": 10, "app_package": ...}, ...];
+    # returns one episode dict per repetition, with a stable id
+    with open(path, 'r', encoding='utf-8') as f:
+        scenarios = json.load(f)
+    episodes = []
+    for index, scenario in enumerate(scenarios):
+        scenario_id = scenario.get('id', f"scenario-{index}")
+        for repetition in range(scenario.get('repeat', 1)):
+            episodes.append(dict(scenario, id=f"{scenario_id}#{repetition}"))
+    return episodes
+
+def read_episodes(output_dir):
+    # Every episode written so far, shard by shard
+    for path in sorted(glob.glob(os.path.join(output_dir, 'episodes-*.jsonl'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # last line of a shard cut short by a crash
+
+
+class EpisodeWriter:
+    # Appends finished episodes to episodes-NNNNN.jsonl shards of at most
+    # shard_size episodes and keeps checkpoint.json (attempts per episode,
+    # collection time) next to them. A new run never appends to an old shard.
+    def __init__(self, output_dir, shard_size=500):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+        self.completed = {episode['id'] for episode in read_episodes(output_dir) if 'id' in episode}
+        self.checkpoint_path = os.path.join(output_dir, 'checkpoint.json')
+        self.checkpoint = {'attempts': {}, 'seconds': 0.0}
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                self.checkpoint = json.load(f)
+        self.shard_index = len(glob.glob(os.path.join(output_dir, 'episodes-*.jsonl')))
+        self.shard = None
+        self.shard_count = 0
+        self.started = time.time()
+        self.written = 0
+        self.failed = 0
+
+    def attempts(self, episode_id):
+        return self.checkpoint['attempts'].get(episode_id, 0)
+
+    def write(self, episode):
+        line = json.dumps(episode, ensure_ascii=False) + '\n'
+        with self.lock:
+            if self.shard is None or self.shard_count >= self.shard_size:
+                if self.shard is not None:
+                    self.shard.close()
+                self.shard = open(os.path.join(self.output_dir, f"episodes-{self.shard_index:05d}.jsonl"),
+                                  'a', encoding='utf-8')
+                self.shard_index += 1
+                self.shard_count = 0
+            self.shard.write(line)
+            self.shard.flush()
+            os.fsync(self.shard.fileno())
+            self.shard_count += 1
+            self.written += 1
+            self.completed.add(episode['id'])
+            self._save_checkpoint()
+
+    def record_failure(self, episode_id):
+        with self.lock:
+            self.checkpoint['attempts'][episode_id] = self.attempts(episode_id) + 1
+            self.failed += 1
+            self._save_checkpoint()
+
+    def _save_checkpoint(self):
+        checkpoint = dict(self.checkpoint, seconds=self.checkpoint['seconds'] + time.time() - self.started,
+                          episodes=len(self.completed), updated_at=time.time())
+        tmp_path = f"{self.checkpoint_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def stats(self):
+        with self.lock:
+            elapsed = time.time() - self.started
+            return {
+                'written': self.written,
+                'failed': self.failed,
+                'total_episodes': len(self.completed),
+                'episodes_per_hour': self.written / elapsed * 3600 if elapsed else 0.0
             }
-            
-            steps.append(step)
-            
-            # Randomly determine if this step was successful for the next iteration
-            pre_step_successful = random.choice([True, False])
-        
-        sample = {
-            "scenario": scenario,
-            "steps": steps
-        }
-        
-        dataset.append(sample)
+
+    def close(self):
+        with self.lock:
+            if self.shard is not None:
+                self.shard.close()
+                self.shard = None
+
+
+def run_episode(driver, scenario, step_delay=2.0):
+    command = scenario['command']
+    max_steps = scenario.get('max_steps', 10)
+    driver.press_keycode(3)  # HOME
+    if scenario.get('app_package'):
+        driver.activate_app(scenario['app_package'])
+    time.sleep(step_delay)
     
-    return dataset
+    steps = []
+    for step_number in range(1, max_steps + 1):
+        screen_info = compress_xml(capture_screen_xml(driver))
+        action = parse_actions(get_model_prediction(screen_info, command))[0]
+        steps.append({'step': step_number, 'task': command, 'screen_info': screen_info, 'action': action})
+        if action['task_complete']:
+            break
+        execute_action(driver, action)
+        time.sleep(step_delay)
+    return steps
+
+def device_worker(device, pending, writer, max_attempts, step_delay):
+    # Runs pending episodes on one device until none are left. The Appium
+    # session is recreated if it dies.
+    driver = None
+    while True:
+        try:
+            scenario = pending.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            if driver is None:
+                driver = setup_appium(device)
+            started = time.time()
+            steps = run_episode(driver, scenario, step_delay)
+            writer.write({
+                'id': scenario['id'],
+                'command': scenario['command'],
+                'device': device.udid if device else None,
+                'completed': bool(steps) and steps[-1]['action']['task_complete'],
+                'started_at': started,
+                'seconds': time.time() - started,
+                'steps': steps
+            })
+            print(f"[{device.udid if device else 'default'}] {scenario['id']} done in {len(steps)} steps")
+        except Exception as e:
+            print(f"[{device.udid if device else 'default'}] {scenario['id']} failed: {str(e)}")
+            writer.record_failure(scenario['id'])
+            if writer.attempts(scenario['id']) < max_attempts:
+                pending.put(scenario)
+            if not isinstance(e, ModelError) and driver is not None:
+                try:
+                    driver.quit()
+                except Exception:
+                    pass
+                driver = None
+    if driver is not None:
+        driver.quit()
+
+def collect_dataset(scenarios, devices, output_dir, shard_size=500, max_attempts=3, step_delay=2.0,
+                    report_interval=60):
+    writer = EpisodeWriter(output_dir, shard_size)
+    pending = queue.Queue()
+    for scenario in scenarios:
+        if scenario['id'] not in writer.completed and writer.attempts(scenario['id']) < max_attempts:
+            pending.put(scenario)
+    print(f"{len(scenarios)} episodes, {len(writer.completed)} already collected, "
+          f"{pending.qsize()} to run on {len(devices)} device(s)")
+    
+    workers = [threading.Thread(target=device_worker, args=(device, pending, writer, max_attempts, step_delay),
+                                daemon=True, name=f"collect-{device.udid if device else 'default'}")
+               for device in devices]
+    for worker in workers:
+        worker.start()
+    try:
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(report_interval / len(workers))
+            stats = writer.stats()
+            print(f"Collected {stats['written']} episodes this run ({stats['total_episodes']} total), "
+                  f"{stats['failed']} failed attempts, {stats['episodes_per_hour']:.1f} episodes/hour")
+    finally:
+        writer.close()
+    return writer.stats()
 
 def save_dataset(dataset, filename):
     with open(filename, 'w') as f:
         json.dump(dataset, f, indent=2)
 
+def export_dataset(output_dir, filename):
+    # The shards as one JSON list, in the format of youtube_interaction_dataset_auto.json
+    dataset = [{'command': episode['command'], 'steps': episode['steps']} for episode in read_episodes(output_dir)]
+    save_dataset(dataset, filename)
+    return dataset
+
+def main():
+    parser = argparse.ArgumentParser(description='Collect interaction episodes on one or more devices')
+    parser.add_argument('--scenarios', help='scenario file (JSON list)')
+    parser.add_argument('--output', default='dataset', help='directory for episode shards and checkpoint')
+    parser.add_argument('--devices', help='device config file; default: every device adb reports')
+    parser.add_argument('--shard-size', type=int, default=500, help='episodes per JSONL shard')
+    parser.add_argument('--max-attempts', type=int, default=3, help='attempts per episode before giving up')
+    parser.add_argument('--step-delay', type=float, default=2.0, help='seconds to wait after each action')
+    parser.add_argument('--export', help='also write all episodes as a single JSON file')
+    args = parser.parse_args()
+
+    if args.scenarios:
+        devices = load_devices_from_config(args.devices) if args.devices else discover_adb_devices()
+        stats = collect_dataset(load_scenarios(args.scenarios), devices or [None], args.output,
+                                shard_size=args.shard_size, max_attempts=args.max_attempts,
+                                step_delay=args.step_delay)
+        print(f"\nCollection finished: {stats}")
+    if args.export:
+        dataset = export_dataset(args.output, args.export)
+        print(f"\nDataset with {len(dataset)} episodes saved to {args.export}")
+
 if __name__ == "__main__":
-    driver = setup_appium()
     try:
-        dataset = generate_dataset(100)  # Example usage with 100 samples
-        save_dataset(dataset, "youtube_interaction_dataset.json")
-        print(f"\nDataset with {len(dataset)} scenarios generated and saved to youtube_interaction_dataset.json")
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
-    finally:
-        driver.quit()
-        print("Exiting the script.")
-        sys.exit(0)
+        main()
+    except KeyboardInterrupt:
+        print("\nInterrupted; run again with the same --output to resume.")
+    sys.exit(0)
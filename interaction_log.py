@@ -0,0 +1,141 @@
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+# Structured interaction log: one JSON record per step, written by a background
+# thread in batches so the step loop never touches the file. The file is
+# rotated by size (optionally gzip-compressed) and read_records() streams the
+# records back, oldest first, for analytics and dataset building.
+
+class InteractionLogWriter:
+    def __init__(self, path='ai_interaction_log.jsonl', batch_size=64, flush_interval=1.0,
+                 max_bytes=50 * 1024 * 1024, backup_count=5, compress=False, max_pending=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.written = 0
+        self.dropped = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True, name='interaction-log')
+        self.thread.start()
+
+    def write(self, record):
+        # Never blocks the caller; records are dropped if the writer falls behind
+        if self.closed:
+            return False
+        record.setdefault('time', time.time())
+        try:
+            self.pending.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = []
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.pending.get(timeout=max(deadline - time.time(), 0.01))
+                except queue.Empty:
+                    break
+                if record is None:
+                    stop = True
+                    break
+                batch.append(record)
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    print(f"Error writing interaction log: {str(e)}")
+
+    def _write_batch(self, batch):
+        lines = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in batch)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+        self.written += len(batch)
+        if self.max_bytes and os.path.getsize(self.path) >= self.max_bytes:
+            self._rotate()
+
+    def _backup_path(self, index):
+        return f"{self.path}.{index}.gz" if self.compress else f"{self.path}.{index}"
+
+    def _rotate(self):
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            return
+        oldest = self._backup_path(self.backup_count)
+        if os.path.exists(oldest):
+            os.remove(oldest)
+        for index in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(self._backup_path(index)):
+                os.replace(self._backup_path(index), self._backup_path(index + 1))
+        if self.compress:
+            with open(self.path, 'rb') as src, gzip.open(self._backup_path(1), 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self._backup_path(1))
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'written': self.written,
+            'pending': self.pending.qsize(),
+            'dropped': self.dropped
+        }
+
+    def close(self, timeout=10):
+        # Flushes everything queued so far
+        if self.closed:
+            return
+        self.closed = True
+        self.pending.put(None)
+        self.thread.join(timeout)
+
+
+def log_files(path):
+    # Rotated files oldest first, then the live file
+    backups = []
+    directory = os.path.dirname(path) or '.'
+    prefix = os.path.basename(path) + '.'
+    for name in os.listdir(directory):
+        if name.startswith(prefix):
+            index = name[len(prefix):].split('.')[0]
+            if index.isdigit():
+                backups.append((int(index), os.path.join(directory, name)))
+    files = [name for _, name in sorted(backups, reverse=True)]
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+def read_records(path='ai_interaction_log.jsonl', session_id=None, command=None, since=None):
+    # Streams records back without loading whole files
+    for name in log_files(path):
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(name, 'rt', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # partially written last line
+                if session_id is not None and record.get('session_id') != session_id:
+                    continue
+                if command is not None and record.get('command') != command:
+                    continue
+                if since is not None and record.get('time', 0) < since:
+                    continue
+                yield record
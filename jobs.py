@@ -0,0 +1,118 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from command_control import cancelled_result
+
+# Background command jobs: the step loop runs on a shared executor, or
+# wherever submit() is told to dispatch it (the server uses the device
+# workers), and publishes per-step events that clients can poll or stream.
+
+class Job:
+    def __init__(self, session_id, command, control=None):
+        self.job_id = str(uuid.uuid4())
+        self.session_id = session_id
+        self.command = command
+        self.control = control
+        self.status = 'queued'
+        self.result = None
+        self.events = []
+        self.created_at = time.time()
+        self.finished_at = None
+        self._cond = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in ('completed', 'failed', 'cancelled')
+
+    def emit(self, event_type, **data):
+        with self._cond:
+            event = {'seq': len(self.events), 'type': event_type, 'time': time.time()}
+            event.update(data)
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def set_status(self, status, result=None):
+        with self._cond:
+            self.status = status
+            if result is not None:
+                self.result = result
+            if self.done:
+                self.finished_at = time.time()
+            self._cond.notify_all()
+
+    def events_since(self, since=0, timeout=None):
+        # Blocks up to `timeout` seconds for events newer than `since`
+        with self._cond:
+            if timeout and len(self.events) <= since and not self.done:
+                self._cond.wait(timeout)
+            return self.events[since:]
+
+    def to_dict(self, since=0):
+        with self._cond:
+            return {
+                'job_id': self.job_id,
+                'session_id': self.session_id,
+                'command': self.command,
+                'command_id': self.control.command_id if self.control is not None else None,
+                'status': self.status,
+                'result': self.result,
+                'events': self.events[since:],
+                'next_seq': len(self.events),
+                'created_at': self.created_at,
+                'finished_at': self.finished_at
+            }
+
+
+class JobManager:
+    def __init__(self, max_workers=8, retention=3600):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='command-job')
+        self.retention = retention
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, session_id, command, runner, dispatch=None, control=None):
+        # runner(job, *args) must return the final result dict for the job.
+        # dispatch(fn) schedules fn(*args) somewhere else than the job executor
+        # and returns its Future. With a control, cancelling it before the
+        # job starts takes the job out of the queue.
+        job = Job(session_id, command, control)
+        with self.lock:
+            self.jobs[job.job_id] = job
+        future = (dispatch or self.executor.submit)(lambda *args: self._run(job, runner, *args))
+        if control is not None:
+            control.future = future
+            future.add_done_callback(lambda future: future.cancelled() and self._finish(
+                job, cancelled_result(control.reason or 'cancelled')))
+        return job
+
+    def _run(self, job, runner, *args):
+        job.set_status('running')
+        job.emit('started', command=job.command)
+        try:
+            result = runner(job, *args)
+        except Exception as e:
+            print(f"Error in job {job.job_id}: {str(e)}")
+            result = {"status": "error", "message": str(e)}
+        self._finish(job, result)
+
+    def _finish(self, job, result):
+        status = {'error': 'failed', 'cancelled': 'cancelled'}.get(result.get('status'), 'completed')
+        job.emit('finished', result=result)
+        job.set_status(status, result)
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cleanup(self):
+        cutoff = time.time() - self.retention
+        with self.lock:
+            for job_id in list(self.jobs.keys()):
+                job = self.jobs[job_id]
+                if job.done and job.finished_at < cutoff:
+                    del self.jobs[job_id]
+
+    def shutdown(self, wait=False):
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,408 @@
+import email.utils
+import os
+import random
+import threading
+import time
+
+# Model backends behind get_model_prediction. Every backend takes the static
+# instructions (system prompt) and the per-step prompt separately, so a local
+# backend can keep the static part evaluated in its KV cache.
+#
+# Failures are raised as ModelError subclasses. create_backend wraps the
+# backend in a LimitedBackend, which retries the retryable ones.
+
+class ModelError(Exception):
+    retryable = False
+
+
+class ModelRateLimitError(ModelError):
+    # 429; retry_after is the server's Retry-After in seconds, if it sent one
+    retryable = True
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ModelUnavailableError(ModelError):
+    # Connection errors, timeouts and 5xx responses
+    retryable = True
+
+
+class ModelRequestError(ModelError):
+    # The request was rejected (bad request, auth, prompt too long); retrying will not help
+    pass
+
+
+class ModelResponseError(ModelError):
+    # The model answered, but not with a usable action
+    pass
+
+
+def retry_after_seconds(headers):
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class ModelBackend:
+    name = 'base'
+
+    def complete(self, system_prompt, user_prompt, max_tokens=250, temperature=0.7):
+        # Returns the completion text
+        raise NotImplementedError
+
+    def stream(self, system_prompt, user_prompt, max_tokens=250, temperature=0.7):
+        # Yields the completion text in chunks; closing the generator stops
+        # generation. Backends without streaming yield it all at once.
+        yield self.complete(system_prompt, user_prompt, max_tokens, temperature)
+
+    def warm(self, system_prompt):
+        pass
+
+    def stats(self):
+        return {'backend': self.name}
+
+
+class GroqBackend(ModelBackend):
+    name = 'groq'
+
+    # One client, and so one HTTP connection pool, shared by every session.
+    # The SDK's own retries are off; LimitedBackend retries instead. The
+    # endpoint can be pointed at a stub server with GROQ_BASE_URL.
+    def __init__(self, model='llama-3.1-70b-versatile', client=None, timeout=30.0, max_connections=8):
+        self.model = model
+        self.client = client
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.client_lock = threading.Lock()
+
+    def get_client(self):
+        with self.client_lock:
+            if self.client is None:
+                import httpx
+                from groq import Groq
+                self.client = Groq(
+                    timeout=self.timeout,
+                    max_retries=0,
+                    http_client=httpx.Client(limits=httpx.Limits(
+                        max_connections=self.max_connections,
+                        max_keepalive_connections=self.max_connections))
+                )
+            return self.client
+
+    def model_error(self, error):
+        # Maps SDK exceptions to ModelError subclasses
+        import groq
+        if isinstance(error, groq.RateLimitError):
+            return ModelRateLimitError(str(error), retry_after_seconds(error.response.headers))
+        if isinstance(error, groq.APIStatusError):
+            if error.status_code >= 500 or error.status_code == 408:
+                return ModelUnavailableError(str(error))
+            return ModelRequestError(str(error))
+        if isinstance(error, groq.APIConnectionError):
+            return ModelUnavailableError(str(error))
+        return ModelError(str(error))
+
+    def create(self, system_prompt, user_prompt, max_tokens, temperature, stream):
+        try:
+            return self.get_client().chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=1,
+                stream=stream
+            )
+        except Exception as e:
+            raise self.model_error(e) from e
+
+    def complete(self, system_prompt, user_prompt, max_tokens=250, temperature=0.7):
+        completion = self.create(system_prompt, user_prompt, max_tokens, temperature, stream=False)
+        return completion.choices[0].message.content
+
+    def stream(self, system_prompt, user_prompt, max_tokens=250, temperature=0.7):
+        chunks = self.create(system_prompt, user_prompt, max_tokens, temperature, stream=True)
+        try:
+            for chunk in chunks:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except Exception as e:
+            raise self.model_error(e) from e
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()  # drops the HTTP response when the caller stops early
+
+
+class LlamaCppBackend(ModelBackend):
+    # Local GGUF model through llama-cpp-python. The model is loaded once per
+    # process and calls are serialized on it. Since every prompt starts with
+    # the same system prompt, llama.cpp's longest-prefix match keeps that part
+    # of the KV cache and only the per-step suffix is evaluated, whichever
+    # session the previous call came from.
+    name = 'llama_cpp'
+
+    def __init__(self, model_path, n_ctx=8192, n_threads=None, n_gpu_layers=0, chat_format=None):
+        from llama_cpp import Llama  # optional dependency, only needed for local inference
+
+        print(f"Loading local model {model_path}...")
+        start = time.time()
+        self.llm = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_threads=n_threads,
+            n_gpu_layers=n_gpu_layers,
+            chat_format=chat_format,
+            verbose=False
+        )
+        print(f"Model loaded in {time.time() - start:.1f}s")
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.prompt_tokens = 0
+
+    def messages(self, system_prompt, user_prompt):
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def warm(self, system_prompt):
+        # Evaluates the static prefix once so the first real step is fast too
+        with self.lock:
+            self.llm.create_chat_completion(messages=self.messages(system_prompt, ''), max_tokens=1)
+
+    def complete(self, system_prompt, user_prompt, max_tokens=250, temperature=0.7):
+        with self.lock:
+            start = time.time()
+            try:
+                completion = self.llm.create_chat_completion(
+                    messages=self.messages(system_prompt, user_prompt),
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    top_p=1
+                )
+            except ValueError as e:  # e.g. prompt longer than the context window
+                raise ModelRequestError(str(e)) from e
+            self.calls += 1
+            self.total_seconds += time.time() - start
+            self.prompt_tokens += completion.get('usage', {}).get('prompt_tokens', 0)
+        return completion['choices'][0]['message']['content']
+
+    def stream(self, system_prompt, user_prompt, max_tokens=250, temperature=0.7):
+        # Holds the model until the generator finishes or is closed
+        with self.lock:
+            start = time.time()
+            try:
+                for chunk in self.llm.create_chat_completion(
+                        messages=self.messages(system_prompt, user_prompt),
+                        max_tokens=max_tokens,
+                        temperature=temperature,
+                        top_p=1,
+                        stream=True):
+                    content = chunk['choices'][0]['delta'].get('content')
+                    if content:
+                        yield content
+            except ValueError as e:
+                raise ModelRequestError(str(e)) from e
+            finally:
+                self.calls += 1
+                self.total_seconds += time.time() - start
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'calls': self.calls,
+            'prompt_tokens': self.prompt_tokens,
+            'mean_seconds': self.total_seconds / self.calls if self.calls else 0.0
+        }
+
+
+class TokenBucket:
+    # rate tokens per second, up to burst saved up. pause() stops handing out
+    # tokens for a while, e.g. for a 429's Retry-After.
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class LimitedBackend(ModelBackend):
+    # Shared limits around a backend: at most max_concurrency calls in flight,
+    # requests_per_minute through a token bucket (0 = unlimited), and retries
+    # of retryable errors with jittered exponential backoff. A 429 with
+    # Retry-After holds back every caller for that long, not just the one
+    # that got it.
+    def __init__(self, backend, max_concurrency=4, requests_per_minute=0, burst=None,
+                 max_retries=3, backoff=0.5, max_backoff=20.0):
+        self.backend = backend
+        self.name = backend.name
+        self.max_concurrency = max_concurrency
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.bucket = TokenBucket(requests_per_minute / 60.0, burst or max(1, requests_per_minute // 10)) \
+            if requests_per_minute else None
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.failures = 0
+
+    def retry_delay(self, error, attempt):
+        if isinstance(error, ModelRateLimitError) and error.retry_after is not None:
+            return error.retry_after + random.uniform(0, self.backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def should_retry(self, error, attempt):
+        # Sleeps before the next attempt; False when the error is final
+        with self.lock:
+            if isinstance(error, ModelRateLimitError):
+                self.rate_limited += 1
+            if not error.retryable or attempt >= self.max_retries:
+                self.failures += 1
+                return False
+            self.retries += 1
+        delay = self.retry_delay(error, attempt)
+        print(f"Model call failed ({str(error)}), retrying in {delay:.1f}s")
+        if isinstance(error, ModelRateLimitError) and self.bucket is not None:
+            self.bucket.pause(delay)
+        time.sleep(delay)
+        return True
+
+    def start(self):
+        if self.bucket is not None:
+            self.bucket.acquire()
+        self.semaphore.acquire()
+        with self.lock:
+            self.in_flight += 1
+            self.requests += 1
+
+    def finish(self):
+        with self.lock:
+            self.in_flight -= 1
+        self.semaphore.release()
+
+    def complete(self, system_prompt, user_prompt, max_tokens=250, temperature=0.7):
+        attempt = 0
+        while True:
+            self.start()
+            try:
+                return self.backend.complete(system_prompt, user_prompt, max_tokens, temperature)
+            except ModelError as e:
+                error = e
+            finally:
+                self.finish()
+            if not self.should_retry(error, attempt):
+                raise error
+            attempt += 1
+
+    def stream(self, system_prompt, user_prompt, max_tokens=250, temperature=0.7):
+        # Retries only until the first chunk; after that the caller has seen output
+        attempt = 0
+        while True:
+            self.start()
+            started = False
+            chunks = self.backend.stream(system_prompt, user_prompt, max_tokens, temperature)
+            try:
+                for chunk in chunks:
+                    started = True
+                    yield chunk
+                return
+            except ModelError as e:
+                if started:
+                    with self.lock:
+                        self.failures += 1
+                    raise
+                error = e
+            finally:
+                chunks.close()
+                self.finish()
+            if not self.should_retry(error, attempt):
+                raise error
+            attempt += 1
+
+    def warm(self, system_prompt):
+        self.backend.warm(system_prompt)
+
+    def stats(self):
+        with self.lock:
+            stats = {
+                'max_concurrency': self.max_concurrency,
+                'in_flight': self.in_flight,
+                'requests': self.requests,
+                'retries': self.retries,
+                'rate_limited': self.rate_limited,
+                'failures': self.failures
+            }
+        return {**self.backend.stats(), **stats}
+
+
+def create_backend(name=None):
+    # MODEL_BACKEND selects the backend: "groq" (default) or "llama_cpp".
+    # MODEL_MAX_CONCURRENCY, MODEL_REQUESTS_PER_MINUTE and MODEL_MAX_RETRIES
+    # set the limits shared by all sessions.
+    backend = create_model_backend(name or os.environ.get('MODEL_BACKEND', 'groq'))
+    return LimitedBackend(
+        backend,
+        max_concurrency=int(os.environ.get('MODEL_MAX_CONCURRENCY', '4')),
+        requests_per_minute=int(os.environ.get('MODEL_REQUESTS_PER_MINUTE', '0')),
+        max_retries=int(os.environ.get('MODEL_MAX_RETRIES', '3'))
+    )
+
+def create_model_backend(name):
+    if name == 'groq':
+        return GroqBackend(
+            model=os.environ.get('GROQ_MODEL', 'llama-3.1-70b-versatile'),
+            timeout=float(os.environ.get('GROQ_TIMEOUT', '30')),
+            max_connections=int(os.environ.get('MODEL_MAX_CONCURRENCY', '4'))
+        )
+    if name == 'llama_cpp':
+        n_threads = os.environ.get('LLAMA_N_THREADS')
+        return LlamaCppBackend(
+            model_path=os.environ['LLAMA_MODEL_PATH'],
+            n_ctx=int(os.environ.get('LLAMA_N_CTX', '8192')),
+            n_threads=int(n_threads) if n_threads else None,
+            n_gpu_layers=int(os.environ.get('LLAMA_N_GPU_LAYERS', '0')),
+            chat_format=os.environ.get('LLAMA_CHAT_FORMAT')
+        )
+    raise ValueError(f"Unknown model backend: {name}")
@@ -0,0 +1,250 @@
+import hashlib
+import heapq
+import json
+import math
+import os
+import re
+import threading
+
+from prediction_cache import normalize_command, normalize_screen
+from screen_diff import split_line
+from trajectory_store import command_slots, template_pattern, to_template
+
+# Navigation graph over app screens. Nodes are screen states (fingerprints of
+# the compressed screen), edges the actions executed on them, counted by the
+# state each one led to. Commands that completed record a goal state: the
+# screen where the command-specific part began (the first step that typed or
+# tapped command text), or the final screen when there was none. A later
+# command matching the same template walks the most reliable shortest path to
+# a goal without the model; the model takes over from there.
+#
+# The graph is persisted as an append-only JSONL log of observations, replayed
+# on load and compacted into per-edge totals when it grows too long.
+
+DIGITS_RE = re.compile(r'\d+')
+MAX_GOALS = 8  # goal states kept per command template
+
+def state_fingerprint(screen_info):
+    # Counters, clocks and durations do not make a new state
+    lines = {DIGITS_RE.sub('#', label) + '|' + class_name
+             for label, _, class_name in map(split_line, normalize_screen(screen_info).splitlines())}
+    return hashlib.sha1('\n'.join(sorted(lines)).encode('utf-8')).hexdigest()[:20]
+
+def action_key(action):
+    bounds = (action.get('bounds') or '').replace('Bounds:', '').strip()
+    return f"{action.get('action_type', '')}|{(action.get('element') or '').strip()}|{bounds}"
+
+def goal_index(command, steps, slots):
+    # Index of the first step that depends on the command's own text
+    for index, step in enumerate(steps):
+        action = step['action']
+        text = (action.get('text') or '').strip().lower()
+        element = (action.get('element') or '').lower()
+        if (action.get('action_type') == 'TYPE' and text) or any(slot in element for slot in slots):
+            return index
+    return len(steps)
+
+
+class Edge:
+    __slots__ = ('action', 'attempts', 'targets', 'target', 'target_count')
+
+    def __init__(self, action):
+        self.action = action
+        self.attempts = 0
+        self.targets = {}  # state -> times the action led there
+        self.target = None  # the most frequent of them
+        self.target_count = 0
+
+    def add(self, state, count=1):
+        self.attempts += count
+        self.targets[state] = self.targets.get(state, 0) + count
+        if self.targets[state] > self.target_count:
+            self.target, self.target_count = state, self.targets[state]
+
+
+class NavigationGraph:
+    def __init__(self, path=None, min_success=0.8, min_attempts=2, compact_ratio=4):
+        self.path = path
+        self.min_success = min_success
+        self.min_attempts = min_attempts
+        self.compact_ratio = compact_ratio
+        self.edges = {}  # state -> {action key: Edge}
+        self.goals = {}  # command template -> {state: count}
+        self.patterns = {}
+        self.lock = threading.Lock()
+        self.log_lines = 0
+        self.log = None
+        if path:
+            self.load()
+
+    def apply(self, record):
+        # Applies one log record; the caller holds the lock
+        if record['t'] in ('edge', 'edge_total'):
+            edge = self.edges.setdefault(record['from'], {}).get(record['key'])
+            if edge is None:
+                edge = self.edges[record['from']][record['key']] = Edge(record['action'])
+            if record['t'] == 'edge':
+                edge.add(record['to'])
+            else:
+                for state, count in record['targets'].items():
+                    edge.add(state, count)
+        elif record['t'] in ('goal', 'goal_total'):
+            template = record['template']
+            goals = self.goals.setdefault(template, {})
+            if template not in self.patterns:
+                self.patterns[template] = template_pattern(template)
+            goals[record['goal']] = goals.get(record['goal'], 0) + record.get('count', 1)
+            if len(goals) > MAX_GOALS:
+                del goals[min(goals, key=goals.get)]
+
+    def append(self, record):
+        # Applies a new observation and logs it; the caller holds the lock
+        self.apply(record)
+        if self.log is not None:
+            self.log.write(json.dumps(record) + '\n')
+            self.log.flush()
+            self.log_lines += 1
+
+    def observe(self, before, action, after):
+        # before/after: compressed screens around an executed action
+        if action.get('action_type') not in ('CLICK', 'TYPE', 'ENTER', 'SCROLL', 'GOBACK'):
+            return
+        stored = {field: action[field] for field in ('action_type', 'element', 'bounds', 'text', 'description')
+                  if action.get(field)}
+        with self.lock:
+            self.append({'t': 'edge', 'from': state_fingerprint(before), 'key': action_key(action),
+                         'action': stored, 'to': state_fingerprint(after)})
+
+    def record_goal(self, command, steps, final_screen):
+        # steps: [{'screen', 'action'}, ...] of a command that completed
+        command = normalize_command(command)
+        slots = command_slots(command, steps)
+        index = goal_index(command, steps, slots)
+        if index == 0:
+            return None  # nothing command-independent to walk
+        goal = state_fingerprint(steps[index]['screen'] if index < len(steps) else final_screen)
+        template = to_template(command, slots)
+        with self.lock:
+            self.append({'t': 'goal', 'template': template, 'goal': goal})
+        return template
+
+    def lookup_goals(self, command):
+        command = normalize_command(command)
+        with self.lock:
+            goals = self.goals.get(command)
+            if goals is not None:
+                return set(goals)
+            for template, pattern in self.patterns.items():
+                if pattern.match(command):
+                    return set(self.goals[template])
+        return set()
+
+    def usable(self, state, edge):
+        # Reliable, observed often enough, changes the screen and carries no typed text
+        if edge.attempts < self.min_attempts or edge.action.get('action_type') == 'TYPE':
+            return None
+        rate = edge.target_count / edge.attempts
+        if rate < self.min_success or edge.target == state:
+            return None
+        return edge.target, rate
+
+    def shortest_path(self, start, goals, max_steps=15):
+        # [(action, expected state)] from start to the nearest goal. Each step
+        # costs 1 - log(success rate), so short reliable paths win.
+        if start in goals:
+            return []
+        with self.lock:
+            best = {start: 0.0}
+            previous = {}
+            heap = [(0.0, 0, start)]
+            while heap:
+                cost, depth, state = heapq.heappop(heap)
+                if state in goals:
+                    path = []
+                    while state != start:
+                        state, action, target = previous[state]
+                        path.append((action, target))
+                    return path[::-1]
+                if cost > best.get(state, math.inf) or depth >= max_steps:
+                    continue
+                for edge in self.edges.get(state, {}).values():
+                    usable = self.usable(state, edge)
+                    if usable is None:
+                        continue
+                    target, rate = usable
+                    next_cost = cost + 1 - math.log(rate)
+                    if next_cost < best.get(target, math.inf):
+                        best[target] = next_cost
+                        previous[target] = (state, edge.action, target)
+                        heapq.heappush(heap, (next_cost, depth + 1, target))
+        return None
+
+    def plan(self, command, screen_info, max_steps=15):
+        # Returns (path, goals) for the command from the given screen; path is
+        # None when no goal is known or reachable
+        goals = self.lookup_goals(command)
+        if not goals:
+            return None, goals
+        return self.shortest_path(state_fingerprint(screen_info), goals, max_steps), goals
+
+    def stats(self):
+        with self.lock:
+            states = set(self.edges)
+            for edges in self.edges.values():
+                for edge in edges.values():
+                    states.update(edge.targets)
+            return {
+                'states': len(states),
+                'edges': sum(len(edges) for edges in self.edges.values()),
+                'templates': len(self.goals),
+                'log_lines': self.log_lines,
+                'persistent': bool(self.path)
+            }
+
+    def load(self):
+        if os.path.exists(self.path):
+            with self.lock, open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self.apply(json.loads(line))
+                    except (json.JSONDecodeError, KeyError, TypeError):
+                        continue  # a torn last line from a crash
+                    self.log_lines += 1
+            print(f"Loaded navigation graph from {self.path}: {self.stats()['edges']} edges")
+        self.log = open(self.path, 'a', encoding='utf-8')
+
+    def snapshot(self):
+        # One total record per edge and goal; the caller holds the lock
+        for state, edges in self.edges.items():
+            for key, edge in edges.items():
+                yield {'t': 'edge_total', 'from': state, 'key': key, 'action': edge.action,
+                       'targets': edge.targets}
+        for template, goals in self.goals.items():
+            for goal, count in goals.items():
+                yield {'t': 'goal_total', 'template': template, 'goal': goal, 'count': count}
+
+    def save(self):
+        # Compacts the log once it is several times longer than the graph
+        if not self.path:
+            return
+        with self.lock:
+            records = sum(len(edges) for edges in self.edges.values()) + sum(map(len, self.goals.values()))
+            if self.log_lines <= self.compact_ratio * records + 1000:
+                return
+            tmp_path = f"{self.path}.tmp"
+            lines = 0
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for record in self.snapshot():
+                    f.write(json.dumps(record) + '\n')
+                    lines += 1
+            self.log.close()
+            os.replace(tmp_path, self.path)
+            self.log = open(self.path, 'a', encoding='utf-8')
+            self.log_lines = lines
+
+    def close(self):
+        self.save()
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# LRU + TTL cache of model predictions keyed on the (command, screen, step)
+# triple, optionally persisted to a JSON file so it survives restarts.
+
+CLOCK_RE = re.compile(r'\b\d{1,2}:\d{2}\b')
+SPACE_RE = re.compile(r'\s+')
+
+def normalize_command(command):
+    return SPACE_RE.sub(' ', (command or '').strip().lower())
+
+def normalize_screen(screen_info):
+    # Clock readings change every minute on otherwise identical screens
+    lines = []
+    for line in (screen_info or '').splitlines():
+        line = SPACE_RE.sub(' ', line.strip())
+        if line:
+            lines.append(CLOCK_RE.sub('#:##', line))
+    return '\n'.join(lines)
+
+def make_key(command, screen_info, step_context=''):
+    raw = '\x00'.join([normalize_command(command), normalize_screen(screen_info), str(step_context)])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def is_cacheable(prediction):
+    if isinstance(prediction, str):
+        try:
+            prediction = json.loads(prediction)
+        except json.JSONDecodeError:
+            return False
+    return isinstance(prediction, dict)
+
+
+class PredictionCache:
+    def __init__(self, maxsize=512, ttl=3600, path=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.entries = OrderedDict()  # key -> (stored_at, prediction)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.dirty = False
+        if path:
+            self.load()
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, prediction = entry
+            if now - stored_at > self.ttl:
+                del self.entries[key]
+                self.dirty = True
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return prediction
+
+    def __contains__(self, key):
+        # Fresh entry present; unlike get() this is not counted as a lookup
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and time.time() - entry[0] <= self.ttl
+
+    def put(self, key, prediction):
+        if not is_cacheable(prediction):
+            return False
+        with self.lock:
+            self.entries[key] = (time.time(), prediction)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            self.dirty = True
+        return True
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.dirty = True
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'persistent': bool(self.path)
+            }
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Could not load prediction cache from {self.path}: {str(e)}")
+            return
+        cutoff = time.time() - self.ttl
+        with self.lock:
+            for key, stored_at, prediction in data.get('entries', []):
+                if stored_at >= cutoff:
+                    self.entries[key] = (stored_at, prediction)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        print(f"Loaded {len(self.entries)} cached predictions from {self.path}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            if not self.dirty:
+                return
+            cutoff = time.time() - self.ttl
+            entries = [[key, stored_at, prediction]
+                       for key, (stored_at, prediction) in self.entries.items()
+                       if stored_at >= cutoff]
+            self.dirty = False
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'entries': entries}, f)
+        os.replace(tmp_path, self.path)
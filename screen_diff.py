@@ -0,0 +1,75 @@
+from collections import OrderedDict
+
+# Delta encoding of compressed screens between consecutive steps. Elements are
+# identified by their bounds and class; a new label at the same position (a
+# text field gaining a value, a toggled button) counts as a change.
+
+def split_line(line):
+    # "label|Bounds:[x1,y1][x2,y2]|Class" -> (label, bounds, class); labels may contain '|'
+    parts = line.rsplit('|', 2)
+    if len(parts) != 3:
+        return line, '', ''
+    label, bounds, class_name = parts
+    return label, bounds.replace('Bounds:', ''), class_name
+
+def index_elements(screen_info):
+    elements = OrderedDict()
+    for line in screen_info.splitlines():
+        if not line:
+            continue
+        _, bounds, class_name = split_line(line)
+        key = (bounds, class_name)
+        occurrence = 0
+        while (key, occurrence) in elements:
+            occurrence += 1
+        elements[(key, occurrence)] = line
+    return elements
+
+def diff_screens(previous, current):
+    prev = index_elements(previous)
+    cur = index_elements(current)
+    added = [line for key, line in cur.items() if key not in prev]
+    removed = [line for key, line in prev.items() if key not in cur]
+    changed = [(prev[key], line) for key, line in cur.items() if key in prev and prev[key] != line]
+    unchanged = [line for key, line in cur.items() if key in prev and prev[key] == line]
+    total = len(prev.keys() | cur.keys())
+    return {
+        'added': added,
+        'removed': removed,
+        'changed': changed,
+        'unchanged': unchanged,
+        'ratio': (len(added) + len(removed) + len(changed)) / total if total else 0.0
+    }
+
+def format_diff(diff):
+    labels = ', '.join(split_line(line)[0] for line in diff['unchanged'])
+    lines = [f"Unchanged since the previous step ({len(diff['unchanged'])} elements): {labels}"]
+    if not (diff['added'] or diff['removed'] or diff['changed']):
+        lines.append("No elements changed since the previous step.")
+    for line in diff['added']:
+        lines.append(f"+ {line}")
+    for line in diff['removed']:
+        lines.append(f"- {line}")
+    for old, new in diff['changed']:
+        lines.append(f"~ {old} -> {new}")
+    return '\n'.join(lines)
+
+def build_screen_context(previous, current, max_ratio=0.5):
+    # Returns (text for the prompt, 'diff' or 'full')
+    if not previous:
+        return current, 'full'
+    diff = diff_screens(previous, current)
+    if diff['ratio'] > max_ratio:
+        return current, 'full'
+    return format_diff(diff), 'diff'
+
+def lookup_bounds(screen_info, element):
+    # Bounds of the first element on screen whose label matches, or ''
+    element = (element or '').strip()
+    if not element:
+        return ''
+    for line in screen_info.splitlines():
+        label, bounds, _ = split_line(line)
+        if label == element:
+            return bounds
+    return ''
@@ -0,0 +1,109 @@
+import re
+
+from element_table import parse_bounds_ints
+from screen_diff import split_line
+
+# Relevance-ranked pruning of a compressed screen to a token budget. Long
+# feeds and settings pages are cut down to the elements most likely to matter
+# for the command: lexical matches first, then interactive elements, then
+# position. Beyond the first few rows of a repeated list layout, rows are
+# dropped unless they match the command. Screens within budget pass through
+# untouched.
+
+WORD_RE = re.compile(r'[a-z0-9]+')
+STOP_WORDS = {'a', 'an', 'and', 'the', 'to', 'on', 'in', 'of', 'for', 'with', 'my', 'me', 'please', 'then'}
+INTERACTIVE_CLASSES = {'Button', 'ImageButton', 'EditText', 'AutoCompleteTextView', 'Switch', 'CheckBox',
+                       'RadioButton', 'ToggleButton', 'SearchView'}
+ROWS_PER_LAYOUT = 3  # repeated list rows kept per layout when they do not match the command
+
+def estimate_tokens(text):
+    # Roughly four characters per token for this kind of text
+    return (len(text) + 3) // 4
+
+def command_terms(command):
+    return {word for word in WORD_RE.findall(command.lower()) if word not in STOP_WORDS}
+
+def word_terms(word, terms):
+    # Command terms a screen word matches; long ones also by prefix ("song" / "songs")
+    return frozenset(term for term in terms if term == word or (
+        len(term) >= 4 and (word.startswith(term) or (len(word) >= 4 and term.startswith(word)))))
+
+def row_layout(class_name, coords):
+    # Rows of one list share class, horizontal extent and height
+    return class_name, coords[0], coords[2], coords[3] - coords[1]
+
+def score_elements(lines, command, table=None):
+    # [(score, index, relevant, layout)] for every element line
+    terms = command_terms(command)
+    parsed = []
+    height = 1
+    for line in lines:
+        label, bounds, class_name = split_line(line)
+        coords = parse_bounds_ints(bounds)
+        parsed.append((label, bounds, class_name, coords))
+        if coords is not None:
+            height = max(height, coords[3])
+    scored = []
+    matches = {}  # word -> matched terms; list rows repeat the same words
+    for index, (label, bounds, class_name, coords) in enumerate(parsed):
+        matched_terms = set()
+        for word in WORD_RE.findall(label.lower()):
+            if word not in matches:
+                matches[word] = word_terms(word, terms)
+            matched_terms |= matches[word]
+        matched = len(matched_terms)
+        score = 4.0 * matched / len(terms) if terms else 0.0
+        clickable = class_name in INTERACTIVE_CLASSES
+        if table is not None and not clickable:
+            clickable = any(table.clickable[i] for i in table.by_bounds.get(bounds, ()))
+        if clickable:
+            score += 1.0
+        if class_name in ('EditText', 'AutoCompleteTextView', 'SearchView'):
+            score += 0.5
+        layout = None
+        if coords is not None:
+            position = (coords[1] + coords[3]) / 2 / height
+            score += 0.5 * (1 - position)
+            if position < 0.1 or position > 0.9:
+                score += 0.3  # toolbars, search bars and bottom navigation
+            layout = row_layout(class_name, coords)
+        scored.append((score, index, matched > 0, layout))
+    return scored
+
+def omitted_hint(omitted):
+    return f"({omitted} more elements omitted)"
+
+def prune_screen(screen_info, command, budget, table=None):
+    # Returns (kept lines in screen order, number of elements omitted)
+    if budget <= 0 or estimate_tokens(screen_info) <= budget:
+        return screen_info, 0
+    lines = [line for line in screen_info.splitlines() if line]
+    scored = score_elements(lines, command, table)
+
+    # Repeated rows beyond the first few of a layout go first, unless relevant
+    layout_rows = {}
+    for _, index, relevant, layout in scored:
+        if layout is not None:
+            layout_rows.setdefault(layout, []).append(index)
+    repeated = set()
+    for rows in layout_rows.values():
+        repeated.update(rows[ROWS_PER_LAYOUT:])
+    seen = set()
+    candidates = []
+    for score, index, relevant, _ in scored:
+        if lines[index] in seen or (index in repeated and not relevant):
+            continue
+        seen.add(lines[index])
+        candidates.append((score, index))
+
+    # Room is left for the omission hint
+    used = estimate_tokens(omitted_hint(len(lines)))
+    kept = []
+    for score, index in sorted(candidates, key=lambda item: (-item[0], item[1])):
+        cost = estimate_tokens(lines[index]) + 1
+        if used + cost > budget:
+            continue
+        used += cost
+        kept.append(index)
+    kept.sort()
+    return '\n'.join(lines[index] for index in kept), len(lines) - len(kept)
@@ -0,0 +1,55 @@
+from lxml import etree
+
+from element_table import ElementTable
+
+# Shared extraction of the compact screen description from an Appium page
+# source. The hierarchy is streamed through an lxml parser target: every node
+# is handled from its start tag and no tree is ever built, so large or deeply
+# nested screens cost neither memory nor Python recursion.
+
+class CompressTarget:
+    # With a table, every described, clickable, focusable or id-carrying
+    # element is also added to it
+    def __init__(self, bounds_prefix='Bounds:', table=None):
+        self.bounds_prefix = bounds_prefix
+        self.lines = []
+        self.table = table
+
+    def start(self, tag, attrib):
+        get = attrib.get
+        desc = get('content-desc', '').strip()
+        label = desc
+        if not label:
+            label = get('text', '').strip()
+            if not label or get('clickable', 'false') != 'true':
+                label = ''
+        if label:
+            self.lines.append(f"{label}|{self.bounds_prefix}{get('bounds', '')}|{get('class', '').split('.')[-1]}")
+        if self.table is not None:
+            clickable = get('clickable', 'false') == 'true'
+            resource_id = get('resource-id', '')
+            if label or clickable or resource_id or get('focusable', 'false') == 'true':
+                self.table.add(get('bounds', ''), label, get('text', '').strip(), desc,
+                               get('class', '').split('.')[-1], resource_id, clickable,
+                               get('focused', 'false') == 'true')
+
+    def end(self, tag):
+        pass
+
+    def close(self):
+        return '\n'.join(self.lines)
+
+def parse_screen(xml_string, target):
+    # Runs the page source through target and returns target.close()
+    if isinstance(xml_string, str):
+        xml_string = xml_string.encode('utf-8')
+    parser = etree.XMLParser(target=target, huge_tree=True)
+    return etree.fromstring(xml_string, parser)
+
+def compress_xml(xml_string, bounds_prefix='Bounds:'):
+    return parse_screen(xml_string, CompressTarget(bounds_prefix))
+
+def compress_screen(xml_string):
+    # (compressed screen, ElementTable) from a single pass over the page source
+    table = ElementTable()
+    return parse_screen(xml_string, CompressTarget(table=table)), table
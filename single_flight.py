@@ -0,0 +1,81 @@
+import threading
+from concurrent.futures import Future
+
+from command_control import CommandCancelled
+
+# Single-flight coalescing of identical model calls. The first caller for a
+# key (the leader) makes the call; callers with the same key that arrive while
+# it is in flight wait for it and get the same result, errors included. Unlike
+# the prediction cache nothing outlives the call, so this only removes
+# duplicate concurrent load, e.g. from sessions on identical devices running
+# the same command side by side.
+
+
+class SingleFlight:
+    def __init__(self):
+        self.flights = {}  # key -> Future of the leader's result
+        self.lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.rejoined = 0
+
+    def do(self, key, call, wait=Future.result, share=None):
+        # call() returns (value, pending). Every caller with the key gets the
+        # value, and later callers keep joining until the pending Future (or
+        # None) has finished. wait(future) is how followers wait; when the
+        # leader's own command is cancelled they start over. share(value) is
+        # called for each follower before it gets the value, e.g. to charge
+        # it for the call it did not have to make.
+        while True:
+            with self.lock:
+                flight = self.flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self.flights[key] = Future()
+                    flight.set_running_or_notify_cancel()  # a follower giving up must not cancel it
+                    self.leaders += 1
+                else:
+                    self.coalesced += 1
+            if leader:
+                return self.lead(key, flight, call)
+            try:
+                value = wait(flight)
+            except CommandCancelled:
+                if not (flight.done() and isinstance(flight.exception(), CommandCancelled)):
+                    raise
+            else:
+                if share is not None:
+                    share(value)
+                return value
+            with self.lock:
+                self.rejoined += 1
+
+    def lead(self, key, flight, call):
+        try:
+            value, pending = call()
+        except BaseException as e:
+            self.land(key, flight)
+            flight.set_exception(e)
+            raise
+        flight.set_result(value)
+        if pending is None:
+            self.land(key, flight)
+        else:
+            pending.add_done_callback(lambda _: self.land(key, flight))
+        return value
+
+    def land(self, key, flight):
+        with self.lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+
+    def stats(self):
+        with self.lock:
+            calls = self.leaders + self.coalesced
+            return {
+                'in_flight': len(self.flights),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'rejoined': self.rejoined,
+                'coalesce_rate': self.coalesced / calls if calls else 0.0
+            }
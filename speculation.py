@@ -0,0 +1,115 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from command_control import CommandCancelled
+from nav_graph import action_key
+from screen_prune import estimate_tokens
+from trajectory_store import screen_fingerprint
+
+# Speculative next-step predictions. The screen an action led to last time is
+# remembered per (screen, action). While the action executes and the UI
+# settles, the next step's prompt is built for that remembered screen and sent
+# to the model. If the real prompt turns out identical, the model's answer is
+# already there (or on its way); otherwise it is thrown away, its stream is
+# stopped and the tokens it used are counted as wasted.
+
+
+class Speculation:
+    __slots__ = ('prompt', 'future', 'stop')
+
+    def __init__(self, prompt, future, stop):
+        self.prompt = prompt
+        self.future = future
+        self.stop = stop  # set when the speculation is dropped
+
+
+class Speculator:
+    def __init__(self, executor, max_transitions=1024):
+        self.executor = executor
+        self.max_transitions = max_transitions
+        self.transitions = OrderedDict()  # (screen fingerprint, action key) -> (screen, element table)
+        self.lock = threading.Lock()
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.wasted_tokens = 0
+
+    def observe(self, before, action, after, table):
+        # before/after: compressed screens around an executed action
+        key = (screen_fingerprint(before), action_key(action))
+        with self.lock:
+            self.transitions[key] = (after, table)
+            self.transitions.move_to_end(key)
+            if len(self.transitions) > self.max_transitions:
+                self.transitions.popitem(last=False)
+
+    def next_screen(self, screen, action):
+        # (screen, element table) the action led to last time, or None
+        key = (screen_fingerprint(screen), action_key(action))
+        with self.lock:
+            predicted = self.transitions.get(key)
+            if predicted is not None:
+                self.transitions.move_to_end(key)
+            return predicted
+
+    def start(self, prompt, predict):
+        # predict(prompt, stop) runs in the background and returns the
+        # prediction; once stop is set it should end the model call and
+        # return what it has so far
+        stop = threading.Event()
+        with self.lock:
+            self.started += 1
+        return Speculation(prompt, self.executor.submit(predict, prompt, stop), stop)
+
+    def resolve(self, speculation, prompt, wait=Future.result):
+        # The speculative prediction if it was made for this exact prompt
+        # (waiting for it with wait(future) if needed), else None after
+        # discarding it. A cancelled command discards it too.
+        if speculation.prompt != prompt:
+            self.discard(speculation)
+            return None
+        try:
+            prediction = wait(speculation.future)
+        except CommandCancelled:
+            self.discard(speculation)
+            raise
+        except Exception as e:
+            print(f"Speculative prediction failed: {str(e)}")
+            with self.lock:
+                self.errors += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return prediction
+
+    def discard(self, speculation):
+        speculation.stop.set()
+        with self.lock:
+            self.misses += 1
+        if speculation.future.cancel():
+            with self.lock:
+                self.cancelled += 1
+            return
+
+        def count_waste(future):
+            if future.exception() is None:
+                with self.lock:
+                    self.wasted_tokens += estimate_tokens(speculation.prompt) + estimate_tokens(future.result())
+        speculation.future.add_done_callback(count_waste)
+
+    def stats(self):
+        with self.lock:
+            resolved = self.hits + self.misses
+            return {
+                'transitions': len(self.transitions),
+                'started': self.started,
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors,
+                'cancelled': self.cancelled,
+                'hit_rate': self.hits / resolved if resolved else 0.0,
+                'wasted_tokens': self.wasted_tokens
+            }
@@ -0,0 +1,71 @@
+from trajectory_store import screen_fingerprint
+
+# Local check of whether an action did anything, from the screens and element
+# tables before and after it. The verdict is handed to the model as a fact
+# instead of asking it to judge the previous step, and taps that obviously did
+# nothing are retried without a model round trip.
+
+TEXT_INPUT_CLASSES = {'EditText', 'AutoCompleteTextView', 'MultiAutoCompleteTextView'}
+# State these toggle (checked, selected) is not part of the compressed screen,
+# and tapping them again would undo a tap that worked
+TOGGLE_CLASSES = {'Switch', 'CheckBox', 'ToggleButton', 'RadioButton', 'CheckedTextView'}
+
+def find_text(table, text):
+    # Index of an element showing the text, text fields first
+    text = text.lower()
+    found = None
+    for index in range(len(table)):
+        if text in table.texts[index].lower() or text in table.labels[index].lower():
+            if table.classes[index] in TEXT_INPUT_CLASSES:
+                return index
+            if found is None:
+                found = index
+    return found
+
+def verify_step(action, before_screen, before_table, after_screen, after_table):
+    # Returns (success, reason). success is None when the screens do not
+    # settle it; reason completes "The previous action succeeded/had no effect: ..."
+    action_type = action.get('action_type')
+    element = (action.get('element') or '').strip()
+    changed = screen_fingerprint(before_screen) != screen_fingerprint(after_screen)
+    if action_type == 'TYPE':
+        text = (action.get('text') or '').strip()
+        index = find_text(after_table, text) if text else None
+        if index is not None:
+            where = 'a text field' if after_table.classes[index] in TEXT_INPUT_CLASSES else 'the screen'
+            return True, f'"{text}" appears in {where}'
+        if not changed:
+            return False, f'the screen did not change and "{text}" does not appear on it'
+        return None, ''
+    if action_type in ('CLICK', 'ENTER'):
+        before = before_table.resolve(element, action.get('bounds'))
+        if before is not None and before_table.classes[before] in TOGGLE_CLASSES:
+            return None, ''
+        if changed:
+            if element and after_table.find_label(element) is None:
+                return True, f'the screen changed and "{element}" is no longer shown'
+            return True, 'the screen changed'
+        name = f'"{element}"' if element else 'the element at ' + (action.get('bounds') or '').strip()
+        after = after_table.resolve(element, action.get('bounds'))
+        if after is not None and after_table.focused[after] and not (before is not None and before_table.focused[before]):
+            return True, f'{name} is now focused'
+        return False, f'the screen did not change after tapping {name}'
+    if action_type == 'SCROLL':
+        if changed:
+            return True, 'the content moved'
+        return False, 'the content did not move, so the end of the list was reached'
+    if action_type == 'GOBACK':
+        return (True, 'the screen changed') if changed else (False, 'the screen did not change')
+    return None, ''
+
+def retry_action(action, table):
+    # The tap to repeat after a no-op CLICK or ENTER, aimed at where its
+    # element is now; None when there is nothing sensible to repeat
+    if action.get('action_type') not in ('CLICK', 'ENTER'):
+        return None
+    index = table.find_label(action.get('element'))
+    if index is None:
+        index = table.resolve('', action.get('bounds'))
+    if index is None or table.classes[index] in TOGGLE_CLASSES:
+        return None
+    return dict(action, bounds=table.get(index)['bounds'])
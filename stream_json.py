@@ -0,0 +1,126 @@
+import json
+
+# Incremental parser for the single JSON object the model streams back. Text
+# is fed chunk by chunk and every top-level field becomes available as soon as
+# its value is complete, long before the closing brace arrives. Anything
+# before the opening brace (preambles, ``` fences) is skipped.
+
+WHITESPACE = ' \t\r\n'
+
+def scan_string(text, start):
+    # Index just past the string starting at text[start] == '"', or None
+    i = start + 1
+    while i < len(text):
+        char = text[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == '"':
+            return i + 1
+        i += 1
+    return None
+
+def scan_value(text, start):
+    # Index just past the JSON value starting at text[start], or None if the
+    # value is not complete yet
+    char = text[start]
+    if char == '"':
+        return scan_string(text, start)
+    if char in '{[':
+        depth = 0
+        i = start
+        while i < len(text):
+            char = text[i]
+            if char == '"':
+                end = scan_string(text, i)
+                if end is None:
+                    return None
+                i = end
+                continue
+            if char in '{[':
+                depth += 1
+            elif char in '}]':
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+            i += 1
+        return None
+    i = start
+    while i < len(text) and text[i] not in ',}' + WHITESPACE:
+        i += 1
+    return i if i < len(text) else None  # a literal is only complete once terminated
+
+
+class IncrementalJSONParser:
+    def __init__(self):
+        self.buffer = ''
+        self.pos = 0
+        self.state = 'start'
+        self.key = None
+        self.fields = {}
+        self.done = False
+        self.complete = False  # closing brace seen
+
+    def feed(self, text):
+        # Returns the fields parsed so far
+        self.buffer += text
+        self.parse()
+        return self.fields
+
+    def skip_whitespace(self):
+        while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+            self.pos += 1
+        return self.pos < len(self.buffer)
+
+    def parse(self):
+        buffer = self.buffer
+        while not self.done:
+            if self.state == 'start':
+                start = buffer.find('{', self.pos)
+                if start < 0:
+                    self.pos = len(buffer)
+                    return
+                self.pos = start + 1
+                self.state = 'key'
+            elif self.state == 'key':
+                if not self.skip_whitespace():
+                    return
+                char = buffer[self.pos]
+                if char == '}':
+                    self.done = self.complete = True
+                    return
+                if char == ',':
+                    self.pos += 1
+                    continue
+                if char != '"':
+                    self.done = True  # not JSON; leave it to the final json.loads
+                    return
+                end = scan_string(buffer, self.pos)
+                if end is None:
+                    return
+                self.key = json.loads(buffer[self.pos:end])
+                self.pos = end
+                self.state = 'colon'
+            elif self.state == 'colon':
+                if not self.skip_whitespace():
+                    return
+                if buffer[self.pos] != ':':
+                    self.done = True
+                    return
+                self.pos += 1
+                self.state = 'value'
+            elif self.state == 'value':
+                if not self.skip_whitespace():
+                    return
+                end = scan_value(buffer, self.pos)
+                if end is None:
+                    return
+                try:
+                    self.fields[self.key] = json.loads(buffer[self.pos:end])
+                except json.JSONDecodeError:
+                    # e.g. False or None: coercing it to a (truthy) string
+                    # could end a command as complete, so parsing stops here
+                    self.done = True
+                    return
+                self.pos = end
+                self.state = 'key'
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from prediction_cache import normalize_command, normalize_screen
+from screen_diff import split_line
+
+# Successful command trajectories, replayed without the model on repeat
+# commands. Every recorded step keeps the screen it ran on and the action
+# taken. A step is replayed only if the current screen still matches: same
+# fingerprint, or the tapped element (label and bounds) is still there.
+#
+# Text typed by the model that also appears in the command becomes a slot, so
+# "play devara song on youtube" is stored as "play {0} on youtube" and also
+# replays "play believer on youtube" with TYPE "believer". Only text with
+# command words on both sides becomes a slot: "open youtube" typing "youtube"
+# stays literal, or it would replay for "open settings" too.
+#
+# At most maxsize trajectories are kept; the least recently recorded or
+# replayed ones are dropped first.
+
+SLOT_RE = re.compile(r'\{(\d+)\}')
+
+def screen_fingerprint(screen_info):
+    return hashlib.sha1(normalize_screen(screen_info).encode('utf-8')).hexdigest()
+
+def find_anchor(screen_info, action):
+    # The screen line of the element the action targets, as (label, bounds)
+    bounds = (action.get('bounds') or '').replace('Bounds:', '').strip()
+    element = (action.get('element') or '').strip()
+    if not bounds:
+        return None
+    for line in screen_info.splitlines():
+        label, line_bounds, _ = split_line(line)
+        if line_bounds == bounds and (not element or label == element):
+            return [label, bounds]
+    return None
+
+def fill_slots(template, values):
+    return SLOT_RE.sub(lambda match: values[int(match.group(1))], template)
+
+def to_template(value, slots):
+    # Replaces every slot value in value with its {i} marker
+    for index, slot in enumerate(slots):
+        value = re.sub(re.escape(slot), f"{{{index}}}", value, flags=re.IGNORECASE)
+    return value
+
+def literal_around(command, text):
+    # Whether text occurs in command with other command text before and after it
+    index = command.find(text)
+    return index >= 0 and bool(command[:index].strip()) and bool(command[index + len(text):].strip())
+
+def command_slots(command, steps):
+    # Text the model typed that also appears inside the (normalized) command
+    slots = []
+    for step in steps:
+        text = (step['action'].get('text') or '').strip().lower()
+        if step['action'].get('action_type') == 'TYPE' and text and literal_around(command, text) \
+                and text not in slots:
+            slots.append(text)
+    return slots
+
+def is_safe_template(template):
+    # Slotted templates must start and end with literal text; "{0}" or
+    # "open {0}" would match unrelated commands
+    parts = SLOT_RE.split(template)
+    return len(parts) == 1 or (bool(parts[0].strip()) and bool(parts[-1].strip()))
+
+def template_pattern(template):
+    parts = SLOT_RE.split(template)
+    pattern = ''.join(re.escape(part) if i % 2 == 0 else '(.+?)' for i, part in enumerate(parts))
+    return re.compile(f"^{pattern}$")
+
+
+class TrajectoryStore:
+    def __init__(self, path=None, max_failures=3, maxsize=1024):
+        self.path = path
+        self.max_failures = max_failures
+        self.maxsize = maxsize
+        self.trajectories = OrderedDict()  # command template -> trajectory, least recently used first
+        self.patterns = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+        if path:
+            self.load()
+
+    def record(self, command, steps, final_screen):
+        # steps: [{'screen': compressed screen, 'action': action dict}, ...]
+        command = normalize_command(command)
+        slots = command_slots(command, steps)
+        template = to_template(command, slots)
+        if not is_safe_template(template):  # one slot value contained another
+            slots, template = [], command
+        recorded = []
+        for step in steps:
+            action = dict(step['action'])
+            anchor = find_anchor(step['screen'], action)
+            for field in ('text', 'element'):
+                if action.get(field):
+                    action[field] = to_template(action[field], slots)
+            if anchor is not None:
+                anchor[0] = to_template(anchor[0], slots)
+            recorded.append({
+                'fingerprint': screen_fingerprint(step['screen']),
+                'anchor': anchor,
+                'action': action
+            })
+        trajectory = {
+            'template': template,
+            'slots': len(slots),
+            'steps': recorded,
+            'final_fingerprint': screen_fingerprint(final_screen),
+            'recorded_at': time.time(),
+            'replays': 0,
+            'failures': 0
+        }
+        with self.lock:
+            existing = self.trajectories.get(template)
+            if existing is not None:
+                trajectory['replays'] = existing['replays']
+            self.trajectories[template] = trajectory
+            self.trajectories.move_to_end(template)
+            self.patterns[template] = template_pattern(template)
+            self._evict()
+            self.dirty = True
+        return template
+
+    def _evict(self):
+        while len(self.trajectories) > self.maxsize:
+            template, _ = self.trajectories.popitem(last=False)
+            del self.patterns[template]
+
+    def lookup(self, command):
+        # Returns (trajectory, slot values) or (None, None)
+        command = normalize_command(command)
+        with self.lock:
+            trajectory = self.trajectories.get(command)
+            if trajectory is not None and trajectory['slots'] == 0:
+                return trajectory, []
+            for template, pattern in self.patterns.items():
+                match = pattern.match(command)
+                if match:
+                    return self.trajectories[template], list(match.groups())
+        return None, None
+
+    def step_matches(self, step, screen_info, values):
+        if step['fingerprint'] == screen_fingerprint(screen_info):
+            return True
+        if step['anchor'] is None:
+            return False
+        label, bounds = step['anchor']
+        label = fill_slots(label, values)
+        for line in screen_info.splitlines():
+            line_label, line_bounds, _ = split_line(line)
+            if line_bounds == bounds and line_label.lower() == label.lower():
+                return True
+        return False
+
+    def step_action(self, step, values):
+        action = dict(step['action'])
+        for field in ('text', 'element'):
+            if action.get(field):
+                action[field] = fill_slots(action[field], values)
+        return action
+
+    def mark(self, template, success):
+        # Trajectories that keep diverging are dropped
+        with self.lock:
+            trajectory = self.trajectories.get(template)
+            if trajectory is None:
+                return
+            self.trajectories.move_to_end(template)
+            trajectory['replays'] += 1
+            if success:
+                trajectory['failures'] = 0
+            else:
+                trajectory['failures'] += 1
+                if trajectory['failures'] >= self.max_failures:
+                    del self.trajectories[template]
+                    del self.patterns[template]
+            self.dirty = True
+
+    def stats(self):
+        with self.lock:
+            return {
+                'trajectories': len(self.trajectories),
+                'maxsize': self.maxsize,
+                'replays': sum(t['replays'] for t in self.trajectories.values()),
+                'persistent': bool(self.path)
+            }
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Could not load trajectories from {self.path}: {str(e)}")
+            return
+        with self.lock:
+            for trajectory in data.get('trajectories', []):
+                if not is_safe_template(trajectory['template']):
+                    continue  # recorded before slots needed literal text around them
+                self.trajectories[trajectory['template']] = trajectory
+                self.patterns[trajectory['template']] = template_pattern(trajectory['template'])
+            self._evict()
+        print(f"Loaded {len(self.trajectories)} trajectories from {self.path}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {'version': 1, 'trajectories': list(self.trajectories.values())}
+            self.dirty = False
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,110 @@
+import re
+import threading
+import time
+import zlib
+
+from screen_xml import compress_xml
+
+# Adaptive wait for the UI to settle after an action. The hierarchy is polled
+# with backoff until its fingerprint stays the same for a number of polls,
+# bounded by a minimum and maximum wait. Observed settle times are tracked per
+# (action type, app) and used to skip most of the polling next time.
+
+PACKAGE_RE = re.compile(r'package="([^"]*)"')
+DIGITS_RE = re.compile(r'\d+')
+
+def fingerprint(xml_string):
+    # Taken over the compressed screen with the numbers in labels blanked
+    # out. Progress bars, clocks and playing video change the raw hierarchy on
+    # every poll, and the screen would otherwise never settle.
+    try:
+        screen = compress_xml(xml_string)
+    except Exception:
+        return zlib.crc32(xml_string.encode('utf-8'))
+    lines = []
+    for line in screen.splitlines():
+        label, separator, rest = line.partition('|')
+        lines.append(DIGITS_RE.sub('#', label) + separator + rest)
+    return zlib.crc32('\n'.join(lines).encode('utf-8'))
+
+def screen_package(xml_string):
+    match = PACKAGE_RE.search(xml_string or '')
+    return match.group(1) if match else ''
+
+
+class SettleTracker:
+    def __init__(self, min_wait=0.2, max_wait=5.0, stable_polls=2, poll_interval=0.15,
+                 backoff=1.5, max_interval=0.6, alpha=0.3, warmup=3):
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.stable_polls = stable_polls
+        self.poll_interval = poll_interval
+        self.backoff = backoff
+        self.max_interval = max_interval
+        self.alpha = alpha
+        self.warmup = warmup
+        self.observed = {}  # (action_type, app) -> {'count', 'ewma', 'max', 'timeouts'}
+        self.lock = threading.Lock()
+
+    def initial_wait(self, action_type, app, max_wait):
+        # Most of the expected settle time is slept blindly; polling covers the rest
+        with self.lock:
+            stats = self.observed.get((action_type, app))
+            if stats is None or stats['count'] < self.warmup:
+                return self.min_wait
+            return min(max(stats['ewma'] * 0.8, self.min_wait), max_wait)
+
+    def record(self, action_type, app, settle_time, timed_out=False):
+        with self.lock:
+            stats = self.observed.setdefault((action_type, app),
+                                             {'count': 0, 'ewma': settle_time, 'max': 0.0, 'timeouts': 0})
+            stats['count'] += 1
+            stats['ewma'] += self.alpha * (settle_time - stats['ewma'])
+            stats['max'] = max(stats['max'], settle_time)
+            if timed_out:
+                stats['timeouts'] += 1
+
+    def wait(self, driver, action_type, app='', max_wait=None, capture=None):
+        # Returns (stable page source, settle seconds). capture defaults to
+        # reading driver.page_source.
+        capture = capture or (lambda: driver.page_source)
+        max_wait = self.max_wait if max_wait is None else max_wait
+        start = time.time()
+        time.sleep(self.initial_wait(action_type, app, max_wait))
+
+        # A change is dated to the start of the capture that saw it. Dating it
+        # after the capture would add the capture time and the blind sleep to
+        # the estimate the next blind sleep is based on, and it would grow.
+        changed_at = time.time() - start
+        xml = capture()
+        last_raw = zlib.crc32(xml.encode('utf-8'))
+        last = fingerprint(xml)
+        stable = 0
+        interval = self.poll_interval
+        timed_out = False
+        while stable < self.stable_polls:
+            if time.time() - start >= max_wait:
+                timed_out = True
+                break
+            time.sleep(interval)
+            interval = min(interval * self.backoff, self.max_interval)
+            captured_at = time.time() - start
+            xml = capture()
+            raw = zlib.crc32(xml.encode('utf-8'))
+            # Compressing is only needed when the raw hierarchy changed
+            current = last if raw == last_raw else fingerprint(xml)
+            last_raw = raw
+            if current == last:
+                stable += 1
+            else:
+                stable = 0
+                last = current
+                changed_at = captured_at
+
+        self.record(action_type, app, changed_at, timed_out)
+        return xml, changed_at
+
+    def stats(self):
+        with self.lock:
+            return [{'action_type': action_type, 'app': app, **stats}
+                    for (action_type, app), stats in self.observed.items()]